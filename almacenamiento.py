@@ -0,0 +1,344 @@
+"""Almacenamiento remoto de los certificados publicados.
+
+Publicación, autocompletado e importador hablan con esta interfaz en lugar de
+usar ftplib directamente. Hay tres implementaciones:
+
+    ftp    FTP plano (el hosting actual)
+    sftp   SFTP con paramiko, escrituras en modo pipelined
+    local  una carpeta del disco; sirve para pruebas y mediciones sin red
+
+Se elige con CERT_ALMACENAMIENTO (por defecto "ftp"). Las rutas son siempre
+las del FTP (FTP_BASE / FTP_VISOR); cada implementación las traduce.
+
+Uso:
+    with abrir_almacenamiento() as almacen:
+        nombres = almacen.listar(FTP_VISOR)
+        almacen.escribir_varios([(ruta, contenido), ...])
+"""
+
+import os
+import posixpath
+import stat
+import tempfile
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from ftplib import FTP, error_perm
+from io import BytesIO
+
+# Bloque de escritura para STOR (el de ftplib, 8 KB, es pequeño para PDFs de cientos de KB).
+FTP_BLOCKSIZE = int(os.environ.get("CERT_FTP_BLOCKSIZE", str(256 * 1024)))
+
+# tamano en bytes; modificado es datetime (UTC) o None si el servidor no lo informa
+InfoArchivo = namedtuple("InfoArchivo", ["tamano", "modificado"])
+
+
+class Almacenamiento(ABC):
+    """Interfaz común. Cada instancia es de un solo hilo; escribir_varios puede paralelizar por dentro."""
+
+    nombre = ""
+
+    @abstractmethod
+    def listar(self, carpeta):
+        """Nombres de archivo (sin ruta) dentro de `carpeta`"""
+
+    @abstractmethod
+    def info(self, ruta):
+        """InfoArchivo de `ruta`, o None si no existe"""
+
+    def listar_info(self, carpeta, extension=""):
+        """
+        {nombre: InfoArchivo} de los archivos de `carpeta` que terminan en
+        `extension` (sin distinguir mayúsculas). Las implementaciones lo sacan
+        del mismo listado; esta versión genérica consulta archivo por archivo.
+        """
+        extension = extension.lower()
+        info = {}
+        for nombre in self.listar(carpeta):
+            if nombre.lower().endswith(extension):
+                datos = self.info(posixpath.join(carpeta, nombre))
+                if datos is not None:
+                    info[nombre] = datos
+        return info
+
+    @abstractmethod
+    def leer(self, ruta):
+        """Contenido de `ruta` en bytes"""
+
+    @abstractmethod
+    def escribir(self, ruta, contenido):
+        """Escribe `contenido` en `ruta` y devuelve su InfoArchivo según el servidor"""
+
+    def escribir_varios(self, archivos):
+        """Escribe [(ruta, contenido), ...]; devuelve los InfoArchivo en el mismo orden"""
+        return [self.escribir(ruta, contenido) for ruta, contenido in archivos]
+
+    def cerrar(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+
+class AlmacenamientoFTP(Almacenamiento):
+    nombre = "ftp"
+
+    def __init__(self, host, puerto, usuario, clave, timeout=45):
+        self.host = host
+        self.puerto = puerto
+        self.usuario = usuario
+        self.clave = clave
+        self.timeout = timeout
+        self._ftp = None
+
+    def _conectar(self):
+        ftp = FTP()
+        ftp.connect(self.host, self.puerto, timeout=self.timeout)
+        ftp.login(user=self.usuario, passwd=self.clave)
+        return ftp
+
+    @property
+    def ftp(self):
+        if self._ftp is None:
+            self._ftp = self._conectar()
+        return self._ftp
+
+    def listar(self, carpeta):
+        actual = self.ftp.pwd()
+        try:
+            self.ftp.cwd(carpeta)
+            return [posixpath.basename(nombre) for nombre in self.ftp.nlst()]
+        finally:
+            self.ftp.cwd(actual)
+
+    def listar_info(self, carpeta, extension=""):
+        # MLSD trae tamaño y fecha de todos en una sola transferencia; si el
+        # servidor no lo soporta se cae a SIZE/MDTM por archivo.
+        try:
+            entradas = list(self.ftp.mlsd(carpeta, facts=["type", "size", "modify"]))
+        except error_perm:
+            return super().listar_info(carpeta, extension)
+
+        extension = extension.lower()
+        info = {}
+        for nombre, hechos in entradas:
+            nombre = posixpath.basename(nombre)
+            if hechos.get("type", "file") != "file" or not nombre.lower().endswith(extension):
+                continue
+            info[nombre] = InfoArchivo(
+                int(hechos["size"]) if "size" in hechos else None,
+                _fecha_ftp(hechos.get("modify")),
+            )
+        return info
+
+    @staticmethod
+    def _info(ftp, ruta):
+        ftp.voidcmd("TYPE I")  # SIZE no es confiable en modo ASCII
+        try:
+            tamano = ftp.size(ruta)
+        except error_perm:
+            return None
+
+        modificado = None
+        try:
+            modificado = _fecha_ftp(ftp.sendcmd(f"MDTM {ruta}")[4:])
+        except error_perm:
+            pass
+        return InfoArchivo(tamano, modificado)
+
+    def info(self, ruta):
+        return self._info(self.ftp, ruta)
+
+    def leer(self, ruta):
+        buffer = BytesIO()
+        self.ftp.retrbinary(f"RETR {ruta}", buffer.write)
+        return buffer.getvalue()
+
+    def _escribir_en(self, ftp, ruta, contenido):
+        ftp.storbinary(f"STOR {ruta}", BytesIO(contenido), blocksize=FTP_BLOCKSIZE)
+        return self._info(ftp, ruta)
+
+    def escribir(self, ruta, contenido):
+        return self._escribir_en(self.ftp, ruta, contenido)
+
+    def escribir_varios(self, archivos):
+        if len(archivos) < 2:
+            return super().escribir_varios(archivos)
+
+        def subir(ruta, contenido):
+            # Una conexión por archivo: cada control FTP admite una sola transferencia a la vez
+            ftp = self._conectar()
+            try:
+                return self._escribir_en(ftp, ruta, contenido)
+            finally:
+                _cerrar_ftp(ftp)
+
+        with ThreadPoolExecutor(max_workers=len(archivos)) as pool:
+            futuros = [pool.submit(subir, ruta, contenido) for ruta, contenido in archivos]
+            # result() relanza el primer error de subida
+            return [futuro.result() for futuro in futuros]
+
+    def cerrar(self):
+        if self._ftp is not None:
+            _cerrar_ftp(self._ftp)
+            self._ftp = None
+
+
+def _fecha_ftp(valor):
+    """YYYYMMDDHHMMSS[.sss] de MDTM/MLSD (UTC) a datetime, o None"""
+    try:
+        return datetime.strptime((valor or "").strip()[:14], "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+
+
+def _cerrar_ftp(ftp):
+    try:
+        ftp.quit()
+    except Exception:
+        ftp.close()
+
+
+class AlmacenamientoSFTP(Almacenamiento):
+    nombre = "sftp"
+
+    def __init__(self, host, puerto, usuario, clave, raiz="", timeout=45):
+        try:
+            import paramiko
+        except ImportError as exc:
+            raise RuntimeError("paramiko no está instalado; es necesario para SFTP") from exc
+
+        self._transporte = paramiko.Transport((host, puerto))
+        self._transporte.banner_timeout = timeout
+        self._transporte.connect(username=usuario, password=clave)
+        self._sftp = paramiko.SFTPClient.from_transport(self._transporte)
+        self._sftp.get_channel().settimeout(timeout)
+        self.raiz = raiz.rstrip("/")
+
+    def _ruta(self, ruta):
+        # Las rutas del FTP son relativas a la cuenta; en SFTP pueden colgar de otra raíz
+        return f"{self.raiz}/{ruta.lstrip('/')}" if self.raiz else ruta
+
+    def listar(self, carpeta):
+        return self._sftp.listdir(self._ruta(carpeta))
+
+    def info(self, ruta):
+        try:
+            atributos = self._sftp.stat(self._ruta(ruta))
+        except FileNotFoundError:
+            return None
+        modificado = datetime.utcfromtimestamp(atributos.st_mtime) if atributos.st_mtime else None
+        return InfoArchivo(atributos.st_size, modificado)
+
+    def listar_info(self, carpeta, extension=""):
+        extension = extension.lower()
+        return {
+            atributos.filename: InfoArchivo(
+                atributos.st_size,
+                datetime.utcfromtimestamp(atributos.st_mtime) if atributos.st_mtime else None,
+            )
+            for atributos in self._sftp.listdir_attr(self._ruta(carpeta))
+            if stat.S_ISREG(atributos.st_mode or 0) and atributos.filename.lower().endswith(extension)
+        }
+
+    def leer(self, ruta):
+        with self._sftp.open(self._ruta(ruta), "rb") as handle:
+            handle.prefetch()
+            return handle.read()
+
+    def escribir(self, ruta, contenido):
+        with self._sftp.open(self._ruta(ruta), "wb") as handle:
+            # Sin esperar el ACK de cada bloque; los errores llegan al cerrar
+            handle.set_pipelined(True)
+            handle.write(contenido)
+        return self.info(ruta)
+
+    def cerrar(self):
+        self._sftp.close()
+        self._transporte.close()
+
+
+class AlmacenamientoLocal(Almacenamiento):
+    nombre = "local"
+
+    def __init__(self, raiz):
+        self.raiz = os.path.abspath(raiz)
+        os.makedirs(self.raiz, exist_ok=True)
+
+    def _ruta(self, ruta):
+        completa = os.path.abspath(os.path.join(self.raiz, ruta.lstrip("/")))
+        if os.path.commonpath([completa, self.raiz]) != self.raiz:
+            raise ValueError(f"Ruta fuera del almacenamiento: {ruta}")
+        return completa
+
+    def listar(self, carpeta):
+        carpeta = self._ruta(carpeta)
+        if not os.path.isdir(carpeta):
+            return []
+        return [n for n in os.listdir(carpeta) if os.path.isfile(os.path.join(carpeta, n))]
+
+    def listar_info(self, carpeta, extension=""):
+        carpeta = self._ruta(carpeta)
+        if not os.path.isdir(carpeta):
+            return {}
+        extension = extension.lower()
+        info = {}
+        with os.scandir(carpeta) as entradas:
+            for entrada in entradas:
+                if entrada.is_file() and entrada.name.lower().endswith(extension):
+                    estado = entrada.stat()
+                    info[entrada.name] = InfoArchivo(estado.st_size, datetime.utcfromtimestamp(estado.st_mtime))
+        return info
+
+    def info(self, ruta):
+        try:
+            estado = os.stat(self._ruta(ruta))
+        except FileNotFoundError:
+            return None
+        return InfoArchivo(estado.st_size, datetime.utcfromtimestamp(estado.st_mtime))
+
+    def leer(self, ruta):
+        with open(self._ruta(ruta), "rb") as handle:
+            return handle.read()
+
+    def escribir(self, ruta, contenido):
+        destino = self._ruta(ruta)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        # Escribir aparte y reemplazar: un lector nunca ve el archivo a medias
+        descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(destino), prefix=".subiendo_")
+        try:
+            with os.fdopen(descriptor, "wb") as handle:
+                handle.write(contenido)
+            os.chmod(temporal, 0o644)  # mkstemp crea con 0600; la carpeta puede servirse por web
+            os.replace(temporal, destino)
+        except Exception:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        return self.info(ruta)
+
+
+def abrir_almacenamiento(tipo=None):
+    """Crea el almacenamiento configurado (CERT_ALMACENAMIENTO o `tipo`)"""
+    import ftp_config
+
+    tipo = (tipo or ftp_config.ALMACENAMIENTO).lower()
+    if tipo == "ftp":
+        return AlmacenamientoFTP(
+            ftp_config.FTP_HOST, ftp_config.FTP_PORT, ftp_config.FTP_USER, ftp_config.FTP_PASS
+        )
+    if tipo == "sftp":
+        return AlmacenamientoSFTP(
+            ftp_config.SFTP_HOST,
+            ftp_config.SFTP_PORT,
+            ftp_config.FTP_USER,
+            ftp_config.FTP_PASS,
+            raiz=ftp_config.SFTP_RAIZ,
+        )
+    if tipo == "local":
+        return AlmacenamientoLocal(ftp_config.ALMACENAMIENTO_DIR)
+    raise ValueError(f"Almacenamiento desconocido: {tipo} (use ftp, sftp o local)")
@@ -1,14 +1,13 @@
+import hashlib
+import json
 import os
-import random
 import re
 import tempfile
-from datetime import datetime
-from ftplib import FTP
-from io import BytesIO
+import unicodedata
+from datetime import date, datetime, timedelta
 from pathlib import Path
 from urllib.parse import quote
 
-import qrcode
 from flask import Flask, jsonify, render_template, request, send_file, send_from_directory, url_for
 from flask_login import (
     LoginManager,
@@ -20,13 +19,29 @@ from flask_login import (
 from dotenv import load_dotenv
 from jinja2 import Environment, FileSystemLoader
 from PIL import Image
-from pypdf import PdfReader, PdfWriter
+from pypdf import PdfReader
 from pypdf.generic import NameObject, NumberObject
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfgen import canvas
+from sqlalchemy.exc import IntegrityError
 
+from almacenamiento import abrir_almacenamiento
 from auth import auth
-from models import GenerationAudit, Party, User, VehicleProfile, db
+from bloqueos import bloqueo_certificado, nueva_secuencia
+from certificado_pdf import huella_datos, llenar_certificado, nombre_archivo_certificado, normalizar_placa
+from cola_publicacion import encolar_publicacion, iniciar_trabajadores, notificar
+import espejo_pdf
+from models import (
+    BatchJob,
+    CertificateRecord,
+    GenerationAudit,
+    Party,
+    PublishedArtifact,
+    User,
+    VehicleProfile,
+    db,
+)
+from migraciones import aplicar_migraciones
+from renovaciones import buscar_borrador, iniciar_preparacion_borradores
+from sincronizacion import estado_sincronizacion, iniciar_sincronizacion
 
 load_dotenv()
 print("DATABASE_URL =", os.getenv("DATABASE_URL"))
@@ -69,18 +84,47 @@ with app.app_context():
     except Exception as exc:
         print("WARN: no se pudieron crear tablas automáticamente:", exc)
 
-env = Environment(loader=FileSystemLoader("templates"), autoescape=False)
+    try:
+        aplicar_migraciones()
+    except Exception as exc:
+        print("WARN: no se pudieron aplicar migraciones:", exc)
 
-Path("build").mkdir(exist_ok=True)
+# Las plantillas compiladas quedan en memoria; sin auto_reload no se revisa el
+# archivo en cada render (reiniciar el proceso para tomar cambios).
+env = Environment(loader=FileSystemLoader("templates"), autoescape=False, auto_reload=False)
 
 os.makedirs("generados", exist_ok=True)
 os.makedirs("instance", exist_ok=True)
 
 CERTIFICATE_SUFFIXES = ["remo5", "remo4", "remo3", "remo2", "remo", ""]
 
+# Envíos idénticos del mismo usuario dentro de esta ventana devuelven el primer resultado.
+VENTANA_DUPLICADOS_SEGUNDOS = int(os.environ.get("CERT_VENTANA_DUPLICADOS", "60"))
+# Una generación "processing" más vieja que esto se considera abandonada (no bloquea reenvíos).
+VIGENCIA_EN_CURSO_SEGUNDOS = 120
+
+# /generar responde al tener el PDF; la subida al FTP la hacen hilos de fondo.
+PUBLICACION_ASINCRONA = os.environ.get("CERT_PUBLICACION_ASINCRONA", "1") == "1"
+
+# Las páginas se suben desde memoria; con esto se deja además una copia en build/
+# (para depurar o archivar).
+COPIAS_LOCALES = os.environ.get("CERT_COPIAS_LOCALES", "0") == "1"
+if COPIAS_LOCALES:
+    Path("build").mkdir(exist_ok=True)
+
+
+@app.before_request
+def arrancar_trabajadores_publicacion():
+    # Se arrancan con la primera petición y no al importar app.py, para que
+    # los scripts de consola (init_db, lotes, ...) no consuman la cola.
+    if PUBLICACION_ASINCRONA:
+        iniciar_trabajadores(app)
+    iniciar_preparacion_borradores(app)
+    iniciar_sincronizacion(app)
+
+    from lotes import revisar_lotes_interrumpidos
 
-def normalizar_placa(placa):
-    return (placa or "").strip().upper().replace(" ", "")
+    revisar_lotes_interrumpidos(app)
 
 
 def guardar_perfil_autocompletado(datos):
@@ -132,6 +176,76 @@ def guardar_perfil_autocompletado(datos):
     vehicle.tipo_transporte = (
         (datos.get("tipo_transporte", "") or "").strip() or vehicle.tipo_transporte
     )
+    vehicle.clase_vehiculo = (
+        (datos.get("clase_vehiculo", "") or "").strip() or vehicle.clase_vehiculo
+    )
+    vehicle.sistema_refrigeracion = (
+        (datos.get("sistema_refrigeracion", "") or "").strip()
+        or vehicle.sistema_refrigeracion
+    )
+    vehicle.codigo_verificacion = (
+        (datos.get("codigo_verificacion", "") or "").strip()
+        or vehicle.codigo_verificacion
+    )
+    vehicle.last_certificate_type = (
+        (datos.get("tipo_certificado", "") or "").strip() or vehicle.last_certificate_type
+    )
+    vehicle.last_certificate_key = nombre_archivo_certificado(datos)
+    vehicle.last_imported_at = datetime.utcnow()
+    return vehicle
+
+
+def guardar_registro_certificado(datos, ruta_pdf, detalles=None):
+    """
+    Crea o actualiza el CertificateRecord de un certificado recién generado
+    (junto con el perfil del vehículo), con la misma forma que deja el
+    importador, para que quede consultable sin esperar otra importación.
+    No confirma: va en la transacción del llamador.
+
+    Args:
+        datos: Datos del formulario
+        ruta_pdf: PDF generado en generados/
+        detalles: numero_acta y numero_inspeccion que devolvió generar_certificado
+    """
+    detalles = detalles or {}
+    vehicle = guardar_perfil_autocompletado(datos)
+    if vehicle is None:
+        return None
+
+    certificate_key = nombre_archivo_certificado(datos)
+    nombres = urls_publicacion(datos)
+
+    record = CertificateRecord.query.filter_by(certificate_key=certificate_key).first()
+    if record is None:
+        record = CertificateRecord(certificate_key=certificate_key)
+        db.session.add(record)
+
+    parsed = {clave: valor for clave, valor in datos.items() if clave not in ("placa_archivos", "es_trailer")}
+    parsed["acta_number"] = detalles.get("numero_acta", "")
+    parsed["inspection_number"] = detalles.get("numero_inspeccion", "")
+
+    # La placa de la clave (nombre_archivo_certificado), tal cual: regenerar_sitio
+    # y las renovaciones rearman la clave y los nombres remotos desde esta columna
+    record.plate = datos["placa"]
+    record.certificate_type = datos.get("tipo_certificado", "nuevo")
+    record.pdf_filename = nombres["pdf_filename"]
+    record.viewer_html_filename = nombres["viewer_filename"]
+    record.index_html_filename = nombres["index_filename"]
+    record.vehicle = vehicle
+    record.party = vehicle.owner
+    record.asignar_fechas(datos.get("fecha_inspeccion"), datos.get("fecha_vencimiento"))
+    record.acta_number = parsed["acta_number"] or record.acta_number
+    record.inspection_number = parsed["inspection_number"] or record.inspection_number
+    record.extracted_json = json.dumps(
+        {"parsed": parsed, "local_pdf": os.path.basename(ruta_pdf) if ruta_pdf else None},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    record.payload = None  # el texto de un PDF importado antes ya no corresponde
+    record.source_status = "generated"
+    record.parse_notes = None
+    record.imported_at = datetime.utcnow()
+    return record
 
 
 @app.route("/_debug/autocompletar/placa/<placa>", methods=["GET"])
@@ -151,20 +265,6 @@ def debug_autocompletar_por_placa(placa):
         return jsonify({"ok": False, "message": f"No se encontró certificado remoto para la placa {placa_norm}."})
 
     return jsonify({"ok": True, "data": payload["data"], "index_url": payload.get("index_url"), "viewer_url": payload.get("viewer_url"), "remote_pdf_url": payload.get("remote_pdf_url"), "certificate_key": payload.get("certificate_key")})
-    vehicle.clase_vehiculo = (
-        (datos.get("clase_vehiculo", "") or "").strip() or vehicle.clase_vehiculo
-    )
-    vehicle.sistema_refrigeracion = (
-        (datos.get("sistema_refrigeracion", "") or "").strip()
-        or vehicle.sistema_refrigeracion
-    )
-    vehicle.codigo_verificacion = (
-        (datos.get("codigo_verificacion", "") or "").strip()
-        or vehicle.codigo_verificacion
-    )
-    vehicle.last_certificate_type = (
-        (datos.get("tipo_certificado", "") or "").strip() or vehicle.last_certificate_type
-    )
 
 
 def serializar_autocompletado(vehicle):
@@ -585,27 +685,20 @@ def _parse_autocomplete_pdf(pdf_path):
     return data
 
 
-def _list_remote_files(ftp, remote_path):
-    current_dir = ftp.pwd()
-    try:
-        ftp.cwd(remote_path)
-        return ftp.nlst()
-    finally:
-        ftp.cwd(current_dir)
-
-
 def buscar_autocompletado_en_ftp(placa_norm):
-    from ftp_config import FTP_BASE, FTP_HOST, FTP_PASS, FTP_USER, FTP_VISOR
+    from ftp_config import FTP_BASE, FTP_VISOR
 
     base_publica = "https://itaguigov-com.us.stackstaging.com"
     carpeta_visor = quote("___ Busqueda de certificados electronicos __._files")
 
-    ftp = FTP(FTP_HOST, timeout=45)
-    ftp.login(user=FTP_USER, passwd=FTP_PASS)
+    try:
+        almacen = abrir_almacenamiento()
+    except Exception as exc:
+        return None, str(exc)
 
     try:
-        root_files = set(_list_remote_files(ftp, FTP_BASE))
-        visor_files = set(_list_remote_files(ftp, FTP_VISOR))
+        root_files = set(almacen.listar(FTP_BASE))
+        visor_files = set(almacen.listar(FTP_VISOR))
 
         selected = None
         for suffix in CERTIFICATE_SUFFIXES:
@@ -642,7 +735,7 @@ def buscar_autocompletado_en_ftp(placa_norm):
         try:
             with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
                 temp_path = temp_file.name
-                ftp.retrbinary(f"RETR {remote_pdf_path}", temp_file.write)
+                temp_file.write(espejo_pdf.leer(almacen, remote_pdf_path))
 
             parsed = _parse_autocomplete_pdf(temp_path)
             parsed["placa"] = parsed.get("placa") or placa_norm
@@ -662,368 +755,205 @@ def buscar_autocompletado_en_ftp(placa_norm):
     except Exception as exc:
         return None, str(exc)
     finally:
-        ftp.quit()
-
-
-def dividir_tipo_transporte(texto, palabras_linea1=3):
-    """Divide el tipo de transporte en dos líneas - Página 1"""
-    if not texto:
-        return {"tipodetransporte_1": "", "tipodetransporte_2": ""}
-
-    palabras = texto.split()
-
-    if len(palabras) <= palabras_linea1:
-        return {"tipodetransporte_1": texto, "tipodetransporte_2": ""}
-
-    return {
-        "tipodetransporte_1": " ".join(palabras[:palabras_linea1]),
-        "tipodetransporte_2": " ".join(palabras[palabras_linea1:]),
-    }
-
-
-def cm_to_points(cm):
-    """Convierte centímetros a puntos (1 cm = 28.3465 puntos)"""
-    return cm * 28.3465
-
-
-def generar_numero_acta(fecha_inspeccion, placa):
-    """
-    Genera número de acta en formato YYYYMMDDPLACA
-    Ejemplo: 20260120PRY576
-    """
-    try:
-        fecha_obj = datetime.strptime(fecha_inspeccion, "%Y-%m-%d")
-        fecha_formateada = fecha_obj.strftime("%Y%m%d")
-        return f"{fecha_formateada}{placa}"
-    except:
-        return f"{placa}"
-
-
-def generar_numero_inspeccion(placa):
-    """
-    Genera número de inspección con 5 dígitos aleatorios + PLACA
-    Ejemplo: 16560PRY576
-    """
-    aleatorio = random.randint(10000, 99999)
-    return f"{aleatorio}{placa}"
+        almacen.cerrar()
 
 
-def convertir_fecha_formato_acta(fecha_inspeccion):
-    """
-    Convierte fecha de YYYY-MM-DD a DD/MM/YYYY
-    Ejemplo: 2026-01-20 → 20/01/2026
-    """
-    try:
-        fecha_obj = datetime.strptime(fecha_inspeccion, "%Y-%m-%d")
-        return fecha_obj.strftime("%d/%m/%Y")
-    except:
-        return fecha_inspeccion
-
+def huella_contenido(contenido):
+    """SHA-256 de un artefacto publicado (bytes)"""
+    return hashlib.sha256(contenido).hexdigest()
 
-def convertir_fecha_formato_firma(fecha_inspeccion):
-    """
-    Convierte fecha para el formato de firma en página 4
-    Retorna: {'dia': '20', 'mes': 'ENERO', 'anio': '2026'}
-    """
-    try:
-        fecha_obj = datetime.strptime(fecha_inspeccion, "%Y-%m-%d")
-
-        meses = {
-            1: "ENERO",
-            2: "FEBRERO",
-            3: "MARZO",
-            4: "ABRIL",
-            5: "MAYO",
-            6: "JUNIO",
-            7: "JULIO",
-            8: "AGOSTO",
-            9: "SEPTIEMBRE",
-            10: "OCTUBRE",
-            11: "NOVIEMBRE",
-            12: "DICIEMBRE",
-        }
 
-        return {
-            "dia": str(fecha_obj.day),
-            "mes": meses[fecha_obj.month],
-            "anio": str(fecha_obj.year),
-        }
-    except:
-        return {"dia": "", "mes": "", "anio": ""}
+_recursos_web = {}
 
 
-def generar_link_certificado(placa, tipo_certificado):
+def recursos_web():
     """
-    Genera el link de verificación del certificado
+    Recursos compartidos de las páginas publicadas (plantilla/web).
 
-    Args:
-        placa: Placa del vehículo (ej: PRY576)
-        tipo_certificado: nuevo, remo, remo2, remo3, remo4, remo5
+    El nombre remoto lleva la huella del contenido (certificado.<huella>.js),
+    así el navegador puede guardarlo indefinidamente y un cambio publica un
+    archivo nuevo en lugar de pisar el que está en caché.
 
     Returns:
-        URL completa del certificado
+        dict nombre original -> (nombre remoto, contenido)
     """
-    base_url = "https://itaguigov-com.us.stackstaging.com/index"
-
-    if tipo_certificado == "nuevo":
-        return f"{base_url}{placa}.html"
-    else:
-        return f"{base_url}{placa}{tipo_certificado}.html"
-
-
-def generar_qr_code(link):
-    """
-    Genera un código QR a partir del link
+    if not _recursos_web:
+        for ruta in sorted(Path("plantilla/web").iterdir()):
+            contenido = ruta.read_bytes()
+            nombre = f"{ruta.stem}.{huella_contenido(contenido)[:12]}{ruta.suffix}"
+            _recursos_web[ruta.name] = (nombre, contenido)
+    return _recursos_web
+
+
+def compactar_html(html):
+    """Quita la sangría y las líneas vacías (las páginas publicadas no tienen <pre>)"""
+    return "\n".join(linea.strip() for linea in html.splitlines() if linea.strip()) + "\n"
+
+
+def generar_certificado(
+    datos,
+    linealizar=None,
+    optimizar=None,
+    determinista=None,
+    publicar=True,
+    secuencia=None,
+    detalles=None,
+):
+    """Genera el certificado PDF con los datos proporcionados
+
+    Toma el bloqueo de la clave del certificado (placa + tipo) mientras escribe
+    generados/<clave>.pdf (llenar_certificado) y, si corresponde, mientras
+    publica.
 
     Args:
-        link: URL completa del certificado
-
-    Returns:
-        PIL Image del código QR
+        datos: Datos del formulario
+        linealizar: True/False para forzar la salida linealizada; None usa
+            CERT_LINEALIZAR_PDF
+        optimizar: True/False para forzar la optimización de tamaño; None usa
+            CERT_OPTIMIZAR_PDF
+        determinista: True/False para forzar la salida reproducible; None usa
+            CERT_SALIDA_DETERMINISTA
+        publicar: False deja el PDF en generados/ sin subirlo (la publicación
+            queda a cargo del llamador, p. ej. los lotes)
+        secuencia: Orden de la petición (nueva_secuencia()); si ya se generó
+            una más reciente de la misma clave, esta no la pisa
+        detalles: dict opcional que se llena con los campos calculados
+            (numero_acta, numero_inspeccion)
     """
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(link)
-    qr.make(fit=True)
-
-    img = qr.make_image(fill_color="black", back_color="white")
-    return img
-
-
-def generar_certificado(datos):
-    """Genera el certificado PDF con los datos proporcionados"""
-    try:
-        # Leer la plantilla
-        reader = PdfReader("plantilla/pny_prueba.pdf")
-        writer = PdfWriter()
-
-        # Agregar todas las páginas
-        writer.append(reader)
-
-        # Usar placa_archivos para nombres de archivos
-        placa_display = datos.get("placa", "")  # Placa completa para mostrar
-        placa_archivos = datos.get("placa_archivos", placa_display)  # Para archivos
-
-        # Dividir tipo de transporte (Página 1: 2 palabras)
-        tipo_dividido = dividir_tipo_transporte(
-            datos.get("tipo_transporte", ""), palabras_linea1=3
+    secuencia = secuencia or nueva_secuencia()
+    with bloqueo_certificado(nombre_archivo_certificado(datos)):
+        ruta_salida, error, calculados = llenar_certificado(
+            datos, linealizar, optimizar, determinista, secuencia
         )
+        if detalles is not None:
+            detalles.update(calculados)
+        if error:
+            return None, error, None
+        return _publicar_generado(datos, ruta_salida, publicar, secuencia)
 
-        # Generar campos automáticos
-        placa = datos.get("placa", "")
-        fecha_inspeccion = datos.get("fecha_inspeccion", "")
-        tipo_certificado = datos.get("tipo_certificado", "nuevo")
 
-        #################################
-        #################################
-
-        print("\n===== DEBUG CERTIFICADO =====")
-        print("TIPO:", tipo_certificado)
-        print("PLACA:", placa)
-        print("PLACA_ARCHIVOS:", placa_archivos)
-
-        #################################
-        #################################
-
-        numero_acta = generar_numero_acta(fecha_inspeccion, placa)
-        numero_inspeccion = generar_numero_inspeccion(placa)
-        fecha_acta = convertir_fecha_formato_acta(fecha_inspeccion)
-        fecha_firma = convertir_fecha_formato_firma(fecha_inspeccion)
-        link_certificado = generar_link_certificado(placa, tipo_certificado)
-
-        #################################
-        #################################
-
-        print("LINK:", link_certificado)
-        print("=============================\n")
-
-        #################################
-        #################################
-
-        # Generar código QR
-        qr_image = generar_qr_code(link_certificado)
-
-        # Guardar QR temporalmente
-        qr_buffer = BytesIO()
-        qr_image.save(qr_buffer, format="PNG")
-        qr_buffer.seek(0)
-
-        # === DETERMINAR QUÉ CHECKBOXES MARCAR ===
-        sistema_refrigeracion = datos.get("sistema_refrigeracion", "NO")
-        clase_vehiculo = datos.get("clase_vehiculo", "CAMION")
-
-        # Sistema de refrigeración
-        refri_si = "X" if sistema_refrigeracion == "SI" else ""
-        refri_no = "X" if sistema_refrigeracion == "NO" else ""
-
-        # Clase de vehículo
-        check_camioneta = "X" if clase_vehiculo == "CAMIONETA" else ""
-        check_camion = "X" if clase_vehiculo == "CAMION" else ""
-        check_moto = "X" if clase_vehiculo == "MOTO" else ""
-        check_otro = "X" if clase_vehiculo == "OTRO" else ""
-
-        # PÁGINA 1 - Datos del formulario
-        datos_pagina1 = {
-            "placa": str(datos.get("placa", "")),
-            "marca": str(datos.get("marca", "")),
-            "modelo": str(datos.get("modelo", "")),
-            "color": str(datos.get("color", "")),
-            "capacidad": str(datos.get("capacidad", "")),
-            "persona": str(datos.get("persona", "")),
-            "nit": str(datos.get("nit", "")),
-            "codigo_verificacion": str(datos.get("codigo_verificacion", "")),
-            "fecha_inspeccion": str(datos.get("fecha_inspeccion", "")),
-            "fecha_inspeccion2": str(datos.get("fecha_inspeccion", "")),
-            "fecha_vencimiento": str(datos.get("fecha_vencimiento", "")),
-            "tipo_transporte": str(datos.get("tipo_transporte", "")),
-            "tipodetransporte_1": str(tipo_dividido["tipodetransporte_1"]),
-            "tipodetransporte_2": str(tipo_dividido["tipodetransporte_2"]),
-            "link_certificado": link_certificado,
-        }
-
-        # PÁGINA 2 - Datos del acta
-        datos_pagina2 = {
-            # Campos duplicados de página 1 (con _2)
-            "placa_2": str(datos.get("placa", "")),
-            "marca_2": str(datos.get("marca", "")),
-            "modelo_2": str(datos.get("modelo", "")),
-            "color_2": str(datos.get("color", "")),
-            "persona_2": str(datos.get("persona", "")),
-            "nit_2": str(datos.get("nit", "")),
-            # Tipo de alimento completo (sin split)
-            "tipodealimento": str(datos.get("tipo_transporte", "")),
-            # Campos específicos de página 2
-            "ciudad": str(datos.get("ciudad", "")),
-            "direccion_notificacion": str(datos.get("direccion_notificacion", "")),
-            "departamento": str(datos.get("departamento", "")),
-            "telefonos": str(datos.get("telefono", "")),
-            "correo_electronico": str(datos.get("correo_electronico", "")),
-            "fecha_ultima_inspeccion": str(datos.get("fecha_ultima_inspeccion", "")),
-            "numero_acta": numero_acta,
-            "numero_inspeccion": numero_inspeccion,
-            "fecha_acta": fecha_acta,
-            # Campo "Otro" especifique
-            "clase_otro_especifique": str(datos.get("clase_otro_especifique", "")),
-            # === CHECKBOXES CON X ===
-            "sistema_refrigeracion_si_check": refri_si,
-            "sistema_refrigeracion_no_check": refri_no,
-            "clase_camioneta_check": check_camioneta,
-            "clase_camion_check": check_camion,
-            "clase_moto_check": check_moto,
-            "clase_otro_check": check_otro,
-        }
-
-        # PÁGINA 4 - Fecha de firma
-        datos_pagina4 = {
-            "fecha_firma_dia": fecha_firma["dia"],
-            "fecha_firma_mes": fecha_firma["mes"],
-            "fecha_firma_anio": fecha_firma["anio"],
-        }
-
-        # === GENERAR NOMBRE DE ARCHIVO CON PLACA DEL TRAILER ===
-        placa_limpia = placa_archivos.replace(" ", "_")
-
-        if tipo_certificado != "nuevo":
-            nombre_archivo = f"{placa_limpia}{tipo_certificado}.pdf"
-        else:
-            nombre_archivo = f"{placa_limpia}.pdf"
+def _publicar_generado(datos, ruta_salida, publicar, secuencia):
+    if not publicar:
+        return ruta_salida, None, None
 
-        # Actualizar cada página por separado
-        if len(writer.pages) >= 1:
-            writer.update_page_form_field_values(writer.pages[0], datos_pagina1)
-
-        if len(writer.pages) >= 2:
-            writer.update_page_form_field_values(writer.pages[1], datos_pagina2)
-
-        # Página 3 no tiene campos (estática)
-
-        if len(writer.pages) >= 4:
-            writer.update_page_form_field_values(writer.pages[3], datos_pagina4)
-
-        # === YA NO MANEJAMOS RADIO BUTTONS MANUALMENTE ===
-        # (Eliminada toda la sección anterior de radio buttons)
-
-        # === INSERTAR CÓDIGO QR EN LA PÁGINA 1 ===
-        # Primero guardamos el PDF con los campos rellenados
-        temp_path = os.path.join("generados", "temp_sin_qr.pdf")
-        with open(temp_path, "wb") as temp_file:
-            writer.write(temp_file)
+    try:
+        ok, publicacion = publicar_certificado_web(datos, ruta_salida, secuencia=secuencia)
+    except Exception as e:
+        return None, str(e), None
 
-        # Ahora usamos ReportLab para agregar el QR
-        # Crear overlay con el QR
-        qr_overlay_path = os.path.join("generados", "qr_overlay.pdf")
-        c = canvas.Canvas(qr_overlay_path)
+    if not ok:
+        return None, f"Error FTP: {publicacion}", None
 
-        # --- Posición y tamaño del QR en CM ---
-        pos_x_cm = 16.60
-        pos_y_cm = 14.75
-        width_cm = 3.04
-        height_cm = 3.04
-        # ------------------------------------
+    return ruta_salida, None, publicacion
 
-        # Conversión a puntos
-        x = cm_to_points(pos_x_cm)
-        y = cm_to_points(pos_y_cm)
-        width = cm_to_points(width_cm)
-        height = cm_to_points(height_cm)
 
-        c.drawImage(ImageReader(qr_buffer), x, y, width, height)
-        c.save()
+def urls_publicacion(datos):
+    """Nombres remotos y URLs públicas del certificado (no requiere FTP)"""
+    placa = datos["placa"]
+    tipo_certificado = datos.get("tipo_certificado", "nuevo")
+    sufijo = "" if tipo_certificado == "nuevo" else tipo_certificado
 
-        # Combinar el PDF con campos y el overlay del QR
-        final_writer = PdfWriter()
+    base_publica = "https://itaguigov-com.us.stackstaging.com"
+    carpeta_visor = quote("___ Busqueda de certificados electronicos __._files")
 
-        with open(qr_overlay_path, "rb") as qr_file, open(temp_path, "rb") as temp_file:
-            qr_reader = PdfReader(qr_file)
-            temp_reader = PdfReader(temp_file)
+    pdf_filename = f"{placa}{sufijo}.pdf"
+    viewer_filename = f"{placa}{sufijo}.html"
+    index_filename = f"index{placa}{sufijo}.html"
 
-            # Página 1: Combinar con el QR
-            page1 = temp_reader.pages[0]
-            qr_page = qr_reader.pages[0]
-            page1.merge_page(qr_page)
-            final_writer.add_page(page1)
+    return {
+        "pdf_filename": pdf_filename,
+        "viewer_filename": viewer_filename,
+        "index_filename": index_filename,
+        "index_url": f"{base_publica}/{index_filename}",
+        "viewer_url": f"{base_publica}/{carpeta_visor}/{quote(viewer_filename)}",
+        "remote_pdf_url": f"{base_publica}/{carpeta_visor}/{quote(pdf_filename)}",
+    }
 
-            # Resto de páginas sin cambios
-            for i in range(1, len(temp_reader.pages)):
-                final_writer.add_page(temp_reader.pages[i])
 
-        ruta_salida = os.path.join("generados", nombre_archivo)
+def renderizar_paginas(datos):
+    """
+    Renderiza las páginas publicadas del certificado.
 
-        # Guardar el PDF final
-        with open(ruta_salida, "wb") as output_file:
-            final_writer.write(output_file)
+    Returns:
+        (html_index, html_visor) listos para subir
+    """
+    archivo_certificado = nombre_archivo_certificado(datos)
+    recursos = recursos_web()
+
+    tpl_index = env.get_template("index_certificado.html")
+    html_index = compactar_html(
+        tpl_index.render(
+            **datos,
+            archivo_certificado=archivo_certificado,
+            recursos={nombre: remoto for nombre, (remoto, _) in recursos.items()},
+        )
+    )
 
-        # Limpiar archivos temporales
-        os.remove(temp_path)
-        os.remove(qr_overlay_path)
+    tpl_visor = env.get_template("visor_pdf.html")
+    html_visor = tpl_visor.render(**datos, archivo_pdf=f"{archivo_certificado}.pdf")
+    return html_index, html_visor
 
-        # Publicar en web
-        ok, publicacion = publicar_certificado_web(datos, ruta_salida)
 
-        if not ok:
-            return None, f"Error FTP: {publicacion}", None
+def registrar_artefacto(registro, ruta_remota, certificate_key, huella, tamano, info):
+    """
+    Verifica lo que informó el almacenamiento tras subir y guarda la huella.
 
-        return ruta_salida, None, publicacion
+    Args:
+        registro: PublishedArtifact existente o None para crearlo
+        info: InfoArchivo devuelto por el almacenamiento (SIZE/MDTM o stat)
+    """
+    # Verificación del archivo puntual, sin listar la carpeta
+    if info is None or info.tamano != tamano:
+        remoto = "no existe" if info is None else f"{info.tamano} de {tamano} bytes"
+        raise IOError(f"{ruta_remota} quedó incompleto en el almacenamiento ({remoto})")
+
+    if registro is None:
+        registro = PublishedArtifact(remote_path=ruta_remota)
+        db.session.add(registro)
+    registro.certificate_key = certificate_key
+    registro.content_hash = huella
+    registro.size_bytes = tamano
+    registro.published_at = datetime.utcnow()
+    return registro
+
+
+def publicar_certificado_web(datos, pdf, secuencia=None):
+    """
+    Sube index, visor y PDF del certificado al FTP desde memoria.
 
+    Args:
+        datos: Datos del certificado
+        pdf: Ruta del PDF generado o sus bytes
+        secuencia: Orden de la petición que generó el PDF. Si la clave ya tiene
+            una generación o publicación más reciente, no se sube nada (esa
+            otra publicará lo suyo) y el resultado trae "reemplazado": True.
+    """
+    secuencia = secuencia or nueva_secuencia()
+    try:
+        with bloqueo_certificado(nombre_archivo_certificado(datos)) as bloqueo:
+            if not bloqueo.vigente(secuencia, "generado", "publicado"):
+                print(f"= {nombre_archivo_certificado(datos)}: hay una versión más reciente, no se publica esta")
+                return True, {**urls_publicacion(datos), "omitidos": [], "reemplazado": True}
+
+            ok, publicacion = _publicar_artefactos(datos, pdf)
+            if ok:
+                bloqueo.guardar(publicado=secuencia)
+            return ok, publicacion
     except Exception as e:
-        return None, str(e), None
+        return False, str(e)
 
 
-def publicar_certificado_web(datos, ruta_pdf):
+def _publicar_artefactos(datos, pdf):
+    """Sube lo que cambió de index, visor y PDF; requiere el bloqueo de la clave"""
     try:
         placa = datos["placa"]
         tipo_certificado = datos.get("tipo_certificado", "nuevo")
-        archivo_certificado = f"{placa}{'' if tipo_certificado == 'nuevo' else tipo_certificado}"
+        archivo_certificado = nombre_archivo_certificado(datos)
 
         # =========================
         # Render HTML
         # =========================
-        tpl_index = env.get_template("index_certificado.html")
-        html_index = tpl_index.render(**datos, archivo_certificado=archivo_certificado)
+        html_index, html_visor = renderizar_paginas(datos)
 
         # indexPRY576.html / indexPRY576remo.html / indexPRY576remo2.html ...
         print("\n========== FTP ==========")
@@ -1037,78 +967,61 @@ def publicar_certificado_web(datos, ruta_pdf):
         print("HTML remoto:", f"{archivo_certificado}.html")
         print("INDEX remoto:", f"index{archivo_certificado}.html")
         print("=========================\n")
-        index_path = f"build/index{archivo_certificado}.html"
-
-        with open(index_path, "w", encoding="utf-8") as f:
-            f.write(html_index)
 
-        tpl_visor = env.get_template("visor_pdf.html")
-        html_visor = tpl_visor.render(**datos, archivo_pdf=f"{archivo_certificado}.pdf")
+        if COPIAS_LOCALES:
+            with open(f"build/index{archivo_certificado}.html", "w", encoding="utf-8") as f:
+                f.write(html_index)
+            with open(f"build/{archivo_certificado}.html", "w", encoding="utf-8") as f:
+                f.write(html_visor)
 
-        visor_path = f"build/{archivo_certificado}.html"
-        with open(visor_path, "w", encoding="utf-8") as f:
-            f.write(html_visor)
+        if isinstance(pdf, (bytes, bytearray)):
+            contenido_pdf = bytes(pdf)
+        else:
+            with open(pdf, "rb") as f:
+                contenido_pdf = f.read()
 
         # =========================
         # FTP
         # =========================
-        from ftp_config import FTP_BASE, FTP_HOST, FTP_PASS, FTP_USER, FTP_VISOR
-
-        ftp = FTP(FTP_HOST, timeout=30)
-        ftp.login(user=FTP_USER, passwd=FTP_PASS)
-
-        # Subir index
-        with open(index_path, "rb") as f:
-            ftp.storbinary(
-                f"STOR {FTP_BASE}/index{archivo_certificado}.html",
-                f,
-            )
-
-        # Subir visor
-        with open(visor_path, "rb") as f:
-            ftp.storbinary(
-                f"STOR {FTP_VISOR}/{archivo_certificado}.html",
-                f,
-            )
-
-        # Subir PDF
-        with open(ruta_pdf, "rb") as f:
-            ftp.storbinary(
-                f"STOR {FTP_VISOR}/{archivo_certificado}.pdf",
-                f,
-            )
-
-        # Entrar al directorio donde quedó el PDF
-        ftp.cwd(FTP_VISOR)
-
-        archivos = ftp.nlst()
-
-        print("\nARCHIVOS EN FTP:")
-        for archivo in archivos:
-            print(" -", archivo)
-
-        if f"{archivo_certificado}.pdf" in archivos:
-            print("✅ El PDF existe en el FTP")
-        else:
-            print("❌ El PDF NO existe en el FTP")
-
-        ftp.quit()
-
-        base_publica = "https://itaguigov-com.us.stackstaging.com"
-        carpeta_visor = quote("___ Busqueda de certificados electronicos __._files")
-
-        pdf_filename = f"{placa}{sufijo}.pdf"
-        viewer_filename = f"{placa}{sufijo}.html"
-        index_filename = f"index{placa}{sufijo}.html"
+        from ftp_config import FTP_BASE, FTP_VISOR
+
+        # (contenido, remoto): recursos compartidos (solo se suben la primera
+        # vez, después coinciden por huella), index, visor y PDF
+        artefactos = [(contenido, f"{FTP_VISOR}/{remoto}") for remoto, contenido in recursos_web().values()]
+        rutas_recursos = {ruta_remota for _, ruta_remota in artefactos}
+        artefactos += [
+            (html_index.encode("utf-8"), f"{FTP_BASE}/index{archivo_certificado}.html"),
+            (html_visor.encode("utf-8"), f"{FTP_VISOR}/{archivo_certificado}.html"),
+            (contenido_pdf, f"{FTP_VISOR}/{archivo_certificado}.pdf"),
+        ]
 
-        return True, {
-            "pdf_filename": pdf_filename,
-            "viewer_filename": viewer_filename,
-            "index_filename": index_filename,
-            "index_url": f"{base_publica}/{index_filename}",
-            "viewer_url": f"{base_publica}/{carpeta_visor}/{quote(viewer_filename)}",
-            "remote_pdf_url": f"{base_publica}/{carpeta_visor}/{quote(pdf_filename)}",
-        }
+        # Saltar los que ya están publicados con el mismo contenido
+        pendientes = []
+        omitidos = []
+        for contenido, ruta_remota in artefactos:
+            huella = huella_contenido(contenido)
+
+            registro = PublishedArtifact.query.filter_by(remote_path=ruta_remota).first()
+            if registro is not None and registro.content_hash == huella:
+                print("= Sin cambios, se omite:", ruta_remota)
+                omitidos.append(ruta_remota)
+            else:
+                pendientes.append((contenido, ruta_remota, huella, len(contenido), registro))
+
+        if pendientes:
+            with abrir_almacenamiento() as almacen:
+                # En FTP cada archivo va por su propia conexión, en paralelo
+                infos = almacen.escribir_varios(
+                    [(ruta_remota, contenido) for contenido, ruta_remota, _, _, _ in pendientes]
+                )
+
+            for (_, ruta_remota, huella, tamano, registro), info in zip(pendientes, infos):
+                # Los recursos compartidos no son de ningún certificado
+                certificate_key = None if ruta_remota in rutas_recursos else archivo_certificado
+                registrar_artefacto(registro, ruta_remota, certificate_key, huella, tamano, info)
+                print(f"✅ Verificado: {ruta_remota} ({tamano} bytes, modificado {info.modificado or '-'})")
+
+        return True, {**urls_publicacion(datos), "omitidos": omitidos}
 
     except Exception as e:
         return False, str(e)
@@ -1140,6 +1053,23 @@ def autocompletar_por_placa(placa):
     if not placa_norm:
         return jsonify({"ok": False, "message": "Placa inválida"}), 400
 
+    # Renovación ya preparada: datos y PDF listos, sin leer el FTP
+    borrador = buscar_borrador(placa_norm)
+    if borrador is not None:
+        anterior = borrador.get("anterior") or {}
+        return jsonify(
+            {
+                "ok": True,
+                "message": f"Renovación {borrador['tipo_certificado']} lista para la placa {placa_norm}.",
+                "source": "borrador",
+                "data": borrador["datos"],
+                "index_url": anterior.get("index_url"),
+                "viewer_url": anterior.get("viewer_url"),
+                "remote_pdf_url": anterior.get("remote_pdf_url"),
+                "certificate_key": borrador["certificate_key"],
+            }
+        )
+
     payload, error = buscar_autocompletado_en_ftp(placa_norm)
     if error:
         return jsonify({"ok": False, "message": f"Error consultando FTP: {error}"}), 500
@@ -1181,15 +1111,57 @@ def login():
     return render_template("login.html")
 
 
-@app.route("/generar", methods=["POST"])
-@login_required
-def generar():
-    """Procesa el formulario y genera el PDF"""
+# Radios del formulario (templates/index.html): opciones, la marcada por
+# defecto y el prefijo de las casillas que devuelve el parser del PDF
+OPCIONES_FORMULARIO = {
+    "sistema_refrigeracion": (("SI", "NO"), "NO", "sistema_refrigeracion_"),
+    "clase_vehiculo": (("CAMIONETA", "CAMION", "MOTO", "OTRO"), "CAMION", "clase_"),
+}
+
+
+def _sin_tildes(texto):
+    return "".join(c for c in unicodedata.normalize("NFD", texto) if unicodedata.category(c) != "Mn")
+
+
+def campos_como_formulario(campos):
+    """
+    Los campos tal como vuelven del formulario después del autocompletado
+    (applyAutocompleteData en index.html): un radio solo puede quedar en una
+    de sus opciones ("Sí" o "CAMIÓN" importados pasan a SI y CAMION; si no
+    coincide ninguna, queda la de defecto), la capacidad en "N TONELADAS" y
+    las fechas en AAAA-MM-DD. Así la huella de un borrador coincide con la
+    de lo que el operador confirma sin cambios.
+    """
+    campos = dict(campos)
+    for campo, (opciones, por_defecto, prefijo) in OPCIONES_FORMULARIO.items():
+        valor = _sin_tildes(str(campos.get(campo) or "")).strip().upper()
+        if valor not in opciones:
+            marcadas = [opcion for opcion in opciones if campos.get(f"{prefijo}{opcion.lower()}_check")]
+            valor = marcadas[0] if not valor and marcadas else por_defecto
+        campos[campo] = valor
+
+    capacidad = str(campos.get("capacidad") or "")
+    toneladas = re.search(r"(\d+[.,]?\d*)\s*TONEL", capacidad, re.IGNORECASE)
+    if toneladas:
+        campos["capacidad"] = f"{toneladas.group(1).replace(',', '.')} TONELADAS"
+    else:
+        campos["capacidad"] = " ".join(capacidad.split())
+
+    for campo in ("fecha_inspeccion", "fecha_vencimiento", "fecha_ultima_inspeccion"):
+        fecha = re.fullmatch(r"(\d{1,2})/(\d{1,2})/(\d{4})", str(campos.get(campo) or ""))
+        if fecha:
+            dia, mes, anio = fecha.groups()
+            campos[campo] = f"{anio}-{mes.zfill(2)}-{dia.zfill(2)}"
+    return campos
+
+
+def datos_desde_formulario(form):
+    """Arma el diccionario `datos` a partir del formulario de /generar (o de una fila de lote)"""
 
     # Capturar datos del trailer
-    es_trailer = request.form.get("es_trailer") == "true"
-    placa_vehiculo = request.form.get("placa", "")
-    placa_trailer = request.form.get("placa_trailer", "")
+    es_trailer = form.get("es_trailer") == "true"
+    placa_vehiculo = form.get("placa", "")
+    placa_trailer = form.get("placa_trailer", "")
 
     # Si es trailer, combinar placas
     if es_trailer and placa_trailer:
@@ -1199,18 +1171,9 @@ def generar():
         placa_completa = placa_vehiculo
         placa_archivos = placa_vehiculo
 
-    print("====== FORM ======")
-    print(request.form)
-    print("tipo_certificado =", request.form.get("tipo_certificado"))
-    print(
-        "tipo_certificado_hidden =",
-        request.form.get("tipo_certificado_hidden"),
-    )
-    print("==================")
-
     tipo_certificado = (
-        request.form.get("tipo_certificado")
-        or request.form.get("tipo_certificado_hidden")
+        form.get("tipo_certificado")
+        or form.get("tipo_certificado_hidden")
         or "nuevo"
     )
 
@@ -1222,90 +1185,363 @@ def generar():
         "placa_archivos": placa_archivos,  # Para nombres de archivos
         "es_trailer": es_trailer,
         # Página 1
-        "placa": request.form.get("placa", ""),
-        "marca": request.form.get("marca", ""),
-        "modelo": request.form.get("modelo", ""),
-        "color": request.form.get("color", ""),
-        "capacidad": request.form.get("capacidad", ""),
-        "persona": request.form.get("persona", ""),
-        "nit": request.form.get("nit", ""),
-        "codigo_verificacion": request.form.get("codigo_verificacion", ""),
-        "tipo_transporte": request.form.get("tipo_transporte", ""),
-        "fecha_inspeccion": request.form.get("fecha_inspeccion", ""),
-        "fecha_vencimiento": request.form.get("fecha_vencimiento", ""),
+        "placa": form.get("placa", ""),
+        "marca": form.get("marca", ""),
+        "modelo": form.get("modelo", ""),
+        "color": form.get("color", ""),
+        "capacidad": form.get("capacidad", ""),
+        "persona": form.get("persona", ""),
+        "nit": form.get("nit", ""),
+        "codigo_verificacion": form.get("codigo_verificacion", ""),
+        "tipo_transporte": form.get("tipo_transporte", ""),
+        "fecha_inspeccion": form.get("fecha_inspeccion", ""),
+        "fecha_vencimiento": form.get("fecha_vencimiento", ""),
         # Página 2
-        "ciudad": request.form.get("ciudad", ""),
-        "direccion_notificacion": request.form.get("direccion_notificacion", ""),
-        "departamento": request.form.get("departamento", ""),
-        "telefono": request.form.get("telefono", ""),
-        "correo_electronico": request.form.get("correo_electronico", ""),
-        "fecha_ultima_inspeccion": request.form.get("fecha_ultima_inspeccion", ""),
-        "sistema_refrigeracion": request.form.get("sistema_refrigeracion", "NO"),
-        "clase_vehiculo": request.form.get("clase_vehiculo", "CAMION"),
-        "clase_otro_especifique": request.form.get("clase_otro_especifique", ""),
+        "ciudad": form.get("ciudad", ""),
+        "direccion_notificacion": form.get("direccion_notificacion", ""),
+        "departamento": form.get("departamento", ""),
+        "telefono": form.get("telefono", ""),
+        "correo_electronico": form.get("correo_electronico", ""),
+        "fecha_ultima_inspeccion": form.get("fecha_ultima_inspeccion", ""),
+        "sistema_refrigeracion": form.get("sistema_refrigeracion", "NO"),
+        "clase_vehiculo": form.get("clase_vehiculo", "CAMION"),
+        "clase_otro_especifique": form.get("clase_otro_especifique", ""),
     }
 
-    ruta_pdf, error, publicacion = generar_certificado(datos)
+    return datos
 
-    if error:
-        audit_error = GenerationAudit(
-            user_id=current_user.id,
-            plate=placa_archivos,
-            certificate_type=tipo_certificado,
-            status="error",
-            message=error,
+
+def buscar_generacion_previa(user_id, idempotency_key, payload_hash):
+    """
+    Busca una generación anterior equivalente del mismo usuario:
+    la misma llave de idempotencia (cualquier antigüedad) o los mismos datos
+    dentro de la ventana de duplicados. Solo cuentan las exitosas y las que
+    siguen en curso; un error no bloquea el reintento.
+    """
+    ahora = datetime.utcnow()
+
+    if idempotency_key:
+        previa = GenerationAudit.query.filter_by(
+            user_id=user_id, idempotency_key=idempotency_key
+        ).first()
+        if previa is not None and previa.status != "error":
+            return previa
+
+    return (
+        GenerationAudit.query.filter(
+            GenerationAudit.user_id == user_id,
+            GenerationAudit.payload_hash == payload_hash,
+            db.or_(
+                db.and_(
+                    GenerationAudit.status == "success",
+                    GenerationAudit.created_at >= ahora - timedelta(seconds=VENTANA_DUPLICADOS_SEGUNDOS),
+                ),
+                db.and_(
+                    GenerationAudit.status == "processing",
+                    GenerationAudit.created_at >= ahora - timedelta(seconds=VIGENCIA_EN_CURSO_SEGUNDOS),
+                ),
+            ),
         )
-        db.session.add(audit_error)
-        db.session.commit()
+        .order_by(GenerationAudit.created_at.desc())
+        .first()
+    )
+
+
+def respuesta_generacion(audit, duplicada=False):
+    """Respuesta JSON de /generar a partir de su GenerationAudit"""
+    if audit.status == "processing":
+        # No se espera aquí: el worker quedaría bloqueado y, con REPEATABLE READ,
+        # no vería el commit de la petición original. El cliente sondea status_url.
+        return (
+            jsonify(
+                {
+                    "ok": True,
+                    "processing": True,
+                    "message": "El certificado se está generando; el resultado aparecerá en unos segundos.",
+                    "audit_id": audit.id,
+                    "status_url": url_for("estado_generacion", audit_id=audit.id),
+                }
+            ),
+            202,
+        )
+
+    if audit.status != "success":
+        return jsonify({"ok": False, "message": f"Error al generar el certificado: {audit.message}"}), 500
+
+    generated_at = audit.created_at.strftime("%Y-%m-%d %H:%M:%S")
+    if duplicada:
+        message = "Este certificado ya se había generado; se devuelve el resultado anterior."
+    elif audit.publish_state in ("pending", "publishing"):
+        message = "Certificado generado; la publicación web está en curso."
+    else:
+        message = "Certificado generado y publicado correctamente."
+
+    respuesta = {
+        "ok": True,
+        "message": message,
+        "duplicate": duplicada,
+        "audit_id": audit.id,
+        "publish_state": audit.publish_state or "published",
+        "status_url": url_for("estado_generacion", audit_id=audit.id),
+        "download_url": url_for("descargar_generado", filename=audit.pdf_filename),
+        "pdf_filename": audit.pdf_filename,
+        "index_url": audit.index_url,
+        "viewer_url": audit.viewer_url,
+        "remote_pdf_url": audit.remote_pdf_url,
+        "generated_at": generated_at,
+    }
+
+    if not duplicada:
+        respuesta["recent_item"] = {
+            "audit_id": audit.id,
+            "plate": audit.plate,
+            "certificate_type": audit.certificate_type,
+            "status": audit.status,
+            "publish_state": audit.publish_state or "published",
+            "generated_at": generated_at,
+            "index_url": audit.index_url,
+            "viewer_url": audit.viewer_url,
+            "remote_pdf_url": audit.remote_pdf_url,
+        }
+
+    return jsonify(respuesta)
+
+
+@app.route("/generar", methods=["POST"])
+@login_required
+def generar():
+    """Procesa el formulario y genera el PDF"""
+
+    print("====== FORM ======")
+    print(request.form)
+    print("tipo_certificado =", request.form.get("tipo_certificado"))
+    print(
+        "tipo_certificado_hidden =",
+        request.form.get("tipo_certificado_hidden"),
+    )
+    print("==================")
 
-        return jsonify({"ok": False, "message": f"Error al generar el certificado: {error}"}), 500
+    # Orden de llegada: si otra petición de la misma placa y tipo termina
+    # después, igual gana la más reciente
+    secuencia = nueva_secuencia()
 
-    pdf_filename = os.path.basename(ruta_pdf)
-    descarga_url = url_for("descargar_generado", filename=pdf_filename)
+    datos = datos_desde_formulario(request.form)
+    tipo_certificado = datos["tipo_certificado"]
+    placa_archivos = datos["placa_archivos"]
 
-    audit_ok = GenerationAudit(
+    # === SOLICITUDES DUPLICADAS ===
+    idempotency_key = (request.form.get("idempotency_key") or "").strip()[:64] or None
+    payload_hash = huella_datos(datos)
+
+    previa = buscar_generacion_previa(current_user.id, idempotency_key, payload_hash)
+    if previa is not None:
+        return respuesta_generacion(previa, duplicada=True)
+
+    audit = GenerationAudit(
         user_id=current_user.id,
         plate=placa_archivos,
         certificate_type=tipo_certificado,
-        status="success",
-        message="Certificado generado y publicado correctamente",
-        pdf_filename=pdf_filename,
-        index_url=publicacion.get("index_url") if publicacion else None,
-        viewer_url=publicacion.get("viewer_url") if publicacion else None,
-        remote_pdf_url=publicacion.get("remote_pdf_url") if publicacion else None,
+        status="processing",
+        idempotency_key=idempotency_key,
+        payload_hash=payload_hash,
+    )
+    db.session.add(audit)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Otra petición con la misma llave se registró primero
+        db.session.rollback()
+        previa = buscar_generacion_previa(current_user.id, idempotency_key, payload_hash)
+        if previa is None:
+            raise
+        return respuesta_generacion(previa, duplicada=True)
+
+    detalles = {}
+    ruta_pdf, error, publicacion = generar_certificado(
+        datos, publicar=not PUBLICACION_ASINCRONA, secuencia=secuencia, detalles=detalles
     )
-    db.session.add(audit_ok)
+
+    if error:
+        audit.status = "error"
+        audit.message = error
+        # Liberar la llave para que el reintento del formulario pueda usarla
+        audit.idempotency_key = None
+        db.session.commit()
+
+        return respuesta_generacion(audit)
+
+    audit.status = "success"
+    audit.pdf_filename = os.path.basename(ruta_pdf)
+
+    if PUBLICACION_ASINCRONA:
+        # Las URLs son predecibles; quedan activas cuando el trabajador publica
+        publicacion = urls_publicacion(datos)
+        audit.message = "Certificado generado; publicación en curso"
+        encolar_publicacion(
+            audit,
+            datos,
+            ruta_pdf,
+            os.path.splitext(publicacion["pdf_filename"])[0],
+            secuencia=secuencia,
+        )
+    else:
+        audit.message = "Certificado generado y publicado correctamente"
+
+    audit.index_url = publicacion.get("index_url") if publicacion else None
+    audit.viewer_url = publicacion.get("viewer_url") if publicacion else None
+    audit.remote_pdf_url = publicacion.get("remote_pdf_url") if publicacion else None
 
     try:
-        guardar_perfil_autocompletado(datos)
+        # Punto de guardado: si falla, se pierde el registro pero no la auditoría
+        with db.session.begin_nested():
+            guardar_registro_certificado(datos, ruta_pdf, detalles)
     except Exception as profile_exc:
-        print("WARN: no se pudo guardar perfil para autocompletado:", profile_exc)
+        print("WARN: no se pudo guardar el registro del certificado:", profile_exc)
 
     db.session.commit()
 
+    if PUBLICACION_ASINCRONA:
+        notificar()
+
+    return respuesta_generacion(audit)
+
+
+@app.route("/api/generaciones/<int:audit_id>", methods=["GET"])
+@login_required
+def estado_generacion(audit_id):
+    """Estado de generación y publicación de un certificado (para sondeo desde la UI)"""
+    audit = GenerationAudit.query.get(audit_id)
+    if audit is None or audit.user_id != current_user.id:
+        return jsonify({"ok": False, "message": "Generación no encontrada."}), 404
+
     return jsonify(
         {
             "ok": True,
-            "message": "Certificado generado y publicado correctamente.",
-            "download_url": descarga_url,
-            "pdf_filename": pdf_filename,
-            "index_url": publicacion.get("index_url") if publicacion else None,
-            "viewer_url": publicacion.get("viewer_url") if publicacion else None,
-            "remote_pdf_url": publicacion.get("remote_pdf_url") if publicacion else None,
-            "generated_at": audit_ok.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-            "recent_item": {
-                "plate": audit_ok.plate,
-                "certificate_type": audit_ok.certificate_type,
-                "status": audit_ok.status,
-                "generated_at": audit_ok.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-                "index_url": audit_ok.index_url,
-                "viewer_url": audit_ok.viewer_url,
-                "remote_pdf_url": audit_ok.remote_pdf_url,
-            },
+            "audit_id": audit.id,
+            "status": audit.status,
+            "publish_state": audit.publish_state or "published",
+            "message": audit.message,
+            "pdf_filename": audit.pdf_filename,
+            "download_url": url_for("descargar_generado", filename=audit.pdf_filename) if audit.pdf_filename else None,
+            "index_url": audit.index_url,
+            "viewer_url": audit.viewer_url,
+            "remote_pdf_url": audit.remote_pdf_url,
         }
     )
 
 
+@app.route("/api/sincronizacion", methods=["GET"])
+@login_required
+def estado_sincronizacion_ftp():
+    """Última sincronización automática con el FTP: hora, duración, conteos y líder"""
+    return jsonify({"ok": True, **estado_sincronizacion()})
+
+
+# Ventana por defecto y tamaño de página de /api/certificados/vencimientos
+DIAS_VENTANA_VENCIMIENTOS = 30
+POR_PAGINA_VENCIMIENTOS = 50
+MAX_POR_PAGINA_VENCIMIENTOS = 500
+
+
+@app.route("/api/certificados/vencimientos", methods=["GET"])
+@login_required
+def certificados_por_vencimiento():
+    """
+    Certificados que vencen entre `desde` y `hasta` (YYYY-MM-DD, ambos incluidos;
+    por defecto hoy y hoy + 30 días), ordenados por vencimiento y paginados
+    con `page` y `per_page`.
+    """
+    try:
+        desde = date.fromisoformat(request.args.get("desde") or date.today().isoformat())
+        hasta = date.fromisoformat(
+            request.args.get("hasta") or (desde + timedelta(days=DIAS_VENTANA_VENCIMIENTOS)).isoformat()
+        )
+    except ValueError:
+        return jsonify({"ok": False, "message": "Las fechas deben tener el formato YYYY-MM-DD."}), 400
+    if hasta < desde:
+        return jsonify({"ok": False, "message": "'hasta' no puede ser anterior a 'desde'."}), 400
+
+    pagina = CertificateRecord.query.filter(CertificateRecord.expires_on.between(desde, hasta)).order_by(
+        CertificateRecord.expires_on, CertificateRecord.certificate_key
+    ).paginate(
+        page=request.args.get("page", 1, type=int),
+        per_page=request.args.get("per_page", POR_PAGINA_VENCIMIENTOS, type=int),
+        max_per_page=MAX_POR_PAGINA_VENCIMIENTOS,
+        error_out=False,
+    )
+
+    return jsonify(
+        {
+            "ok": True,
+            "desde": desde.isoformat(),
+            "hasta": hasta.isoformat(),
+            "page": pagina.page,
+            "per_page": pagina.per_page,
+            "total": pagina.total,
+            "pages": pagina.pages,
+            "items": [
+                {
+                    "certificate_key": record.certificate_key,
+                    "plate": record.plate,
+                    "certificate_type": record.certificate_type,
+                    "inspected_on": record.inspected_on.isoformat() if record.inspected_on else None,
+                    "expires_on": record.expires_on.isoformat(),
+                    "days_left": (record.expires_on - date.today()).days,
+                    "pdf_filename": record.pdf_filename,
+                }
+                for record in pagina.items
+            ],
+        }
+    )
+
+
+@app.route("/api/lotes", methods=["POST"])
+@login_required
+def crear_lote():
+    """Recibe un lote CSV/JSON (archivo o cuerpo) y lo genera en segundo plano"""
+    from lotes import iniciar_lote, leer_filas
+
+    archivo = request.files.get("archivo")
+    try:
+        if archivo:
+            filas = leer_filas(archivo.read(), archivo.filename or "")
+        else:
+            filas = leer_filas(request.get_data())
+    except ValueError as exc:
+        return jsonify({"ok": False, "message": f"No se pudo leer el lote: {exc}"}), 400
+
+    if not filas:
+        return jsonify({"ok": False, "message": "El lote no tiene filas."}), 400
+
+    job = iniciar_lote(current_user.id, filas)
+
+    return (
+        jsonify(
+            {
+                "ok": True,
+                "message": f"Lote #{job.id} en proceso ({job.total_rows} filas).",
+                "job_id": job.id,
+                "total": job.total_rows,
+                "status_url": url_for("estado_lote", job_id=job.id),
+            }
+        ),
+        202,
+    )
+
+
+@app.route("/api/lotes/<int:job_id>", methods=["GET"])
+@login_required
+def estado_lote(job_id):
+    """Avance del lote y resultado por fila (parcial mientras corre)"""
+    from lotes import serializar_lote
+
+    job = BatchJob.query.get(job_id)
+    if job is None or job.user_id != current_user.id:
+        return jsonify({"ok": False, "message": "Lote no encontrado."}), 404
+
+    return jsonify({"ok": True, **serializar_lote(job)})
+
+
 ## **3. Agrega el campo en LibreOffice Draw:**
 
 # En la **Página 1**, donde va el link de verificación (debajo del código QR):
@@ -0,0 +1,156 @@
+"""Bloqueos por clave de certificado (PRY576, PRY576remo, ...).
+
+Dos generaciones de la misma placa y tipo escriben los mismos archivos
+(generados/<clave>.pdf, index<clave>.html, <clave>.pdf en el servidor); placas
+distintas no se bloquean entre sí. El bloqueo es un flock sobre
+instance/bloqueos/<clave>.lock, así vale entre hilos y entre los procesos de
+gunicorn del mismo servidor.
+
+El archivo guarda además la secuencia (time_ns de cuando se pidió) de la
+última generación y la última publicación de la clave. Con eso gana siempre
+la petición más reciente, termine primero o no: una más vieja que llega tarde
+no pisa a la nueva.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo se bloquea dentro del proceso
+    fcntl = None
+
+CARPETA_BLOQUEOS = os.path.join("instance", "bloqueos")
+ESPERA_MAXIMA_SEGUNDOS = float(os.environ.get("CERT_ESPERA_BLOQUEO", "300"))
+# Esperas más largas que esto se informan en el log
+ESPERA_INFORMADA_SEGUNDOS = 0.1
+INTERVALO_REINTENTO_SEGUNDOS = 0.05
+
+_locales = threading.local()
+_locks_proceso = {}
+_locks_proceso_lock = threading.Lock()
+
+_esperas = {"bloqueos": 0, "con_espera": 0, "total_segundos": 0.0, "maxima_segundos": 0.0}
+_esperas_lock = threading.Lock()
+
+
+def _nombre_archivo(certificate_key):
+    return re.sub(r"[^A-Za-z0-9_-]", "_", certificate_key or "") or "_"
+
+
+def _registrar_espera(certificate_key, espera):
+    with _esperas_lock:
+        _esperas["bloqueos"] += 1
+        _esperas["total_segundos"] += espera
+        _esperas["maxima_segundos"] = max(_esperas["maxima_segundos"], espera)
+        if espera >= ESPERA_INFORMADA_SEGUNDOS:
+            _esperas["con_espera"] += 1
+    if espera >= ESPERA_INFORMADA_SEGUNDOS:
+        print(f"⏳ Bloqueo de {certificate_key}: {espera:.2f}s de espera")
+
+
+def estadisticas_esperas():
+    """Esperas acumuladas de este proceso (bloqueos tomados, con espera, total y máxima)"""
+    with _esperas_lock:
+        return dict(_esperas)
+
+
+class BloqueoCertificado:
+    """
+    Context manager del bloqueo de una clave. Es reentrante dentro del mismo
+    hilo (generar_certificado publica con el bloqueo ya tomado).
+
+    Atributos:
+        estado: dict con "generado" y "publicado" (secuencias guardadas)
+        espera: segundos que tardó en obtenerse
+    """
+
+    def __init__(self, certificate_key, espera_maxima=None):
+        self.certificate_key = certificate_key
+        self.espera_maxima = ESPERA_MAXIMA_SEGUNDOS if espera_maxima is None else espera_maxima
+        self.estado = {}
+        self.espera = 0.0
+        self._archivo = None
+        self._lock_proceso = None
+        self._padre = None
+
+    def __enter__(self):
+        tomados = getattr(_locales, "tomados", None)
+        if tomados is None:
+            tomados = _locales.tomados = {}
+
+        self._padre = tomados.get(self.certificate_key)
+        if self._padre is not None:
+            self.estado = self._padre.estado
+            return self
+
+        inicio = time.monotonic()
+        if fcntl is None:
+            with _locks_proceso_lock:
+                self._lock_proceso = _locks_proceso.setdefault(self.certificate_key, threading.Lock())
+            if not self._lock_proceso.acquire(timeout=self.espera_maxima):
+                raise TimeoutError(f"No se obtuvo el bloqueo de {self.certificate_key}")
+            self._archivo = open(self._ruta(), "a+", encoding="utf-8")
+        else:
+            self._archivo = open(self._ruta(), "a+", encoding="utf-8")
+            while True:
+                try:
+                    fcntl.flock(self._archivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() - inicio > self.espera_maxima:
+                        self._archivo.close()
+                        raise TimeoutError(f"No se obtuvo el bloqueo de {self.certificate_key}")
+                    time.sleep(INTERVALO_REINTENTO_SEGUNDOS)
+
+        self.espera = time.monotonic() - inicio
+        _registrar_espera(self.certificate_key, self.espera)
+
+        self._archivo.seek(0)
+        try:
+            self.estado = json.loads(self._archivo.read() or "{}")
+        except ValueError:
+            self.estado = {}
+        tomados[self.certificate_key] = self
+        return self
+
+    def _ruta(self):
+        os.makedirs(CARPETA_BLOQUEOS, exist_ok=True)
+        return os.path.join(CARPETA_BLOQUEOS, f"{_nombre_archivo(self.certificate_key)}.lock")
+
+    def guardar(self, **cambios):
+        """Actualiza el estado guardado de la clave (requiere tener el bloqueo)"""
+        if self._padre is not None:
+            self._padre.guardar(**cambios)
+            return
+        self.estado.update(cambios)
+        self._archivo.seek(0)
+        self._archivo.truncate()
+        self._archivo.write(json.dumps(self.estado))
+        self._archivo.flush()
+
+    def vigente(self, secuencia, *etapas):
+        """True si ninguna de las `etapas` guardadas es más reciente que `secuencia`"""
+        return all(self.estado.get(etapa, 0) <= secuencia for etapa in etapas)
+
+    def __exit__(self, *exc):
+        if self._padre is not None:
+            return
+        del _locales.tomados[self.certificate_key]
+        if fcntl is not None:
+            fcntl.flock(self._archivo.fileno(), fcntl.LOCK_UN)
+        self._archivo.close()
+        if self._lock_proceso is not None:
+            self._lock_proceso.release()
+
+
+def bloqueo_certificado(certificate_key, espera_maxima=None):
+    return BloqueoCertificado(certificate_key, espera_maxima=espera_maxima)
+
+
+def nueva_secuencia():
+    """Secuencia de una petición: se toma al recibirla, antes de esperar el bloqueo"""
+    return time.time_ns()
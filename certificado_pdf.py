@@ -0,0 +1,472 @@
+"""Llenado del PDF del certificado a partir de los `datos` del formulario.
+
+Separado de app.py para que los procesos del pool de lotes (que arrancan con
+spawn e importan el módulo de la función que corren) no levanten la app:
+importar este módulo no crea tablas, no aplica migraciones ni abre la base.
+app.py lo reexporta y agrega la publicación (generar_certificado).
+"""
+
+import hashlib
+import json
+import os
+import random
+import tempfile
+from datetime import datetime
+from io import BytesIO
+
+import qrcode
+from pypdf import PdfReader, PdfWriter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from bloqueos import bloqueo_certificado, nueva_secuencia
+from renovaciones import tomar_borrador
+from salida_pdf import postprocesar_pdf
+
+# PDF linealizado ("fast web view") para que el visor muestre la página 1 por rangos.
+LINEALIZAR_PDF = os.environ.get("CERT_LINEALIZAR_PDF", "0") == "1"
+# Compresión y limpieza del PDF publicado (activa por defecto).
+OPTIMIZAR_PDF = os.environ.get("CERT_OPTIMIZAR_PDF", "1") == "1"
+# Mismos datos → mismos bytes (número de inspección e /ID derivados de los datos).
+SALIDA_DETERMINISTA = os.environ.get("CERT_SALIDA_DETERMINISTA", "0") == "1"
+
+
+def normalizar_placa(placa):
+    return (placa or "").strip().upper().replace(" ", "")
+
+
+def nombre_archivo_certificado(datos):
+    """PRY576 / PRY576remo / PRY576remo2 ... (base de los nombres remotos)"""
+    tipo_certificado = datos.get("tipo_certificado", "nuevo")
+    return f"{datos['placa']}{'' if tipo_certificado == 'nuevo' else tipo_certificado}"
+
+
+def ruta_pdf_generado(datos, carpeta="generados"):
+    """generados/<placa_archivos><sufijo>.pdf"""
+    placa_limpia = datos.get("placa_archivos", datos.get("placa", "")).replace(" ", "_")
+    tipo_certificado = datos.get("tipo_certificado", "nuevo")
+    sufijo = "" if tipo_certificado == "nuevo" else tipo_certificado
+    return os.path.join(carpeta, f"{placa_limpia}{sufijo}.pdf")
+
+
+def dividir_tipo_transporte(texto, palabras_linea1=3):
+    """Divide el tipo de transporte en dos líneas - Página 1"""
+    if not texto:
+        return {"tipodetransporte_1": "", "tipodetransporte_2": ""}
+
+    palabras = texto.split()
+
+    if len(palabras) <= palabras_linea1:
+        return {"tipodetransporte_1": texto, "tipodetransporte_2": ""}
+
+    return {
+        "tipodetransporte_1": " ".join(palabras[:palabras_linea1]),
+        "tipodetransporte_2": " ".join(palabras[palabras_linea1:]),
+    }
+
+
+def cm_to_points(cm):
+    """Convierte centímetros a puntos (1 cm = 28.3465 puntos)"""
+    return cm * 28.3465
+
+
+def generar_numero_acta(fecha_inspeccion, placa):
+    """
+    Genera número de acta en formato YYYYMMDDPLACA
+    Ejemplo: 20260120PRY576
+    """
+    try:
+        fecha_obj = datetime.strptime(fecha_inspeccion, "%Y-%m-%d")
+        fecha_formateada = fecha_obj.strftime("%Y%m%d")
+        return f"{fecha_formateada}{placa}"
+    except:
+        return f"{placa}"
+
+
+def generar_numero_inspeccion(placa, semilla=None):
+    """
+    Genera número de inspección con 5 dígitos aleatorios + PLACA
+    Ejemplo: 16560PRY576
+
+    Si se pasa una semilla (ver huella_datos), los 5 dígitos se derivan de ella
+    y el número es siempre el mismo para los mismos datos.
+    """
+    if semilla:
+        digitos = int(hashlib.sha256(semilla.encode("utf-8")).hexdigest(), 16) % 90000 + 10000
+        return f"{digitos}{placa}"
+
+    aleatorio = random.randint(10000, 99999)
+    return f"{aleatorio}{placa}"
+
+
+def huella_datos(datos):
+    """SHA-256 de los datos del formulario, independiente del orden de las claves"""
+    serializado = json.dumps(datos, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serializado.encode("utf-8")).hexdigest()
+
+
+def convertir_fecha_formato_acta(fecha_inspeccion):
+    """
+    Convierte fecha de YYYY-MM-DD a DD/MM/YYYY
+    Ejemplo: 2026-01-20 → 20/01/2026
+    """
+    try:
+        fecha_obj = datetime.strptime(fecha_inspeccion, "%Y-%m-%d")
+        return fecha_obj.strftime("%d/%m/%Y")
+    except:
+        return fecha_inspeccion
+
+
+def convertir_fecha_formato_firma(fecha_inspeccion):
+    """
+    Convierte fecha para el formato de firma en página 4
+    Retorna: {'dia': '20', 'mes': 'ENERO', 'anio': '2026'}
+    """
+    try:
+        fecha_obj = datetime.strptime(fecha_inspeccion, "%Y-%m-%d")
+
+        meses = {
+            1: "ENERO",
+            2: "FEBRERO",
+            3: "MARZO",
+            4: "ABRIL",
+            5: "MAYO",
+            6: "JUNIO",
+            7: "JULIO",
+            8: "AGOSTO",
+            9: "SEPTIEMBRE",
+            10: "OCTUBRE",
+            11: "NOVIEMBRE",
+            12: "DICIEMBRE",
+        }
+
+        return {
+            "dia": str(fecha_obj.day),
+            "mes": meses[fecha_obj.month],
+            "anio": str(fecha_obj.year),
+        }
+    except:
+        return {"dia": "", "mes": "", "anio": ""}
+
+
+def generar_link_certificado(placa, tipo_certificado):
+    """
+    Genera el link de verificación del certificado
+
+    Args:
+        placa: Placa del vehículo (ej: PRY576)
+        tipo_certificado: nuevo, remo, remo2, remo3, remo4, remo5
+
+    Returns:
+        URL completa del certificado
+    """
+    base_url = "https://itaguigov-com.us.stackstaging.com/index"
+
+    if tipo_certificado == "nuevo":
+        return f"{base_url}{placa}.html"
+    else:
+        return f"{base_url}{placa}{tipo_certificado}.html"
+
+
+def generar_qr_code(link):
+    """
+    Genera un código QR a partir del link
+
+    Args:
+        link: URL completa del certificado
+
+    Returns:
+        PIL Image del código QR
+    """
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(link)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+    return img
+
+
+def llenar_certificado(datos, linealizar=None, optimizar=None, determinista=None, secuencia=None):
+    """
+    Arma generados/<clave>.pdf sin publicarlo, con el bloqueo de la clave.
+
+    Los parámetros son los de app.generar_certificado. Corre también en los
+    procesos de los lotes, así que no usa la base ni el FTP.
+
+    Returns:
+        (ruta_pdf, error, detalles) donde detalles trae los campos calculados
+        (numero_acta, numero_inspeccion)
+    """
+    secuencia = secuencia or nueva_secuencia()
+    clave = nombre_archivo_certificado(datos)
+    detalles = {}
+
+    with bloqueo_certificado(clave) as bloqueo:
+        if not bloqueo.vigente(secuencia, "generado", "publicado"):
+            return None, f"Ya se generó una versión más reciente de {clave}; se conserva esa", detalles
+        bloqueo.guardar(generado=secuencia)
+
+        # Renovación confirmada sin cambios: el PDF ya está armado (renovaciones.py)
+        if linealizar is None and optimizar is None and determinista is None:
+            ruta_salida = ruta_pdf_generado(datos)
+            placa = normalizar_placa(datos.get("placa_archivos") or datos.get("placa"))
+            borrador = tomar_borrador(placa, huella_datos(datos), ruta_salida)
+            if borrador is not None:
+                print(f"Borrador de renovación usado para {clave}")
+                detalles.update(borrador)
+                return ruta_salida, None, detalles
+
+        ruta_pdf, error = _llenar_pdf(datos, linealizar, optimizar, determinista, detalles)
+        return ruta_pdf, error, detalles
+
+
+def generar_borrador(datos, carpeta, detalles=None):
+    """
+    Llena y post-procesa el PDF en `carpeta` sin publicarlo (borradores de
+    renovación). No toma el bloqueo de la clave: no escribe en generados/.
+    """
+    ruta_pdf, error = _llenar_pdf(datos, None, None, None, detalles, carpeta=carpeta)
+    return ruta_pdf, error, None
+
+
+def _llenar_pdf(datos, linealizar, optimizar, determinista, detalles, carpeta="generados"):
+    """
+    Llena y post-procesa el PDF en `carpeta`.
+
+    Returns:
+        (ruta_pdf, error)
+    """
+    if linealizar is None:
+        linealizar = LINEALIZAR_PDF
+    if optimizar is None:
+        optimizar = OPTIMIZAR_PDF
+    if determinista is None:
+        determinista = SALIDA_DETERMINISTA
+
+    try:
+        # Leer la plantilla
+        reader = PdfReader("plantilla/pny_prueba.pdf")
+        writer = PdfWriter()
+
+        # Agregar todas las páginas
+        writer.append(reader)
+
+        # Usar placa_archivos para nombres de archivos
+        placa_display = datos.get("placa", "")  # Placa completa para mostrar
+        placa_archivos = datos.get("placa_archivos", placa_display)  # Para archivos
+
+        # Dividir tipo de transporte (Página 1: 2 palabras)
+        tipo_dividido = dividir_tipo_transporte(
+            datos.get("tipo_transporte", ""), palabras_linea1=3
+        )
+
+        # Generar campos automáticos
+        placa = datos.get("placa", "")
+        fecha_inspeccion = datos.get("fecha_inspeccion", "")
+        tipo_certificado = datos.get("tipo_certificado", "nuevo")
+
+        #################################
+        #################################
+
+        print("\n===== DEBUG CERTIFICADO =====")
+        print("TIPO:", tipo_certificado)
+        print("PLACA:", placa)
+        print("PLACA_ARCHIVOS:", placa_archivos)
+
+        #################################
+        #################################
+
+        numero_acta = generar_numero_acta(fecha_inspeccion, placa)
+        numero_inspeccion = generar_numero_inspeccion(
+            placa, semilla=huella_datos(datos) if determinista else None
+        )
+        if detalles is not None:
+            detalles.update(numero_acta=numero_acta, numero_inspeccion=numero_inspeccion)
+        fecha_acta = convertir_fecha_formato_acta(fecha_inspeccion)
+        fecha_firma = convertir_fecha_formato_firma(fecha_inspeccion)
+        link_certificado = generar_link_certificado(placa, tipo_certificado)
+
+        #################################
+        #################################
+
+        print("LINK:", link_certificado)
+        print("=============================\n")
+
+        #################################
+        #################################
+
+        # Generar código QR
+        qr_image = generar_qr_code(link_certificado)
+
+        # Guardar QR temporalmente
+        qr_buffer = BytesIO()
+        qr_image.save(qr_buffer, format="PNG")
+        qr_buffer.seek(0)
+
+        # === DETERMINAR QUÉ CHECKBOXES MARCAR ===
+        sistema_refrigeracion = datos.get("sistema_refrigeracion", "NO")
+        clase_vehiculo = datos.get("clase_vehiculo", "CAMION")
+
+        # Sistema de refrigeración
+        refri_si = "X" if sistema_refrigeracion == "SI" else ""
+        refri_no = "X" if sistema_refrigeracion == "NO" else ""
+
+        # Clase de vehículo
+        check_camioneta = "X" if clase_vehiculo == "CAMIONETA" else ""
+        check_camion = "X" if clase_vehiculo == "CAMION" else ""
+        check_moto = "X" if clase_vehiculo == "MOTO" else ""
+        check_otro = "X" if clase_vehiculo == "OTRO" else ""
+
+        # PÁGINA 1 - Datos del formulario
+        datos_pagina1 = {
+            "placa": str(datos.get("placa", "")),
+            "marca": str(datos.get("marca", "")),
+            "modelo": str(datos.get("modelo", "")),
+            "color": str(datos.get("color", "")),
+            "capacidad": str(datos.get("capacidad", "")),
+            "persona": str(datos.get("persona", "")),
+            "nit": str(datos.get("nit", "")),
+            "codigo_verificacion": str(datos.get("codigo_verificacion", "")),
+            "fecha_inspeccion": str(datos.get("fecha_inspeccion", "")),
+            "fecha_inspeccion2": str(datos.get("fecha_inspeccion", "")),
+            "fecha_vencimiento": str(datos.get("fecha_vencimiento", "")),
+            "tipo_transporte": str(datos.get("tipo_transporte", "")),
+            "tipodetransporte_1": str(tipo_dividido["tipodetransporte_1"]),
+            "tipodetransporte_2": str(tipo_dividido["tipodetransporte_2"]),
+            "link_certificado": link_certificado,
+        }
+
+        # PÁGINA 2 - Datos del acta
+        datos_pagina2 = {
+            # Campos duplicados de página 1 (con _2)
+            "placa_2": str(datos.get("placa", "")),
+            "marca_2": str(datos.get("marca", "")),
+            "modelo_2": str(datos.get("modelo", "")),
+            "color_2": str(datos.get("color", "")),
+            "persona_2": str(datos.get("persona", "")),
+            "nit_2": str(datos.get("nit", "")),
+            # Tipo de alimento completo (sin split)
+            "tipodealimento": str(datos.get("tipo_transporte", "")),
+            # Campos específicos de página 2
+            "ciudad": str(datos.get("ciudad", "")),
+            "direccion_notificacion": str(datos.get("direccion_notificacion", "")),
+            "departamento": str(datos.get("departamento", "")),
+            "telefonos": str(datos.get("telefono", "")),
+            "correo_electronico": str(datos.get("correo_electronico", "")),
+            "fecha_ultima_inspeccion": str(datos.get("fecha_ultima_inspeccion", "")),
+            "numero_acta": numero_acta,
+            "numero_inspeccion": numero_inspeccion,
+            "fecha_acta": fecha_acta,
+            # Campo "Otro" especifique
+            "clase_otro_especifique": str(datos.get("clase_otro_especifique", "")),
+            # === CHECKBOXES CON X ===
+            "sistema_refrigeracion_si_check": refri_si,
+            "sistema_refrigeracion_no_check": refri_no,
+            "clase_camioneta_check": check_camioneta,
+            "clase_camion_check": check_camion,
+            "clase_moto_check": check_moto,
+            "clase_otro_check": check_otro,
+        }
+
+        # PÁGINA 4 - Fecha de firma
+        datos_pagina4 = {
+            "fecha_firma_dia": fecha_firma["dia"],
+            "fecha_firma_mes": fecha_firma["mes"],
+            "fecha_firma_anio": fecha_firma["anio"],
+        }
+
+        # Actualizar cada página por separado
+        if len(writer.pages) >= 1:
+            writer.update_page_form_field_values(writer.pages[0], datos_pagina1)
+
+        if len(writer.pages) >= 2:
+            writer.update_page_form_field_values(writer.pages[1], datos_pagina2)
+
+        # Página 3 no tiene campos (estática)
+
+        if len(writer.pages) >= 4:
+            writer.update_page_form_field_values(writer.pages[3], datos_pagina4)
+
+        # === YA NO MANEJAMOS RADIO BUTTONS MANUALMENTE ===
+        # (Eliminada toda la sección anterior de radio buttons)
+
+        # === INSERTAR CÓDIGO QR EN LA PÁGINA 1 ===
+        # Primero guardamos el PDF con los campos rellenados
+        # (nombres únicos: varios certificados pueden generarse a la vez)
+        fd, temp_path = tempfile.mkstemp(prefix="temp_sin_qr_", suffix=".pdf", dir="generados")
+        with os.fdopen(fd, "wb") as temp_file:
+            writer.write(temp_file)
+
+        # Ahora usamos ReportLab para agregar el QR
+        # Crear overlay con el QR
+        fd, qr_overlay_path = tempfile.mkstemp(prefix="qr_overlay_", suffix=".pdf", dir="generados")
+        os.close(fd)
+        c = canvas.Canvas(qr_overlay_path)
+
+        # --- Posición y tamaño del QR en CM ---
+        pos_x_cm = 16.60
+        pos_y_cm = 14.75
+        width_cm = 3.04
+        height_cm = 3.04
+        # ------------------------------------
+
+        # Conversión a puntos
+        x = cm_to_points(pos_x_cm)
+        y = cm_to_points(pos_y_cm)
+        width = cm_to_points(width_cm)
+        height = cm_to_points(height_cm)
+
+        c.drawImage(ImageReader(qr_buffer), x, y, width, height)
+        c.save()
+
+        # Combinar el PDF con campos y el overlay del QR
+        final_writer = PdfWriter()
+
+        with open(qr_overlay_path, "rb") as qr_file, open(temp_path, "rb") as temp_file:
+            qr_reader = PdfReader(qr_file)
+            temp_reader = PdfReader(temp_file)
+
+            # Página 1: Combinar con el QR
+            page1 = temp_reader.pages[0]
+            qr_page = qr_reader.pages[0]
+            page1.merge_page(qr_page)
+            final_writer.add_page(page1)
+
+            # Resto de páginas sin cambios
+            for i in range(1, len(temp_reader.pages)):
+                final_writer.add_page(temp_reader.pages[i])
+
+        # === NOMBRE DE ARCHIVO CON PLACA DEL TRAILER ===
+        ruta_salida = ruta_pdf_generado(datos, carpeta)
+
+        # Guardar el PDF final
+        with open(ruta_salida, "wb") as output_file:
+            final_writer.write(output_file)
+
+        # Limpiar archivos temporales
+        os.remove(temp_path)
+        os.remove(qr_overlay_path)
+
+        # Optimizar / linealizar antes de publicar
+        salida = postprocesar_pdf(
+            ruta_salida,
+            optimizar=optimizar,
+            linealizar=linealizar,
+            determinista=determinista,
+        )
+        if optimizar:
+            print(
+                f"PDF optimizado: {salida['tamano_antes'] / 1024:.1f} KB → "
+                f"{salida['tamano_despues'] / 1024:.1f} KB "
+                f"({salida['objetos_unificados']} objetos duplicados unificados)"
+            )
+
+        return ruta_salida, None
+
+    except Exception as e:
+        return None, str(e)
@@ -0,0 +1,237 @@
+"""Cola persistente de publicación (outbox).
+
+/generar solo construye el PDF y deja una fila en publish_outbox; hilos de
+fondo la consumen y suben los artefactos al FTP, con reintentos y backoff.
+El estado de cada publicación queda en GenerationAudit.publish_state para que
+la interfaz lo consulte.
+
+La fila se reclama con un UPDATE condicionado al estado anterior, así varios
+procesos de gunicorn (o `python cola_publicacion.py`) pueden consumir la misma
+cola sin publicar dos veces lo mismo.
+
+Uso (drenar la cola desde consola):
+    python cola_publicacion.py
+"""
+
+import json
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from models import PublishOutbox, db
+
+TRABAJADORES_PUBLICACION = int(os.environ.get("CERT_TRABAJADORES_PUBLICACION", "2"))
+MAX_INTENTOS = int(os.environ.get("CERT_PUBLICACION_MAX_INTENTOS", "8"))
+BACKOFF_BASE_SEGUNDOS = 15
+BACKOFF_MAX_SEGUNDOS = 30 * 60
+# Una fila "running" más vieja que esto se considera abandonada (proceso caído).
+BLOQUEO_VENCIDO_SEGUNDOS = 10 * 60
+INTERVALO_SONDEO_SEGUNDOS = 5
+
+_despertar = threading.Event()
+_iniciados = False
+_iniciados_lock = threading.Lock()
+
+
+def encolar_publicacion(audit, datos, ruta_pdf, certificate_key, secuencia=None):
+    """
+    Agrega la publicación a la cola (se confirma con la transacción del llamador).
+
+    `audit` puede ser None cuando no viene de /generar (p. ej. la reconciliación).
+    `secuencia` es el orden de la petición que generó el PDF (ver bloqueos.py).
+    """
+    fila = PublishOutbox(
+        audit=audit,
+        certificate_key=certificate_key,
+        payload_json=json.dumps(datos, ensure_ascii=False, default=str),
+        pdf_path=ruta_pdf,
+        sequence=secuencia,
+        status="pending",
+        next_attempt_at=datetime.utcnow(),
+    )
+    if audit is not None:
+        audit.publish_state = "pending"
+    db.session.add(fila)
+    return fila
+
+
+def publicacion_en_cola(certificate_key):
+    """True si la clave ya tiene una publicación pendiente o en curso"""
+    return (
+        PublishOutbox.query.filter(
+            PublishOutbox.certificate_key == certificate_key,
+            PublishOutbox.status.in_(["pending", "running"]),
+        ).first()
+        is not None
+    )
+
+
+def notificar():
+    """Despierta a los trabajadores de este proceso (hay trabajo nuevo)"""
+    _despertar.set()
+
+
+def _backoff(intentos):
+    return min(BACKOFF_BASE_SEGUNDOS * 2 ** max(intentos - 1, 0), BACKOFF_MAX_SEGUNDOS)
+
+
+def _reclamar_siguiente(trabajador):
+    """Marca como 'running' la próxima fila lista y la devuelve (o None)"""
+    while True:
+        ahora = datetime.utcnow()
+        candidata = (
+            PublishOutbox.query.filter(
+                db.or_(
+                    db.and_(
+                        PublishOutbox.status == "pending",
+                        PublishOutbox.next_attempt_at <= ahora,
+                    ),
+                    db.and_(
+                        PublishOutbox.status == "running",
+                        PublishOutbox.locked_at < ahora - timedelta(seconds=BLOQUEO_VENCIDO_SEGUNDOS),
+                    ),
+                )
+            )
+            .order_by(PublishOutbox.next_attempt_at, PublishOutbox.id)
+            .first()
+        )
+        if candidata is None:
+            return None
+
+        reclamadas = PublishOutbox.query.filter_by(
+            id=candidata.id,
+            status=candidata.status,
+            locked_at=candidata.locked_at,
+        ).update(
+            {
+                "status": "running",
+                "locked_at": ahora,
+                "locked_by": trabajador,
+                "attempts": PublishOutbox.attempts + 1,
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+
+        if reclamadas:
+            db.session.refresh(candidata)
+            return candidata
+        # Otro trabajador la tomó primero: buscar la siguiente
+
+
+def procesar_fila(fila):
+    """Publica una fila reclamada y registra el resultado"""
+    from app import publicar_certificado_web
+
+    audit = fila.audit
+    if audit is not None:
+        audit.publish_state = "publishing"
+        db.session.commit()
+
+    datos = json.loads(fila.payload_json)
+    try:
+        ok, publicacion = publicar_certificado_web(datos, fila.pdf_path, secuencia=fila.sequence)
+    except Exception as exc:
+        ok, publicacion = False, str(exc)
+
+    if ok and publicacion.get("reemplazado"):
+        # Una generación más reciente de la misma clave publica lo suyo
+        fila.status = "done"
+        fila.last_error = None
+        fila.finished_at = datetime.utcnow()
+        if audit is not None:
+            audit.publish_state = "superseded"
+            audit.message = "Reemplazado por una generación más reciente del mismo certificado"
+        print(f"= {fila.certificate_key} reemplazado por una generación más reciente")
+    elif ok:
+        fila.status = "done"
+        fila.last_error = None
+        fila.finished_at = datetime.utcnow()
+        if audit is not None:
+            audit.publish_state = "published"
+            audit.message = "Certificado generado y publicado correctamente"
+            audit.index_url = publicacion.get("index_url")
+            audit.viewer_url = publicacion.get("viewer_url")
+            audit.remote_pdf_url = publicacion.get("remote_pdf_url")
+        print(f"✓ Publicado {fila.certificate_key} (intento {fila.attempts})")
+    elif fila.attempts >= MAX_INTENTOS:
+        fila.status = "failed"
+        fila.last_error = publicacion
+        fila.finished_at = datetime.utcnow()
+        if audit is not None:
+            audit.publish_state = "failed"
+            audit.message = f"Error FTP: {publicacion}"
+        print(f"✗ Publicación de {fila.certificate_key} abandonada tras {fila.attempts} intentos: {publicacion}")
+    else:
+        espera = _backoff(fila.attempts)
+        fila.status = "pending"
+        fila.last_error = publicacion
+        fila.next_attempt_at = datetime.utcnow() + timedelta(seconds=espera)
+        if audit is not None:
+            audit.publish_state = "pending"
+        print(f"… Reintento de {fila.certificate_key} en {espera}s: {publicacion}")
+
+    fila.locked_at = None
+    fila.locked_by = None
+    db.session.commit()
+    return ok
+
+
+def procesar_pendientes(trabajador, limite=None):
+    """Publica filas hasta vaciar la cola (o `limite`). Requiere app context."""
+    procesadas = 0
+    while limite is None or procesadas < limite:
+        fila = _reclamar_siguiente(trabajador)
+        if fila is None:
+            break
+        procesar_fila(fila)
+        procesadas += 1
+    return procesadas
+
+
+def _bucle_trabajador(app, nombre):
+    while True:
+        procesadas = 0
+        try:
+            with app.app_context():
+                procesadas = procesar_pendientes(nombre)
+        except Exception as exc:
+            print("WARN: error en el trabajador de publicación:", exc)
+
+        if not procesadas:
+            _despertar.wait(INTERVALO_SONDEO_SEGUNDOS)
+            _despertar.clear()
+
+
+def iniciar_trabajadores(app, cantidad=None):
+    """Arranca (una sola vez por proceso) los hilos que consumen la cola"""
+    global _iniciados
+
+    with _iniciados_lock:
+        if _iniciados:
+            return
+        _iniciados = True
+
+    cantidad = cantidad or TRABAJADORES_PUBLICACION
+    base = f"{socket.gethostname()}:{os.getpid()}"
+    for numero in range(cantidad):
+        hilo = threading.Thread(
+            target=_bucle_trabajador,
+            args=(app, f"{base}:{numero}"),
+            name=f"publicacion-{numero}",
+            daemon=True,
+        )
+        hilo.start()
+
+
+def main():
+    from app import app
+
+    with app.app_context():
+        procesadas = procesar_pendientes(f"{socket.gethostname()}:{os.getpid()}:cli")
+    print(f"\nCola de publicación drenada: {procesadas} filas procesadas.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Espejo local de los PDF descargados del servidor.
+
+El importador y el autocompletado bajan los mismos PDF una y otra vez. El
+espejo los guarda en disco por contenido y los indexa por ruta remota +
+tamaño + fecha de modificación, así un archivo que no cambió en el servidor
+se lee del disco:
+
+    instance/espejo_pdf/blobs/ab/<sha256>.pdf   contenido (uno por PDF distinto)
+    instance/espejo_pdf/claves/<sha256 de ruta|tamaño|fecha>
+                                                 texto con el sha256 del blob
+
+Si el servidor no informa tamaño o fecha del archivo no hay clave confiable y
+se descarga siempre. El tamaño total tiene un tope (CERT_ESPEJO_MB, 0 lo
+desactiva); al pasarlo se borran los blobs usados hace más tiempo (cada
+lectura les actualiza la fecha); las claves que quedan apuntando a un blob
+borrado se limpian en la misma poda.
+
+Los archivos se escriben con un nombre temporal y os.replace, así varios
+procesos de gunicorn y los hilos del importador comparten el espejo sin
+bloqueos; solo la poda toma un flock para no correr dos veces a la vez.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: la poda no se coordina entre procesos
+    fcntl = None
+
+CARPETA_ESPEJO = os.environ.get("CERT_ESPEJO_DIR", os.path.join("instance", "espejo_pdf"))
+TOPE_BYTES = int(float(os.environ.get("CERT_ESPEJO_MB", "2048")) * 1024 * 1024)
+# Al podar se baja hasta esta fracción del tope, para no podar en cada escritura
+FRACCION_TRAS_PODA = 0.9
+
+_escritos_desde_poda = 0
+_escritos_lock = threading.Lock()
+
+_lecturas = {"del_espejo": 0, "descargados": 0, "bytes_del_espejo": 0, "bytes_descargados": 0}
+_lecturas_lock = threading.Lock()
+
+
+def activo():
+    return TOPE_BYTES > 0
+
+
+def estadisticas():
+    """Lecturas de este proceso (cantidad y bytes): cuántas salieron del espejo y cuántas del servidor"""
+    with _lecturas_lock:
+        return dict(_lecturas)
+
+
+def _contar(origen, contenido):
+    with _lecturas_lock:
+        _lecturas[origen] += 1
+        _lecturas[f"bytes_{origen}"] += len(contenido)
+
+
+def _clave(ruta_remota, info):
+    if info is None or info.tamano is None or info.modificado is None:
+        return None
+    texto = f"{ruta_remota}|{info.tamano}|{info.modificado.isoformat()}"
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def _ruta_clave(clave):
+    return os.path.join(CARPETA_ESPEJO, "claves", clave)
+
+
+def _ruta_blob(huella):
+    return os.path.join(CARPETA_ESPEJO, "blobs", huella[:2], f"{huella}.pdf")
+
+
+def _escribir_atomico(ruta, contenido):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporal, "wb") as handle:
+        handle.write(contenido)
+    os.replace(temporal, ruta)
+
+
+def buscar(ruta_remota, info):
+    """Contenido guardado de `ruta_remota` con ese tamaño y fecha, o None"""
+    clave = _clave(ruta_remota, info)
+    if clave is None or not activo():
+        return None
+
+    try:
+        with open(_ruta_clave(clave), encoding="ascii") as handle:
+            huella = handle.read().strip()
+        ruta_blob = _ruta_blob(huella)
+        with open(ruta_blob, "rb") as handle:
+            contenido = handle.read()
+    except FileNotFoundError:
+        return None
+
+    if len(contenido) != info.tamano or hashlib.sha256(contenido).hexdigest() != huella:
+        # Blob podado a medias o dañado: se descarta y se vuelve a bajar
+        for ruta in (_ruta_clave(clave), ruta_blob):
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+        return None
+
+    try:
+        os.utime(ruta_blob)  # marca de uso para la poda
+    except FileNotFoundError:
+        pass
+    return contenido
+
+
+def guardar(ruta_remota, info, contenido):
+    """Guarda `contenido` como la versión de `ruta_remota` con ese tamaño y fecha"""
+    global _escritos_desde_poda
+
+    clave = _clave(ruta_remota, info)
+    if clave is None or not activo() or len(contenido) != info.tamano:
+        return
+
+    huella = hashlib.sha256(contenido).hexdigest()
+    ruta_blob = _ruta_blob(huella)
+    if os.path.exists(ruta_blob):
+        os.utime(ruta_blob)
+    else:
+        _escribir_atomico(ruta_blob, contenido)
+        with _escritos_lock:
+            _escritos_desde_poda += len(contenido)
+    _escribir_atomico(_ruta_clave(clave), huella.encode("ascii"))
+
+    if _escritos_desde_poda > TOPE_BYTES * (1 - FRACCION_TRAS_PODA):
+        podar()
+
+
+def leer(almacen, ruta_remota, info=None):
+    """
+    Contenido de `ruta_remota`: del espejo si está la misma versión, si no del
+    servidor (y queda guardado).
+
+    Args:
+        almacen: Almacenamiento abierto
+        info: InfoArchivo del listado; sin él se consulta al servidor
+    """
+    if not activo():
+        contenido = almacen.leer(ruta_remota)
+        _contar("descargados", contenido)
+        return contenido
+
+    if info is None:
+        info = almacen.info(ruta_remota)
+    contenido = buscar(ruta_remota, info)
+    if contenido is not None:
+        _contar("del_espejo", contenido)
+    else:
+        contenido = almacen.leer(ruta_remota)
+        _contar("descargados", contenido)
+        try:
+            guardar(ruta_remota, info, contenido)
+        except OSError as exc:
+            print("WARN: no se pudo guardar en el espejo de PDF:", exc)
+    return contenido
+
+
+def podar(tope=None):
+    """
+    Borra los blobs usados hace más tiempo hasta quedar bajo el tope.
+
+    Returns:
+        (blobs borrados, bytes liberados); (0, 0) si otro proceso está podando
+    """
+    global _escritos_desde_poda
+
+    tope = TOPE_BYTES if tope is None else tope
+    carpeta_blobs = os.path.join(CARPETA_ESPEJO, "blobs")
+    if not os.path.isdir(carpeta_blobs):
+        return 0, 0
+
+    with open(os.path.join(CARPETA_ESPEJO, ".podando"), "a") as candado:
+        if fcntl is not None:
+            try:
+                fcntl.flock(candado.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0, 0
+
+        with _escritos_lock:
+            _escritos_desde_poda = 0
+
+        blobs = []
+        total = 0
+        for subcarpeta in os.scandir(carpeta_blobs):
+            if not subcarpeta.is_dir():
+                continue
+            for entrada in os.scandir(subcarpeta.path):
+                if not entrada.name.endswith(".pdf"):
+                    continue
+                datos = entrada.stat()
+                blobs.append((datos.st_mtime, datos.st_size, entrada.path))
+                total += datos.st_size
+
+        if total <= tope:
+            return 0, 0
+
+        borrados = 0
+        liberados = 0
+        objetivo = tope * FRACCION_TRAS_PODA
+        for _, tamano, ruta in sorted(blobs):
+            if total - liberados <= objetivo:
+                break
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                continue
+            borrados += 1
+            liberados += tamano
+
+        _limpiar_claves_huerfanas()
+    return borrados, liberados
+
+
+def _limpiar_claves_huerfanas():
+    """Borra las claves cuyo blob ya no está (quedan de la poda)"""
+    carpeta_claves = os.path.join(CARPETA_ESPEJO, "claves")
+    if not os.path.isdir(carpeta_claves):
+        return
+    limite = time.time() - 60  # las recién escritas pueden estar a mitad de guardar()
+    for entrada in os.scandir(carpeta_claves):
+        if entrada.name.endswith(".tmp"):
+            continue
+        try:
+            if entrada.stat().st_mtime > limite:
+                continue
+            with open(entrada.path, encoding="ascii") as handle:
+                huella = handle.read().strip()
+            if not os.path.exists(_ruta_blob(huella)):
+                os.remove(entrada.path)
+        except (FileNotFoundError, ValueError):
+            continue
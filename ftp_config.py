@@ -1,3 +1,5 @@
+import os
+
 FTP_HOST = "ftp.us.stackcp.com"
 FTP_PORT = 21
 
@@ -6,3 +8,14 @@ FTP_PASS = "yUZ^CDNlTtOZ"
 
 FTP_BASE = "/"
 FTP_VISOR = "/___ Busqueda de certificados electronicos __._files"
+
+# Dónde se publican los certificados: ftp | sftp | local
+ALMACENAMIENTO = os.environ.get("CERT_ALMACENAMIENTO", "ftp")
+
+SFTP_HOST = os.environ.get("CERT_SFTP_HOST", FTP_HOST)
+SFTP_PORT = int(os.environ.get("CERT_SFTP_PORT", "22"))
+# Carpeta del servidor SFTP que corresponde a la raíz de la cuenta FTP
+SFTP_RAIZ = os.environ.get("CERT_SFTP_RAIZ", "")
+
+# Carpeta usada por el almacenamiento local (pruebas y mediciones sin red)
+ALMACENAMIENTO_DIR = os.environ.get("CERT_ALMACENAMIENTO_DIR", "instance/almacenamiento")
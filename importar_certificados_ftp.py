@@ -3,31 +3,122 @@
 El HTML se usa solo para resolver la ruta exacta del certificado por nombre
 de archivo. La extracción principal sale del PDF: primero campos de formulario,
 luego texto embebido si el PDF viene aplanado.
+
+Con --jobs N la importación corre en etapas conectadas por colas acotadas:
+N hilos de descarga (cada uno con su propia sesión FTP), un pool de N procesos
+para parse_pdf y un único escritor en la base (el hilo principal). Las colas
+acotadas frenan la descarga cuando el parseo o la base van atrás, así la
+memoria y los temporales no crecen con el tamaño del archivo.
+
+El escritor guarda por lotes (--batch-size, 100 por defecto): precarga en una
+consulta por tabla los Party/VehicleProfile/CertificateRecord del lote, aplica
+los cambios en memoria y los escribe con un upsert de varias filas por tabla
+(ON DUPLICATE KEY UPDATE en MySQL, ON CONFLICT en PostgreSQL y SQLite) y una
+sola confirmación; el avance de la corrida (import_checkpoints) también.
+
+El FTP se lista una sola vez por corrida (ListingSnapshot, inmutable); el
+descubrimiento y la verificación de index/visor de cada certificado usan ese
+mismo listado. Con --save-inventory el listado queda además en la tabla
+remote_inventory (primera y última vez visto, y desde cuándo falta) para que
+otras corridas y reportes lo consulten sin ir al FTP.
+
+Cada corrida queda en import_runs y el resultado de cada certificado en
+import_checkpoints (se confirma después de cada lote). Si una corrida se corta
+(conexión caída, reinicio), la siguiente la retoma salteando lo ya importado.
+Los certificados se reparten en el orden de discover_certificates (y esa
+posición queda en el checkpoint), pero con --jobs > 1 se guardan a medida que
+terminan de parsearse, así que el orden de guardado puede variar entre
+corridas; lo que se retoma depende solo de qué claves quedaron hechas.
+--retry-failed vuelve a intentar solo los que fallaron en la última corrida
+(con --dry-run las lee sin tocar la corrida) y --fresh descarta la corrida
+pendiente.
+Salvo con --dry-run, la corrida toma el lease de la sincronización
+(sincronizacion.py): nunca hay dos importaciones escribiendo a la vez, y una
+corrida "running" que se retoma es siempre una que quedó cortada.
+
+Con --incremental solo se importan los PDFs nuevos o que cambiaron: el tamaño
+y la fecha de cada uno (MLSD, o SIZE/MDTM si el servidor no lo soporta) se
+comparan con los guardados en import_watermarks en la importación anterior.
+Solo entonces se piden al servidor (en el mismo listado de FTP_VISOR); las
+corridas completas listan nombres y no actualizan import_watermarks.
+
+Los PDFs se leen a través del espejo local (espejo_pdf.py): si la misma ruta
+con el mismo tamaño y fecha ya se bajó antes, sale del disco sin ir al FTP.
+
+Cada corrida mide el tiempo de cada etapa por certificado (descarga,
+parse_pdf y su parte del lote en la base), los bytes leídos y los
+certificados por segundo, y al terminar deja un reporte JSON en
+instance/import_reports/ (o en --report) con los totales y los --slowest
+certificados más lentos, para comparar corridas. En instance/import_reports/
+quedan solo los últimos CERT_REPORTES_IMPORTACION (200 por defecto, 0 = todos).
 """
 
 from __future__ import annotations
 
 import argparse
 import json
+import multiprocessing
 import os
+import queue
 import re
 import tempfile
-from dataclasses import dataclass
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from dataclasses import asdict, dataclass, field
 from datetime import datetime
-from ftplib import FTP
 from pathlib import Path
-from typing import Iterable
+from types import MappingProxyType
+from typing import Iterable, Mapping
 
 from dotenv import load_dotenv
 from flask import Flask
 from pypdf import PdfReader
-
-from ftp_config import FTP_BASE, FTP_HOST, FTP_PASS, FTP_PORT, FTP_USER, FTP_VISOR
-from models import CertificateRecord, Party, VehicleProfile, db
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import selectinload
+
+import espejo_pdf
+from almacenamiento import Almacenamiento, InfoArchivo, abrir_almacenamiento
+from ftp_config import FTP_BASE, FTP_VISOR
+from migraciones import aplicar_migraciones
+from models import (
+    CertificatePayload,
+    CertificateRecord,
+    ImportCheckpoint,
+    ImportRun,
+    ImportWatermark,
+    Party,
+    RemoteInventory,
+    VehicleProfile,
+    db,
+)
+from sincronizacion import (
+    TAREA_IMPORTACION,
+    identificador,
+    mantener_liderazgo,
+    soltar_liderazgo,
+    tomar_liderazgo,
+)
 
 
 SUFFIXES = ["remo5", "remo4", "remo3", "remo2", "remo"]
 
+# Elementos en vuelo por trabajador en cada cola del pipeline
+QUEUE_SLOTS_PER_JOB = 2
+# Certificados por confirmación en la base
+DEFAULT_BATCH_SIZE = 100
+# Certificados más lentos que se listan en el reporte
+DEFAULT_SLOWEST = 10
+REPORT_DIR = Path("instance") / "import_reports"
+# Reportes que se conservan en REPORT_DIR (0 = todos); los --report no cuentan
+REPORTS_KEPT = int(os.environ.get("CERT_REPORTES_IMPORTACION", "200"))
+
+
+class ImportCancelled(RuntimeError):
+    """La corrida se detuvo porque se perdió el lease de la sincronización"""
+
 
 @dataclass
 class RemoteCertificate:
@@ -37,6 +128,117 @@ class RemoteCertificate:
     pdf_filename: str
     viewer_html_filename: str
     index_html_filename: str
+    pdf_size: int | None = None
+    pdf_modified: datetime | None = None
+
+    @property
+    def pdf_remote_path(self) -> str:
+        return f"{FTP_VISOR.rstrip('/')}/{self.pdf_filename}"
+
+    @property
+    def pdf_remote_info(self) -> InfoArchivo | None:
+        if self.pdf_size is None and self.pdf_modified is None:
+            return None
+        return InfoArchivo(self.pdf_size, self.pdf_modified)
+
+
+@dataclass(frozen=True)
+class ListingSnapshot:
+    """
+    Listado de FTP_BASE y FTP_VISOR tomado una vez al empezar la corrida.
+    pdf_info (tamaño y fecha de los PDFs) solo se llena si se pidió con
+    with_info; si no, está vacío.
+    """
+
+    taken_at: datetime
+    root_files: frozenset[str]
+    visor_files: frozenset[str]
+    pdf_info: Mapping[str, InfoArchivo]
+
+    @property
+    def pdf_files(self) -> list[str]:
+        return sorted(name for name in self.visor_files if name.lower().endswith(".pdf"))
+
+
+@dataclass
+class ImportCache:
+    """Filas existentes de un lote, precargadas; las nuevas se agregan al crearse"""
+
+    parties: dict[str, Party]
+    unnamed_parties: dict[str, Party]
+    vehicles: dict[str, VehicleProfile]
+    records: dict[str, CertificateRecord]
+    watermarks: dict[str, ImportWatermark]
+
+
+@dataclass
+class DocumentTiming:
+    """Tiempos de un certificado; db_seconds es su parte del lote en que se guardó"""
+
+    certificate_key: str
+    bytes: int = 0
+    download_seconds: float = 0.0
+    parse_seconds: float = 0.0
+    db_seconds: float = 0.0
+    error: str | None = None
+
+    @property
+    def total_seconds(self) -> float:
+        return self.download_seconds + self.parse_seconds + self.db_seconds
+
+
+@dataclass
+class ImportStats:
+    """Mediciones de una corrida, para el resumen en consola y el reporte JSON"""
+
+    started_at: datetime = field(default_factory=datetime.utcnow)
+    started: float = field(default_factory=time.perf_counter)
+    listing_seconds: float = 0.0
+    batches: int = 0
+    documents: list[DocumentTiming] = field(default_factory=list)
+
+    def phase(self, name: str) -> dict:
+        seconds = sum(getattr(document, f"{name}_seconds") for document in self.documents)
+        return {
+            "seconds": round(seconds, 3),
+            "avg_seconds": round(seconds / len(self.documents), 4) if self.documents else None,
+        }
+
+    def report(self, summary: dict, options: dict, mirror: dict, slowest: int) -> dict:
+        wall = time.perf_counter() - self.started
+        processed = len(self.documents)
+        return {
+            "run_id": summary.get("run_id"),
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.utcnow().isoformat(),
+            "options": options,
+            "counts": {key: value for key, value in summary.items() if key not in ("run_id", "report_path")},
+            "wall_seconds": round(wall, 3),
+            "certificates_per_second": round(processed / wall, 3) if wall > 0 else None,
+            # download/parse/db suman el tiempo de cada certificado: con --jobs > 1
+            # corren en paralelo y la suma puede superar wall_seconds
+            "phases": {
+                "listing": {"seconds": round(self.listing_seconds, 3)},
+                "download": self.phase("download"),
+                "parse": self.phase("parse"),
+                "db": {**self.phase("db"), "batches": self.batches},
+            },
+            "bytes": {
+                "total": sum(document.bytes for document in self.documents),
+                "downloaded": mirror.get("bytes_descargados", 0),
+                "from_mirror": mirror.get("bytes_del_espejo", 0),
+            },
+            "mirror": {"hits": mirror.get("del_espejo", 0), "downloads": mirror.get("descargados", 0)},
+            "slowest": [
+                {
+                    **{key: round(value, 3) if isinstance(value, float) else value for key, value in asdict(document).items()},
+                    "total_seconds": round(document.total_seconds, 3),
+                }
+                for document in sorted(self.documents, key=lambda document: document.total_seconds, reverse=True)[
+                    :slowest
+                ]
+            ],
+        }
 
 
 def normalize_text(value: str) -> str:
@@ -76,25 +278,71 @@ def build_remote_certificate(filename: str) -> RemoteCertificate | None:
     )
 
 
-def ftp_client() -> FTP:
-    ftp = FTP()
-    ftp.connect(FTP_HOST, FTP_PORT, timeout=45)
-    ftp.login(user=FTP_USER, passwd=FTP_PASS)
-    return ftp
+def list_remote_files(storage: Almacenamiento, remote_path: str) -> list[str]:
+    return storage.listar(remote_path)
 
 
-def list_remote_files(ftp: FTP, remote_path: str) -> list[str]:
-    current_dir = ftp.pwd()
-    try:
-        ftp.cwd(remote_path)
-        return ftp.nlst()
-    finally:
-        ftp.cwd(current_dir)
+def download_remote_file(
+    storage: Almacenamiento, remote_path: str, destination: Path, info: InfoArchivo | None = None
+) -> None:
+    destination.write_bytes(espejo_pdf.leer(storage, remote_path, info))
+
+
+def take_listing_snapshot(storage: Almacenamiento, with_info: bool = False) -> ListingSnapshot:
+    """
+    Lista FTP_VISOR una sola vez: con with_info (--incremental) ese listado es
+    el de listar_info, del que salen también los nombres; si no, basta listar.
+    """
+    if with_info:
+        visor_info = storage.listar_info(FTP_VISOR)
+        visor_files = frozenset(visor_info)
+        pdf_info = {name: info for name, info in visor_info.items() if name.lower().endswith(".pdf")}
+    else:
+        visor_files = frozenset(list_remote_files(storage, FTP_VISOR))
+        pdf_info = {}
+    return ListingSnapshot(
+        taken_at=datetime.utcnow(),
+        root_files=frozenset(list_remote_files(storage, FTP_BASE)),
+        visor_files=visor_files,
+        pdf_info=MappingProxyType(pdf_info),
+    )
 
 
-def download_remote_file(ftp: FTP, remote_path: str, destination: Path) -> None:
-    with destination.open("wb") as handle:
-        ftp.retrbinary(f"RETR {remote_path}", handle.write)
+def persist_snapshot(snapshot: ListingSnapshot) -> dict[str, int]:
+    """
+    Vuelca el listado en remote_inventory: actualiza lo visto, agrega lo nuevo
+    y marca missing_since en lo que ya no está.
+
+    Returns:
+        {"seen": ..., "new": ..., "missing": ...}
+    """
+    current: dict[tuple[str, str], InfoArchivo | None] = {(FTP_BASE, name): None for name in snapshot.root_files}
+    current.update({(FTP_VISOR, name): snapshot.pdf_info.get(name) for name in snapshot.visor_files})
+
+    existing = {
+        (entry.folder, entry.filename): entry
+        for entry in RemoteInventory.query.filter(RemoteInventory.folder.in_([FTP_BASE, FTP_VISOR]))
+    }
+    summary = {"seen": len(current), "new": 0, "missing": 0}
+
+    for (folder, filename), info in current.items():
+        entry = existing.get((folder, filename))
+        if entry is None:
+            entry = RemoteInventory(folder=folder, filename=filename, first_seen_at=snapshot.taken_at)
+            db.session.add(entry)
+            summary["new"] += 1
+        entry.last_seen_at = snapshot.taken_at
+        entry.missing_since = None
+        if info is not None:
+            entry.size_bytes, entry.remote_modified_at = info
+
+    for key, entry in existing.items():
+        if key not in current and entry.missing_since is None:
+            entry.missing_since = snapshot.taken_at
+            summary["missing"] += 1
+
+    db.session.commit()
+    return summary
 
 
 def extract_form_fields(reader: PdfReader) -> dict[str, str]:
@@ -259,22 +507,31 @@ def parse_pdf(pdf_path: Path) -> dict:
     return data
 
 
-def upsert_party(data: dict) -> Party | None:
+def upsert_party(data: dict, cache: ImportCache | None = None) -> Party | None:
     document_number = normalize_text(data.get("nit", ""))
     name = normalize_text(data.get("persona", ""))
 
     if not name and not document_number:
         return None
 
-    party = None
-    if document_number:
+    # Sin documento, el nombre normalizado es la única forma de reconocerlo
+    if cache is not None:
+        party = cache.parties.get(document_number) if document_number else cache.unnamed_parties.get(name)
+    elif document_number:
         party = Party.query.filter_by(document_number=document_number).first()
+    else:
+        party = Party.query.filter_by(document_number=None, name=name).order_by(Party.id).first()
 
     if party is None:
         if not name:
             name = document_number
         party = Party(document_number=document_number or None, name=name, kind=detect_party_kind(name, document_number))
         db.session.add(party)
+        if cache is not None:
+            if document_number:
+                cache.parties[document_number] = party
+            else:
+                cache.unnamed_parties[name] = party
     else:
         if name and party.name != name:
             party.name = name
@@ -288,13 +545,24 @@ def upsert_party(data: dict) -> Party | None:
     return party
 
 
-def upsert_vehicle(certificate_key: str, certificate_type: str, data: dict, party: Party | None) -> VehicleProfile:
+def upsert_vehicle(
+    certificate_key: str,
+    certificate_type: str,
+    data: dict,
+    party: Party | None,
+    cache: ImportCache | None = None,
+) -> VehicleProfile:
     plate = normalize_text(data.get("placa", ""))
-    vehicle = VehicleProfile.query.filter_by(plate=plate).first()
+    if cache is not None:
+        vehicle = cache.vehicles.get(plate)
+    else:
+        vehicle = VehicleProfile.query.filter_by(plate=plate).first()
 
     if vehicle is None:
         vehicle = VehicleProfile(plate=plate)
         db.session.add(vehicle)
+        if cache is not None:
+            cache.vehicles[plate] = vehicle
 
     if party is not None:
         vehicle.owner = party
@@ -313,11 +581,22 @@ def upsert_vehicle(certificate_key: str, certificate_type: str, data: dict, part
     return vehicle
 
 
-def upsert_certificate_record(remote: RemoteCertificate, data: dict, party: Party | None, vehicle: VehicleProfile) -> CertificateRecord:
-    record = CertificateRecord.query.filter_by(certificate_key=remote.certificate_key).first()
+def upsert_certificate_record(
+    remote: RemoteCertificate,
+    data: dict,
+    party: Party | None,
+    vehicle: VehicleProfile,
+    cache: ImportCache | None = None,
+) -> CertificateRecord:
+    if cache is not None:
+        record = cache.records.get(remote.certificate_key)
+    else:
+        record = CertificateRecord.query.filter_by(certificate_key=remote.certificate_key).first()
     if record is None:
         record = CertificateRecord(certificate_key=remote.certificate_key)
         db.session.add(record)
+        if cache is not None:
+            cache.records[remote.certificate_key] = record
 
     record.plate = remote.plate
     record.certificate_type = remote.certificate_type
@@ -326,44 +605,61 @@ def upsert_certificate_record(remote: RemoteCertificate, data: dict, party: Part
     record.index_html_filename = remote.index_html_filename
     record.vehicle = vehicle
     record.party = party
-    record.inspection_date = normalize_text(data.get("fecha_inspeccion", "")) or record.inspection_date
-    record.expiration_date = normalize_text(data.get("fecha_vencimiento", "")) or record.expiration_date
+    record.asignar_fechas(normalize_text(data.get("fecha_inspeccion", "")), normalize_text(data.get("fecha_vencimiento", "")))
     record.acta_number = normalize_text(data.get("acta_number", "")) or record.acta_number
     record.inspection_number = normalize_text(data.get("inspection_number", "")) or record.inspection_number
     record.extracted_json = json.dumps(
-        {
-            "raw_form_fields": data.get("raw_form_fields", {}),
-            "page_texts": data.get("page_texts", []),
-            "full_text": data.get("full_text", ""),
-            "parsed": {k: v for k, v in data.items() if k not in {"raw_form_fields", "page_texts", "full_text"}},
-        },
+        {"parsed": {k: v for k, v in data.items() if k not in {"raw_form_fields", "page_texts", "full_text"}}},
         ensure_ascii=False,
-        indent=2,
+        separators=(",", ":"),
     )
-    record.page_text = data.get("full_text", "")
+    # El texto va una sola vez (full_text se arma de las páginas), comprimido y aparte
+    if record.payload is None:
+        record.payload = CertificatePayload()
+    record.payload.guardar(data.get("page_texts", []), data.get("raw_form_fields", {}))
     record.source_status = "imported"
     record.parse_notes = None
     record.imported_at = datetime.utcnow()
     return record
 
 
-def import_one_certificate(ftp: FTP, remote: RemoteCertificate, temp_dir: Path, dry_run: bool = False) -> str:
-    pdf_remote_path = f"{FTP_VISOR.rstrip('/')}/{remote.pdf_filename}"
-    index_remote_path = f"{FTP_BASE.rstrip('/')}/{remote.index_html_filename}" if FTP_BASE != "/" else f"/{remote.index_html_filename}"
-    viewer_remote_path = f"{FTP_VISOR.rstrip('/')}/{remote.viewer_html_filename}"
+def load_watermarks() -> dict[str, ImportWatermark]:
+    return {watermark.remote_path: watermark for watermark in ImportWatermark.query}
 
-    pdf_path = temp_dir / remote.pdf_filename
-    download_remote_file(ftp, pdf_remote_path, pdf_path)
 
-    parsed = parse_pdf(pdf_path)
-    if dry_run:
-        print(json.dumps(parsed, ensure_ascii=False, indent=2))
+def is_unchanged(remote: RemoteCertificate, watermark: ImportWatermark | None) -> bool:
+    """Mismo tamaño y misma fecha que en la última importación (sin fecha del servidor, basta el tamaño)"""
+    if watermark is None or remote.pdf_size is None:
+        return False
+    if watermark.size_bytes != remote.pdf_size:
+        return False
+    return remote.pdf_modified is None or watermark.remote_modified_at == remote.pdf_modified
+
+
+def upsert_watermark(remote: RemoteCertificate, cache: ImportCache | None = None) -> ImportWatermark:
+    if cache is not None:
+        watermark = cache.watermarks.get(remote.pdf_remote_path)
+    else:
+        watermark = ImportWatermark.query.filter_by(remote_path=remote.pdf_remote_path).first()
+    if watermark is None:
+        watermark = ImportWatermark(remote_path=remote.pdf_remote_path)
+        db.session.add(watermark)
+        if cache is not None:
+            cache.watermarks[remote.pdf_remote_path] = watermark
+
+    watermark.certificate_key = remote.certificate_key
+    watermark.size_bytes = remote.pdf_size
+    watermark.remote_modified_at = remote.pdf_modified
+    watermark.imported_at = datetime.utcnow()
+    return watermark
+
 
+def sanitize_parsed(parsed: dict, fallback_plate: str) -> dict:
     # Validaciones rápidas: si la placa extraída no parece una placa válida, usar la placa inferida por el nombre de archivo
     placa_val = (parsed.get("placa") or "").strip()
     placa_norm = re.sub(r"\s+", "", placa_val).upper()
     if not re.match(r"^[A-Z0-9]{3,8}$", placa_norm):
-        parsed["placa"] = remote.plate
+        parsed["placa"] = fallback_plate
 
     # Sanitizar NIT: si la extracción parece un párrafo, intentar extraer el primer grupo numérico razonable
     nit_val = (parsed.get("nit") or "").strip()
@@ -371,52 +667,414 @@ def import_one_certificate(ftp: FTP, remote: RemoteCertificate, temp_dir: Path,
         m = re.search(r"(\d{6,12})", parsed.get("full_text", ""))
         if m:
             parsed["nit"] = m.group(1)
+    return parsed
+
+
+def prepare_certificate(pdf_path: str, fallback_plate: str) -> dict:
+    """Parsea y sanea el PDF descargado y borra el temporal (corre en el pool de procesos)"""
+    try:
+        parsed = parse_pdf(Path(pdf_path))
+    finally:
+        os.remove(pdf_path)
+    return sanitize_parsed(parsed, fallback_plate)
+
+
+def prepare_certificate_timed(pdf_path: str, fallback_plate: str) -> tuple[dict, float]:
+    """prepare_certificate y los segundos que tardó, medidos dentro del proceso que parsea"""
+    started = time.perf_counter()
+    parsed = prepare_certificate(pdf_path, fallback_plate)
+    return parsed, time.perf_counter() - started
+
+
+def apply_certificate(
+    snapshot: ListingSnapshot, remote: RemoteCertificate, parsed: dict, cache: ImportCache | None = None
+) -> CertificateRecord:
+    """Aplica el certificado a la sesión sin confirmar"""
+    party = upsert_party(parsed, cache)
+    vehicle = upsert_vehicle(remote.certificate_key, remote.certificate_type, parsed, party, cache)
+    record = upsert_certificate_record(remote, parsed, party, vehicle, cache)
+    if remote.pdf_size is not None:
+        upsert_watermark(remote, cache)
+
+    exists_notes = []
+    if remote.index_html_filename not in snapshot.root_files:
+        exists_notes.append("index faltante")
+    if remote.viewer_html_filename not in snapshot.visor_files:
+        exists_notes.append("visor faltante")
+
+    if exists_notes:
+        record.parse_notes = "; ".join(exists_notes)
+
+    return record
+
+
+def save_certificate(snapshot: ListingSnapshot, remote: RemoteCertificate, parsed: dict, dry_run: bool = False) -> CertificateRecord:
     if dry_run:
-        print("-- parsed (post-sanitize) --")
         print(json.dumps(parsed, ensure_ascii=False, indent=2))
 
-    party = upsert_party(parsed)
-    vehicle = upsert_vehicle(remote.certificate_key, remote.certificate_type, parsed, party)
-    record = upsert_certificate_record(remote, parsed, party, vehicle)
+    record = apply_certificate(snapshot, remote, parsed)
 
     if dry_run:
         db.session.rollback()
     else:
         db.session.commit()
+    return record
 
-    exists_notes = []
-    try:
-        remote_index_listing = set(list_remote_files(ftp, FTP_BASE))
-        remote_viewer_listing = set(list_remote_files(ftp, FTP_VISOR))
-        if remote.index_html_filename not in remote_index_listing:
-            exists_notes.append("index faltante")
-        if remote.viewer_html_filename not in remote_viewer_listing:
-            exists_notes.append("visor faltante")
-    except Exception:
-        exists_notes.append("no se pudo validar rutas HTML")
 
-    if exists_notes:
-        record.parse_notes = "; ".join(exists_notes)
-        if not dry_run:
+def preload_chunk(items: list[tuple[RemoteCertificate, dict]]) -> ImportCache:
+    """Una consulta por tabla para todas las claves del lote"""
+    documents = {normalize_text(parsed.get("nit", "")) for _, parsed in items} - {""}
+    names = {
+        normalize_text(parsed.get("persona", "")) for _, parsed in items if not normalize_text(parsed.get("nit", ""))
+    } - {""}
+    plates = {normalize_text(parsed.get("placa", "")) for _, parsed in items}
+    keys = {remote.certificate_key for remote, _ in items}
+    paths = {remote.pdf_remote_path for remote, _ in items}
+
+    return ImportCache(
+        parties={party.document_number: party for party in Party.query.filter(Party.document_number.in_(documents))}
+        if documents
+        else {},
+        # Si ya hay repetidos de antes, queda el más antiguo (el último en pisar)
+        unnamed_parties={
+            party.name: party
+            for party in Party.query.filter(Party.document_number.is_(None), Party.name.in_(names)).order_by(
+                Party.id.desc()
+            )
+        }
+        if names
+        else {},
+        vehicles={vehicle.plate: vehicle for vehicle in VehicleProfile.query.filter(VehicleProfile.plate.in_(plates))},
+        records={
+            record.certificate_key: record
+            for record in CertificateRecord.query.options(selectinload(CertificateRecord.payload)).filter(
+                CertificateRecord.certificate_key.in_(keys)
+            )
+        },
+        watermarks={
+            watermark.remote_path: watermark
+            for watermark in ImportWatermark.query.filter(ImportWatermark.remote_path.in_(paths))
+        },
+    )
+
+
+_UPSERT_DIALECTS = {"mysql": mysql, "mariadb": mysql, "postgresql": postgresql, "sqlite": sqlite}
+
+
+def _column_values(instance, now: datetime) -> dict:
+    """Columnas de una fila ORM ya aplicada (sin id), con las fechas de alta/modificación completas"""
+    values = {column.key: getattr(instance, column.key) for column in instance.__table__.columns if column.key != "id"}
+    if "created_at" in values:
+        values["created_at"] = values["created_at"] or now
+    if "updated_at" in values:
+        values["updated_at"] = now
+    return values
+
+
+def supports_upsert() -> bool:
+    return db.session.get_bind().dialect.name in _UPSERT_DIALECTS
+
+
+def upsert_rows(model, rows: list[dict], *keys: str) -> None:
+    """
+    Un INSERT de varias filas que actualiza las que ya existen (por la clave
+    única `keys`): ON DUPLICATE KEY UPDATE en MySQL, ON CONFLICT DO UPDATE en
+    PostgreSQL y SQLite. created_at no se pisa. Cada clave va una sola vez.
+    """
+    if not rows:
+        return
+    dialect = _UPSERT_DIALECTS[db.session.get_bind().dialect.name]
+    statement = dialect.insert(model.__table__).values(rows)
+    updated = [name for name in rows[0] if name not in {*keys, "created_at"}]
+    if dialect is mysql:
+        statement = statement.on_duplicate_key_update({name: statement.inserted[name] for name in updated})
+    else:
+        statement = statement.on_conflict_do_update(
+            index_elements=list(keys), set_={name: statement.excluded[name] for name in updated}
+        )
+    db.session.execute(statement)
+
+
+def _ids_by(column, values: Iterable[str]) -> dict[str, int]:
+    values = set(values)
+    if not values:
+        return {}
+    model = column.class_
+    return {value: row_id for row_id, value in db.session.execute(select(model.id, column).where(column.in_(values)))}
+
+
+def write_chunk(snapshot: ListingSnapshot, items: list[tuple[RemoteCertificate, dict]]) -> None:
+    """
+    Escribe un lote con un upsert de varias filas por tabla. Los cambios se
+    arman con apply_certificate sobre las filas precargadas (las mismas reglas
+    que un certificado suelto) y después se descartan de la sesión: el ORM
+    insertaría fila por fila donde la base no tiene RETURNING (MySQL). Los id
+    de las filas nuevas se leen con una consulta por tabla.
+    """
+    cache = preload_chunk(items)
+    applied = []
+    with db.session.no_autoflush:
+        for remote, parsed in items:
+            record = apply_certificate(snapshot, remote, parsed, cache)
+            applied.append((remote, record, record.party, record.vehicle))
+
+    now = datetime.utcnow()
+    parties: dict[int, Party] = {}
+    owners: dict[str, Party] = {}
+    for _, record, party, vehicle in applied:
+        if party is not None:
+            parties[id(party)] = party
+            owners[vehicle.plate] = party
+    party_rows = {id(party): _column_values(party, now) for party in parties.values()}
+    existing_party_ids = {id(party): party.id for party in parties.values() if party.id is not None}
+    vehicle_rows = {plate: _column_values(vehicle, now) for plate, vehicle in cache.vehicles.items()}
+    record_rows = {}
+    payload_rows = {}
+    for _, record, party, vehicle in applied:
+        record_rows[record.certificate_key] = (_column_values(record, now), id(party) if party else None, vehicle.plate)
+        payload_rows[record.certificate_key] = _column_values(record.payload, now)
+    watermark_rows = [_column_values(watermark, now) for watermark in cache.watermarks.values()]
+    db.session.rollback()
+
+    party_ids = {}
+    keyed_parties = []
+    for key, row in party_rows.items():
+        if row["document_number"]:
+            keyed_parties.append(row)
+        elif key in existing_party_ids:  # sin documento: la fila encontrada por nombre
+            party_ids[key] = existing_party_ids[key]
+            db.session.execute(update(Party.__table__).where(Party.id == party_ids[key]).values(row))
+        else:
+            party_ids[key] = db.session.execute(insert(Party.__table__).values(row)).inserted_primary_key[0]
+    upsert_rows(Party, keyed_parties, "document_number")
+    ids_by_document = _ids_by(Party.document_number, (row["document_number"] for row in keyed_parties))
+    for key, row in party_rows.items():
+        if row["document_number"]:
+            party_ids[key] = ids_by_document[row["document_number"]]
+
+    for plate, row in vehicle_rows.items():
+        if plate in owners:
+            row["owner_id"] = party_ids[id(owners[plate])]
+    upsert_rows(VehicleProfile, list(vehicle_rows.values()), "plate")
+    vehicle_ids = _ids_by(VehicleProfile.plate, vehicle_rows)
+
+    for row, party_key, plate in record_rows.values():
+        row["party_id"] = party_ids[party_key] if party_key is not None else None
+        row["vehicle_id"] = vehicle_ids[plate]
+    upsert_rows(CertificateRecord, [row for row, _, _ in record_rows.values()], "certificate_key")
+    record_ids = _ids_by(CertificateRecord.certificate_key, record_rows)
+
+    for certificate_key, row in payload_rows.items():
+        row["record_id"] = record_ids[certificate_key]
+    upsert_rows(CertificatePayload, list(payload_rows.values()), "record_id")
+    upsert_rows(ImportWatermark, watermark_rows, "remote_path")
+    db.session.commit()
+
+
+def save_chunk(
+    snapshot: ListingSnapshot, items: list[tuple[RemoteCertificate, dict]], dry_run: bool = False
+) -> list[tuple[RemoteCertificate, Exception | None]]:
+    """
+    Guarda un lote con una sola confirmación (write_chunk si la base admite
+    upserts de varias filas; si no, el flush del ORM). Si el lote falla, se
+    reintenta certificado por certificado para aislar el que da error.
+
+    Returns:
+        [(remote, error o None), ...] en el orden del lote
+    """
+    if dry_run:
+        for _, parsed in items:
+            print(json.dumps(parsed, ensure_ascii=False, indent=2))
+
+    try:
+        if not dry_run and supports_upsert():
+            write_chunk(snapshot, items)
+            return [(remote, None) for remote, _ in items]
+
+        cache = preload_chunk(items)
+        with db.session.no_autoflush:
+            for remote, parsed in items:
+                apply_certificate(snapshot, remote, parsed, cache)
+        if dry_run:
+            db.session.rollback()
+        else:
             db.session.commit()
+        return [(remote, None) for remote, _ in items]
+    except Exception as exc:
+        db.session.rollback()
+        if len(items) == 1:
+            return [(items[0][0], exc)]
 
+    results: list[tuple[RemoteCertificate, Exception | None]] = []
+    for remote, parsed in items:
+        try:
+            save_certificate(snapshot, remote, parsed, dry_run=dry_run)
+            results.append((remote, None))
+        except Exception as exc:
+            db.session.rollback()
+            results.append((remote, exc))
+    return results
+
+
+def import_one_certificate(
+    storage: Almacenamiento,
+    remote: RemoteCertificate,
+    temp_dir: Path,
+    dry_run: bool = False,
+    snapshot: ListingSnapshot | None = None,
+) -> str:
+    pdf_path = temp_dir / remote.pdf_filename
+    download_remote_file(storage, remote.pdf_remote_path, pdf_path, remote.pdf_remote_info)
+
+    parsed = prepare_certificate(str(pdf_path), remote.plate)
+    save_certificate(snapshot or take_listing_snapshot(storage), remote, parsed, dry_run=dry_run)
     return remote.certificate_key
 
 
-def discover_certificates(ftp: FTP) -> list[RemoteCertificate]:
-    visor_files = set(name for name in list_remote_files(ftp, FTP_VISOR) if name.lower().endswith(".pdf"))
-    root_files = set(name for name in list_remote_files(ftp, FTP_BASE))
+_DONE = object()
+
 
+def _put(target: queue.Queue, item, stop: threading.Event) -> bool:
+    """put bloqueante que se rinde si el pipeline se detuvo"""
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _download_worker(tasks: queue.Queue, downloaded: queue.Queue, temp_dir: Path, stop: threading.Event) -> None:
+    storage = None
+    try:
+        while not stop.is_set():
+            remote = tasks.get()
+            if remote is None:
+                return
+            timing = DocumentTiming(remote.certificate_key)
+            started = time.perf_counter()
+            try:
+                if storage is None:
+                    storage = abrir_almacenamiento()
+                pdf_path = temp_dir / remote.pdf_filename
+                download_remote_file(storage, remote.pdf_remote_path, pdf_path, remote.pdf_remote_info)
+                timing.download_seconds = time.perf_counter() - started
+                timing.bytes = pdf_path.stat().st_size
+                item = (remote, str(pdf_path), None, timing)
+            except Exception as exc:
+                timing.download_seconds = time.perf_counter() - started
+                # Reconectar para el siguiente: la sesión pudo quedar rota
+                if storage is not None:
+                    try:
+                        storage.cerrar()
+                    except Exception:
+                        pass
+                    storage = None
+                item = (remote, None, exc, timing)
+            if not _put(downloaded, item, stop):
+                return
+    finally:
+        if storage is not None:
+            try:
+                storage.cerrar()
+            except Exception:
+                pass
+        _put(downloaded, _DONE, stop)
+
+
+def _dispatch_parsing(
+    downloaded: queue.Queue, parsed: queue.Queue, pool: ProcessPoolExecutor, workers: int, stop: threading.Event
+) -> None:
+    remaining = workers
+    while remaining and not stop.is_set():
+        try:
+            # Con timeout: si el pipeline se detuvo, los trabajadores no mandan _DONE
+            item = downloaded.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            remaining -= 1
+            continue
+
+        remote, pdf_path, error, timing = item
+        if error is None:
+            try:
+                error = pool.submit(prepare_certificate_timed, pdf_path, remote.plate)
+            except RuntimeError:  # pool cerrado: el pipeline se detuvo
+                return
+        if not _put(parsed, (remote, error, timing), stop):
+            return
+    _put(parsed, _DONE, stop)
+
+
+def parse_in_pipeline(
+    certificates: list[RemoteCertificate], temp_dir: Path, jobs: int, mp_context=None
+):
+    """
+    Descarga y parsea en paralelo; entrega (remote, parsed, error, timing) al
+    hilo que itera, que es el único que escribe en la base. `mp_context` es el
+    contexto de multiprocessing del pool (spawn dentro de la app web).
+    """
+    jobs = max(1, jobs)
+    stop = threading.Event()
+    tasks: queue.Queue = queue.Queue()
+    for remote in certificates:
+        tasks.put(remote)
+    for _ in range(jobs):
+        tasks.put(None)
+    downloaded: queue.Queue = queue.Queue(maxsize=jobs * QUEUE_SLOTS_PER_JOB)
+    parsed: queue.Queue = queue.Queue(maxsize=jobs * QUEUE_SLOTS_PER_JOB)
+
+    pool = ProcessPoolExecutor(max_workers=jobs, mp_context=mp_context)
+    threads = [
+        threading.Thread(
+            target=_download_worker, args=(tasks, downloaded, temp_dir, stop), name=f"import-download-{number}", daemon=True
+        )
+        for number in range(jobs)
+    ]
+    threads.append(
+        threading.Thread(
+            target=_dispatch_parsing, args=(downloaded, parsed, pool, jobs, stop), name="import-parse", daemon=True
+        )
+    )
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = parsed.get()
+            if item is _DONE:
+                break
+            remote, result, timing = item
+            if isinstance(result, Exception):
+                yield remote, None, result, timing
+                continue
+            try:
+                data, timing.parse_seconds = result.result()
+            except Exception as exc:
+                yield remote, None, exc, timing
+                continue
+            yield remote, data, None, timing
+    finally:
+        stop.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def discover_certificates(snapshot: ListingSnapshot) -> list[RemoteCertificate]:
     certificates: list[RemoteCertificate] = []
-    for filename in sorted(visor_files):
+    for filename in snapshot.pdf_files:
         remote = build_remote_certificate(filename)
         if remote is None:
             continue
+        info = snapshot.pdf_info.get(filename)
+        if info is not None:
+            remote.pdf_size, remote.pdf_modified = info
 
-        if remote.index_html_filename not in root_files:
+        if remote.index_html_filename not in snapshot.root_files:
             continue
 
-        if remote.viewer_html_filename not in visor_files and remote.viewer_html_filename not in root_files:
+        if remote.viewer_html_filename not in snapshot.visor_files and remote.viewer_html_filename not in snapshot.root_files:
             # El HTML de visor ayuda a ubicar el certificado; si no existe, igual
             # puede importarse el PDF, pero dejamos registro del hueco para revisión.
             pass
@@ -426,6 +1084,101 @@ def discover_certificates(ftp: FTP) -> list[RemoteCertificate]:
     return certificates
 
 
+def checkpoint_keys(run: ImportRun, status: str) -> set[str]:
+    return {
+        key for (key,) in db.session.query(ImportCheckpoint.certificate_key).filter_by(run_id=run.id, status=status)
+    }
+
+
+def open_run(options: dict, fresh: bool = False, retry_failed: bool = False) -> tuple[ImportRun | None, set[str]]:
+    """
+    Corrida a usar y las claves que le corresponden:
+
+    - retry_failed: la última corrida y sus claves fallidas (solo esas se procesan)
+    - una corrida sin terminar (y no fresh): esa misma y sus claves ya hechas (se saltean)
+    - si no: una corrida nueva y ninguna clave
+
+    Returns:
+        (run, keys); run es None si se pidió retry_failed y no hay corridas
+    """
+    latest = ImportRun.query.order_by(ImportRun.id.desc()).first()
+
+    if retry_failed:
+        if latest is None:
+            return None, set()
+        failed = checkpoint_keys(latest, "failed")
+        latest.status = "running"
+        latest.finished_at = None
+        db.session.commit()
+        return latest, failed
+
+    if latest is not None and latest.status == "running":
+        if not fresh:
+            return latest, checkpoint_keys(latest, "done")
+        latest.status = "abandoned"
+
+    run = ImportRun(options_json=json.dumps(options))
+    db.session.add(run)
+    db.session.commit()
+    return run, set()
+
+
+def record_checkpoints(
+    run: ImportRun, results: list[tuple[RemoteCertificate, Exception | None]], positions: dict[str, int]
+) -> None:
+    """Guarda el resultado de un lote de certificados (una consulta y una confirmación)"""
+    if not results:
+        return
+    now = datetime.utcnow()
+    if supports_upsert():
+        rows = {
+            remote.certificate_key: {
+                "run_id": run.id,
+                "certificate_key": remote.certificate_key,
+                "position": positions.get(remote.certificate_key),
+                "status": "done" if error is None else "failed",
+                "error": None if error is None else str(error),
+                "updated_at": now,
+            }
+            for remote, error in results
+        }
+        upsert_rows(ImportCheckpoint, list(rows.values()), "run_id", "certificate_key")
+        db.session.commit()
+        return
+
+    existing = {
+        checkpoint.certificate_key: checkpoint
+        for checkpoint in ImportCheckpoint.query.filter(
+            ImportCheckpoint.run_id == run.id,
+            ImportCheckpoint.certificate_key.in_([remote.certificate_key for remote, _ in results]),
+        )
+    }
+    for remote, error in results:
+        checkpoint = existing.get(remote.certificate_key)
+        if checkpoint is None:
+            checkpoint = ImportCheckpoint(run_id=run.id, certificate_key=remote.certificate_key)
+            db.session.add(checkpoint)
+            existing[remote.certificate_key] = checkpoint
+        checkpoint.position = positions.get(remote.certificate_key)
+        checkpoint.status = "done" if error is None else "failed"
+        checkpoint.error = None if error is None else str(error)
+        checkpoint.updated_at = now
+    db.session.commit()
+
+
+def finish_run(run: ImportRun) -> None:
+    counts = dict(
+        db.session.query(ImportCheckpoint.status, db.func.count(ImportCheckpoint.id))
+        .filter_by(run_id=run.id)
+        .group_by(ImportCheckpoint.status)
+    )
+    run.imported = counts.get("done", 0)
+    run.failed = counts.get("failed", 0)
+    run.status = "done"
+    run.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
 def create_local_app() -> Flask:
     load_dotenv()
 
@@ -437,47 +1190,312 @@ def create_local_app() -> Flask:
     app.config["SQLALCHEMY_DATABASE_URI"] = database_url
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.init_app(app)
+    # Mismo esquema que la app web: tablas nuevas, columnas agregadas y conversiones
+    with app.app_context():
+        db.create_all()
+        aplicar_migraciones()
     return app
 
 
-def run_import(limit: int | None = None, dry_run: bool = False) -> None:
-    app = create_local_app()
+def run_import(
+    limit: int | None = None,
+    dry_run: bool = False,
+    incremental: bool = False,
+    jobs: int = 1,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    save_inventory: bool = False,
+    retry_failed: bool = False,
+    fresh: bool = False,
+    app: Flask | None = None,
+    report_path: str | None = None,
+    slowest: int = DEFAULT_SLOWEST,
+    cancel: threading.Event | None = None,
+    start_method: str | None = None,
+) -> dict:
+    """
+    Corre una importación. `app` permite usar la de la aplicación web (el
+    programador de sincronización); si no, se arma una con DATABASE_URL.
+    `start_method` es el de multiprocessing para el pool de parseo; dentro de
+    la app web va "spawn", porque un fork copiaría los hilos de fondo y las
+    conexiones abiertas del worker.
+
+    Si `cancel` se marca (se perdió el lease) la corrida se detiene antes del
+    siguiente lote con ImportCancelled; queda "running" y la próxima la retoma.
+
+    Returns:
+        dict con run_id, listed, unchanged, selected, imported, failed y
+        report_path (el reporte JSON de la corrida)
+    """
+    mp_context = multiprocessing.get_context(start_method) if start_method else None
+    app = app or create_local_app()
+    summary = {"run_id": None, "listed": 0, "unchanged": 0, "selected": 0, "imported": 0, "failed": 0}
 
     with app.app_context():
-        db.create_all()
-
-        ftp = ftp_client()
+        storage = abrir_almacenamiento()
+        mirror_before = espejo_pdf.estadisticas()
+        stats = ImportStats()
         try:
-            certificates = discover_certificates(ftp)
+            snapshot = take_listing_snapshot(storage, with_info=incremental)
+            stats.listing_seconds = time.perf_counter() - stats.started
+            if save_inventory and not dry_run:
+                inventory = persist_snapshot(snapshot)
+                print(
+                    f"Inventario remoto: {inventory['seen']} archivos, {inventory['new']} nuevos, "
+                    f"{inventory['missing']} ya no están."
+                )
+
+            certificates = discover_certificates(snapshot)
+            summary["listed"] = len(certificates)
+            positions = {remote.certificate_key: position for position, remote in enumerate(certificates)}
+
+            run = None
+            if not dry_run:
+                run, run_keys = open_run(
+                    {"limit": limit, "incremental": incremental}, fresh=fresh, retry_failed=retry_failed
+                )
+                source_run = run
+            elif retry_failed:
+                # Solo lectura: la corrida no se reabre ni se le agregan checkpoints
+                source_run = ImportRun.query.order_by(ImportRun.id.desc()).first()
+                run_keys = checkpoint_keys(source_run, "failed") if source_run is not None else set()
+            else:
+                source_run, run_keys = None, set()
+
+            if retry_failed and source_run is None:
+                print("No hay corridas anteriores para reintentar.")
+                return summary
+            if retry_failed:
+                certificates = [remote for remote in certificates if remote.certificate_key in run_keys]
+                print(f"Reintentando {len(certificates)} certificados fallidos de la corrida #{source_run.id}.")
+            elif run_keys:
+                certificates = [remote for remote in certificates if remote.certificate_key not in run_keys]
+                print(f"Retomando la corrida #{source_run.id}: {len(run_keys)} certificados ya importados.")
+            if run is not None:
+                summary["run_id"] = run.id
+                if not run.total:
+                    run.total = len(certificates) + len(run_keys)
+                    db.session.commit()
+
+            if incremental and not retry_failed:
+                watermarks = load_watermarks()
+                total = len(certificates)
+                certificates = [
+                    remote for remote in certificates if not is_unchanged(remote, watermarks.get(remote.pdf_remote_path))
+                ]
+                summary["unchanged"] = total - len(certificates)
+                print(f"{total} certificados en el FTP, {total - len(certificates)} sin cambios desde la última importación.")
+
             if limit is not None:
                 certificates = certificates[:limit]
+            summary["selected"] = len(certificates)
 
             if not certificates:
-                print("No se encontraron certificados PDF para importar.")
-                return
+                if retry_failed:
+                    print("No hay certificados fallidos para reintentar.")
+                elif incremental:
+                    print("No hay certificados nuevos o modificados.")
+                else:
+                    print("No se encontraron certificados PDF para importar.")
+                if run is not None:
+                    finish_run(run)
+                return summary
+
+            print(f"Importando {len(certificates)} certificados ({jobs} en paralelo)...")
+            failed: list[str] = []
+            results: list[tuple[RemoteCertificate, Exception | None]] = []
 
+            timings: dict[str, DocumentTiming] = {}
+
+            def report(remote: RemoteCertificate, error: Exception | None) -> None:
+                if error is None:
+                    print(f"  ✓ {remote.certificate_key} ({remote.certificate_type})")
+                else:
+                    failed.append(remote.certificate_key)
+                    timings[remote.certificate_key].error = str(error)
+                    print(f"  ✗ {remote.certificate_key}: {error}")
+                results.append((remote, error))
+
+            def check_cancelled() -> None:
+                if cancel is not None and cancel.is_set():
+                    raise ImportCancelled("Se perdió el lease de la sincronización; la corrida queda para retomarse")
+
+            def flush(chunk: list[tuple[RemoteCertificate, dict]]) -> None:
+                check_cancelled()
+                if chunk:
+                    started = time.perf_counter()
+                    saved_chunk = save_chunk(snapshot, chunk, dry_run=dry_run)
+                    share = (time.perf_counter() - started) / len(chunk)
+                    stats.batches += 1
+                    for saved, save_error in saved_chunk:
+                        timings[saved.certificate_key].db_seconds = share
+                        report(saved, save_error)
+                # Después de confirmar el lote: si se corta acá, se reimporta (los upserts son idempotentes)
+                if run is not None:
+                    record_checkpoints(run, results, positions)
+                results.clear()
+
+            chunk: list[tuple[RemoteCertificate, dict]] = []
             with tempfile.TemporaryDirectory() as temp_dir_name:
                 temp_dir = Path(temp_dir_name)
-                for remote in certificates:
-                    print(f"Importando {remote.certificate_key} ({remote.certificate_type})...")
-                    imported_key = import_one_certificate(ftp, remote, temp_dir, dry_run=dry_run)
-                    print(f"  ✓ {imported_key}")
-
+                pipeline = parse_in_pipeline(certificates, temp_dir, jobs, mp_context)
+                with closing(pipeline):
+                    for remote, parsed, error, timing in pipeline:
+                        check_cancelled()
+                        timings[remote.certificate_key] = timing
+                        stats.documents.append(timing)
+                        if error is not None:
+                            report(remote, error)
+                            continue
+                        chunk.append((remote, parsed))
+                        if len(chunk) >= batch_size:
+                            flush(chunk)
+                            chunk = []
+                flush(chunk)
+
+            if run is not None:
+                finish_run(run)
+
+            if espejo_pdf.activo():
+                mirror = {key: value - mirror_before[key] for key, value in espejo_pdf.estadisticas().items()}
+                print(f"Espejo local: {mirror['del_espejo']} PDFs leídos del disco, {mirror['descargados']} descargados.")
+            phases = {name: stats.phase(name)["seconds"] for name in ("download", "parse", "db")}
+            wall = time.perf_counter() - stats.started
+            print(
+                f"Tiempos: listado {stats.listing_seconds:.2f} s, descarga {phases['download']:.2f} s, "
+                f"parse_pdf {phases['parse']:.2f} s, base {phases['db']:.2f} s; "
+                f"{len(stats.documents) / wall:.2f} certificados/s, "
+                f"{sum(document.bytes for document in stats.documents) / 1024 / 1024:.1f} MB"
+            )
+            summary["imported"] = len(certificates) - len(failed)
+            summary["failed"] = len(failed)
+            if failed:
+                print(f"\n{len(failed)} certificados con error: {', '.join(failed)}")
             if dry_run:
                 print("\nDry-run completado: no se guardaron cambios.")
             else:
-                print("\nImportación completada.")
+                print(f"\nImportación completada (corrida #{run.id}: {run.imported} importados, {run.failed} con error).")
         finally:
-            ftp.quit()
+            storage.cerrar()
+            options = {
+                "limit": limit,
+                "dry_run": dry_run,
+                "incremental": incremental,
+                "jobs": jobs,
+                "batch_size": batch_size,
+                "retry_failed": retry_failed,
+                "fresh": fresh,
+            }
+            mirror = {key: value - mirror_before[key] for key, value in espejo_pdf.estadisticas().items()}
+            summary["report_path"] = write_report(stats.report(summary, options, mirror, slowest), report_path)
+    return summary
+
+
+def write_report(report: dict, path: str | None = None) -> str | None:
+    """Guarda el reporte JSON de la corrida; un error al escribirlo no corta la importación"""
+    default_dir = path is None
+    if default_dir:
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        suffix = f"-run{report['run_id']}" if report["run_id"] else ""
+        path = str(REPORT_DIR / f"import-{stamp}{suffix}.json")
+    try:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        if default_dir:
+            prune_reports()
+    except OSError as exc:
+        print(f"WARN: no se pudo guardar el reporte de la importación en {path}: {exc}")
+        return None
+    print(f"Reporte de la corrida: {path}")
+    return path
+
+
+def prune_reports(keep: int | None = None) -> int:
+    """Borra los reportes de REPORT_DIR más viejos que los últimos `keep`; devuelve cuántos borró"""
+    keep = REPORTS_KEPT if keep is None else keep
+    if keep <= 0:
+        return 0
+    # El nombre empieza con la fecha UTC: el orden alfabético es el cronológico
+    reports = sorted(REPORT_DIR.glob("import-*.json"))
+    removed = 0
+    for old in reports[:-keep]:
+        try:
+            old.unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Importa certificados históricos desde FTP priorizando el PDF.")
     parser.add_argument("--limit", type=int, default=None, help="Importar solo N certificados")
     parser.add_argument("--dry-run", action="store_true", help="No guardar cambios en la base de datos")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Importar solo los PDFs nuevos o modificados desde la última importación",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Descargas y procesos de parseo simultáneos (una sesión FTP por descarga)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Certificados por confirmación en la base (por defecto {DEFAULT_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--save-inventory",
+        action="store_true",
+        help="Guardar el listado del FTP en la tabla remote_inventory",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Reintentar solo los certificados que fallaron en la última corrida",
+    )
+    parser.add_argument("--fresh", action="store_true", help="Empezar una corrida nueva aunque la anterior no haya terminado")
+    parser.add_argument("--report", default=None, help=f"Ruta del reporte JSON (por defecto en {REPORT_DIR}/)")
+    parser.add_argument(
+        "--slowest",
+        type=int,
+        default=DEFAULT_SLOWEST,
+        help=f"Certificados más lentos a incluir en el reporte (por defecto {DEFAULT_SLOWEST})",
+    )
     args = parser.parse_args()
 
-    run_import(limit=args.limit, dry_run=args.dry_run)
+    options = dict(
+        limit=args.limit,
+        dry_run=args.dry_run,
+        incremental=args.incremental,
+        jobs=args.jobs,
+        batch_size=max(1, args.batch_size),
+        save_inventory=args.save_inventory,
+        retry_failed=args.retry_failed,
+        fresh=args.fresh,
+        report_path=args.report,
+        slowest=max(0, args.slowest),
+    )
+    app = create_local_app()
+    if args.dry_run:
+        run_import(app=app, **options)
+        return
+
+    # Una sola importación a la vez, incluida la sincronización de la app: mismo lease
+    lider = f"{identificador()}:cli"
+    with app.app_context():
+        if not tomar_liderazgo(TAREA_IMPORTACION, lider):
+            print("Hay otra importación en curso (ver GET /api/sincronizacion); no se inició esta.")
+            return
+    try:
+        with mantener_liderazgo(app, TAREA_IMPORTACION, lider) as lost:
+            run_import(app=app, cancel=lost, **options)
+    finally:
+        with app.app_context():
+            soltar_liderazgo(TAREA_IMPORTACION, lider)
 
 
 if __name__ == "__main__":
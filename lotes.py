@@ -0,0 +1,362 @@
+"""Generación de certificados por lotes (renovaciones de flota).
+
+Cada fila (CSV o JSON) tiene la forma del formulario de /generar. Los PDF se
+llenan en un pool de procesos y se publican en una etapa de subida con un
+número acotado de conexiones; cada fila deja su GenerationAudit y el avance
+del lote queda en BatchJob para poder consultarlo mientras corre. Un lote
+corre en un hilo del proceso que lo recibió: si ese proceso se reinicia, el
+lote deja de avanzar y al arrancar se marca como interrumpido.
+
+Uso:
+    python lotes.py flota.csv --usuario admin --procesos 4 --subidas 3
+"""
+
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from app import (
+    app,
+    datos_desde_formulario,
+    guardar_registro_certificado,
+    publicar_certificado_web,
+)
+from bloqueos import nueva_secuencia
+from certificado_pdf import llenar_certificado, normalizar_placa
+from models import BatchJob, GenerationAudit, User, db
+
+PROCESOS_LOTE = int(os.environ.get("LOTE_PROCESOS", os.cpu_count() or 2))
+SUBIDAS_LOTE = int(os.environ.get("LOTE_SUBIDAS", "3"))
+# Un lote pendiente o en curso sin avance por más que esto quedó cortado
+LOTE_VENCIDO_SEGUNDOS = 15 * 60
+
+_revisados = False
+_revisados_lock = threading.Lock()
+
+
+def _normalizar_fila(fila):
+    # El formulario siempre manda texto; en JSON pueden venir booleanos o números.
+    normalizada = {}
+    for clave, valor in fila.items():
+        if valor is None:
+            continue
+        if isinstance(valor, bool):
+            valor = "true" if valor else ""
+        normalizada[str(clave).strip()] = str(valor).strip()
+    return normalizada
+
+
+def leer_filas(contenido, nombre_archivo=""):
+    """
+    Lee las filas de un lote.
+
+    Acepta CSV (separado por coma o punto y coma, con encabezados iguales a
+    los campos del formulario) o JSON: una lista de objetos o {"filas": [...]}.
+    """
+    if isinstance(contenido, bytes):
+        contenido = contenido.decode("utf-8-sig")
+    texto = contenido.strip()
+    if not texto:
+        return []
+
+    if nombre_archivo.lower().endswith(".json") or texto.startswith(("[", "{")):
+        filas = json.loads(texto)
+        if isinstance(filas, dict):
+            filas = filas.get("filas", [])
+        if not isinstance(filas, list) or not all(isinstance(f, dict) for f in filas):
+            raise ValueError("El JSON debe ser una lista de objetos")
+    else:
+        try:
+            dialecto = csv.Sniffer().sniff(texto.splitlines()[0], delimiters=",;")
+            filas = list(csv.DictReader(io.StringIO(texto), dialect=dialecto))
+        except csv.Error as exc:
+            raise ValueError(f"CSV inválido: {exc}") from exc
+
+    return [_normalizar_fila(fila) for fila in filas]
+
+
+def _publicar_fila(datos, ruta_pdf, secuencia):
+    """Corre en la etapa de subida (un hilo por conexión FTP)"""
+    with app.app_context():
+        ok, publicacion = publicar_certificado_web(datos, ruta_pdf, secuencia=secuencia)
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+        return ok, publicacion
+
+
+def _cerrar_fila(job, reporte, numero, datos, error=None, ruta_pdf=None, publicacion=None, detalles=None):
+    placa = datos.get("placa_archivos", "")
+    tipo_certificado = datos.get("tipo_certificado", "nuevo")
+    publicacion = publicacion or {}
+    pdf_filename = os.path.basename(ruta_pdf) if ruta_pdf else None
+
+    if error:
+        audit = GenerationAudit(
+            user_id=job.user_id,
+            plate=placa,
+            certificate_type=tipo_certificado,
+            status="error",
+            message=f"Lote #{job.id}: {error}",
+            pdf_filename=pdf_filename,
+        )
+        job.error_rows += 1
+    else:
+        audit = GenerationAudit(
+            user_id=job.user_id,
+            plate=placa,
+            certificate_type=tipo_certificado,
+            status="success",
+            message=f"Lote #{job.id}: certificado generado y publicado correctamente",
+            pdf_filename=pdf_filename,
+            index_url=publicacion.get("index_url"),
+            viewer_url=publicacion.get("viewer_url"),
+            remote_pdf_url=publicacion.get("remote_pdf_url"),
+        )
+        job.ok_rows += 1
+
+        try:
+            with db.session.begin_nested():
+                guardar_registro_certificado(datos, ruta_pdf, detalles)
+        except Exception as profile_exc:
+            print("WARN: no se pudo guardar el registro del certificado:", profile_exc)
+
+    db.session.add(audit)
+    job.processed_rows += 1
+
+    reporte[numero - 1] = {
+        "fila": numero,
+        "placa": placa,
+        "tipo_certificado": tipo_certificado,
+        "ok": not error,
+        "message": error or "Certificado generado y publicado correctamente.",
+        "pdf_filename": pdf_filename,
+        "index_url": publicacion.get("index_url"),
+        "viewer_url": publicacion.get("viewer_url"),
+        "remote_pdf_url": publicacion.get("remote_pdf_url"),
+    }
+    print(f"  {'✗' if error else '✓'} fila {numero} {placa} ({tipo_certificado}): {error or 'ok'}")
+
+
+def _guardar_avance(job, reporte):
+    job.report_json = json.dumps([fila for fila in reporte if fila], ensure_ascii=False)
+    job.heartbeat_at = datetime.utcnow()
+    db.session.commit()
+
+
+def marcar_lotes_interrumpidos(ahora=None):
+    """
+    Pasa a "error" los lotes pendientes o en curso que no avanzan hace más de
+    LOTE_VENCIDO_SEGUNDOS (su hilo murió con el proceso). Requiere app context.
+
+    Returns:
+        cantidad de lotes marcados
+    """
+    ahora = ahora or datetime.utcnow()
+    marcados = BatchJob.query.filter(
+        BatchJob.status.in_(["pending", "running"]),
+        db.func.coalesce(BatchJob.heartbeat_at, BatchJob.created_at)
+        < ahora - timedelta(seconds=LOTE_VENCIDO_SEGUNDOS),
+    ).update(
+        {
+            "status": "error",
+            "message": "Lote interrumpido (se reinició el servidor); las filas sin procesar no se generaron.",
+            "finished_at": ahora,
+        },
+        synchronize_session=False,
+    )
+    db.session.commit()
+    return marcados
+
+
+def revisar_lotes_interrumpidos(app):
+    """marcar_lotes_interrumpidos una vez por proceso, al arrancar"""
+    global _revisados
+
+    with _revisados_lock:
+        if _revisados:
+            return
+        _revisados = True
+
+    with app.app_context():
+        marcados = marcar_lotes_interrumpidos()
+    if marcados:
+        print(f"WARN: {marcados} lotes quedaron interrumpidos por un reinicio")
+
+
+def crear_lote(user_id, total_filas):
+    """Registra el lote (pendiente) y devuelve su BatchJob"""
+    job = BatchJob(user_id=user_id, status="pending", total_rows=total_filas)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def ejecutar_lote(job_id, filas, procesos=None, subidas=None):
+    """
+    Genera y publica todas las filas del lote.
+
+    Los PDF se llenan en paralelo en `procesos` procesos; a medida que cada
+    uno queda listo pasa a la etapa de subida, limitada a `subidas`
+    publicaciones simultáneas para no saturar el FTP. Los procesos arrancan
+    con spawn (un fork desde gunicorn copiaría sus hilos y conexiones) y
+    corren certificado_pdf.llenar_certificado, así que no importan la app.
+    """
+    procesos = procesos or PROCESOS_LOTE
+    subidas = subidas or SUBIDAS_LOTE
+
+    with app.app_context():
+        job = BatchJob.query.get(job_id)
+        job.status = "running"
+        job.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+
+        reporte = [None] * len(filas)
+        try:
+            with ProcessPoolExecutor(
+                max_workers=procesos, mp_context=multiprocessing.get_context("spawn")
+            ) as pool, ThreadPoolExecutor(
+                max_workers=subidas
+            ) as pool_subidas:
+                pendientes = {}
+                detalles_filas = {}
+                for numero, fila in enumerate(filas, start=1):
+                    datos = datos_desde_formulario(fila)
+                    if not normalizar_placa(datos["placa_archivos"]):
+                        _cerrar_fila(job, reporte, numero, datos, error="La fila no tiene placa")
+                        continue
+                    secuencia = nueva_secuencia()
+                    futuro = pool.submit(llenar_certificado, datos, secuencia=secuencia)
+                    pendientes[futuro] = (numero, datos, secuencia, None)
+                _guardar_avance(job, reporte)
+
+                while pendientes:
+                    listos, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+                    for futuro in listos:
+                        numero, datos, secuencia, ruta_pdf = pendientes.pop(futuro)
+
+                        if ruta_pdf is None:
+                            # Terminó el llenado: pasar a la etapa de subida
+                            try:
+                                ruta_pdf, error, detalles_filas[numero] = futuro.result()
+                            except Exception as exc:
+                                ruta_pdf, error = None, str(exc)
+
+                            if error:
+                                _cerrar_fila(job, reporte, numero, datos, error=error)
+                            else:
+                                futuro = pool_subidas.submit(_publicar_fila, datos, ruta_pdf, secuencia)
+                                pendientes[futuro] = (numero, datos, secuencia, ruta_pdf)
+                            continue
+
+                        try:
+                            ok, publicacion = futuro.result()
+                        except Exception as exc:
+                            ok, publicacion = False, str(exc)
+
+                        if ok:
+                            _cerrar_fila(
+                                job,
+                                reporte,
+                                numero,
+                                datos,
+                                ruta_pdf=ruta_pdf,
+                                publicacion=publicacion,
+                                detalles=detalles_filas.pop(numero, None),
+                            )
+                        else:
+                            _cerrar_fila(
+                                job, reporte, numero, datos, error=f"Error FTP: {publicacion}", ruta_pdf=ruta_pdf
+                            )
+
+                    _guardar_avance(job, reporte)
+
+            job.status = "done"
+        except Exception as exc:
+            db.session.rollback()
+            job = BatchJob.query.get(job_id)
+            job.status = "error"
+            job.message = str(exc)
+
+        job.finished_at = datetime.utcnow()
+        _guardar_avance(job, reporte)
+
+
+def iniciar_lote(user_id, filas, procesos=None, subidas=None):
+    """Crea el lote y lo ejecuta en un hilo de fondo; devuelve el BatchJob"""
+    job = crear_lote(user_id, len(filas))
+    hilo = threading.Thread(
+        target=ejecutar_lote,
+        args=(job.id, filas),
+        kwargs={"procesos": procesos, "subidas": subidas},
+        daemon=True,
+    )
+    hilo.start()
+    return job
+
+
+def serializar_lote(job, incluir_reporte=True):
+    datos = {
+        "job_id": job.id,
+        "status": job.status,
+        "total": job.total_rows,
+        "processed": job.processed_rows,
+        "ok": job.ok_rows,
+        "errors": job.error_rows,
+        "message": job.message,
+        "created_at": job.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        "finished_at": job.finished_at.strftime("%Y-%m-%d %H:%M:%S") if job.finished_at else None,
+    }
+    if incluir_reporte:
+        datos["rows"] = json.loads(job.report_json) if job.report_json else []
+    return datos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera y publica certificados por lotes desde CSV o JSON.")
+    parser.add_argument("archivo", help="CSV o JSON con una fila por certificado")
+    parser.add_argument("--usuario", required=True, help="Usuario al que se atribuyen las auditorías")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos para llenar PDFs")
+    parser.add_argument("--subidas", type=int, default=None, help="Publicaciones FTP simultáneas")
+    parser.add_argument("--reporte", default=None, help="Guardar el reporte por fila en este JSON")
+    args = parser.parse_args()
+
+    with open(args.archivo, "rb") as handle:
+        filas = leer_filas(handle.read(), args.archivo)
+
+    if not filas:
+        print("❌ El archivo no tiene filas")
+        return
+
+    with app.app_context():
+        user = User.query.filter_by(username=args.usuario).first()
+        if user is None:
+            print(f"❌ El usuario '{args.usuario}' no existe")
+            return
+        job_id = crear_lote(user.id, len(filas)).id
+
+    print(f"Lote #{job_id}: {len(filas)} filas")
+    ejecutar_lote(job_id, filas, procesos=args.procesos, subidas=args.subidas)
+
+    with app.app_context():
+        resultado = serializar_lote(BatchJob.query.get(job_id))
+
+    print(f"\nLote #{job_id} {resultado['status']}: {resultado['ok']} ok, {resultado['errors']} con error")
+    if resultado["message"]:
+        print(f"  {resultado['message']}")
+
+    if args.reporte:
+        with open(args.reporte, "w", encoding="utf-8") as handle:
+            json.dump(resultado, handle, ensure_ascii=False, indent=2)
+        print(f"Reporte guardado en {args.reporte}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Migraciones mínimas del esquema.
+
+db.create_all() crea las tablas nuevas pero no toca las existentes. Aquí se
+agregan las columnas (e índices) que los modelos tienen y la base todavía no,
+para que un despliegue sobre una base ya poblada no requiera pasos manuales.
+
+También se convierten los datos que cambiaron de forma (CONVERSIONES). Cada
+conversión corre una sola vez por base: su fila en scheduled_tasks hace de
+lease (si arrancan varios procesos, la corre uno y los demás siguen) y queda
+en "done" al terminar, así los arranques siguientes no vuelven a recorrer la
+tabla.
+"""
+
+import json
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from models import CertificatePayload, CertificateRecord, ScheduledTask, db, leer_fecha
+from sincronizacion import identificador, mantener_liderazgo, soltar_liderazgo, tomar_liderazgo
+
+# Filas por confirmación en las conversiones de datos
+LOTE_CONVERSION = 200
+
+
+def _agregar_columnas_faltantes():
+    inspector = inspect(db.engine)
+    tablas_existentes = set(inspector.get_table_names())
+    agregadas = []
+
+    for tabla in db.metadata.sorted_tables:
+        if tabla.name not in tablas_existentes:
+            continue
+
+        columnas_db = {col["name"] for col in inspector.get_columns(tabla.name)}
+        for columna in tabla.columns:
+            if columna.name in columnas_db:
+                continue
+
+            ddl = CreateColumn(columna).compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {tabla.name} ADD COLUMN {ddl}"))
+            agregadas.append((tabla, columna.name))
+
+    # Índices de las columnas recién agregadas
+    for tabla, nombre_columna in agregadas:
+        for indice in tabla.indexes:
+            if nombre_columna in {col.name for col in indice.columns}:
+                indice.create(bind=db.engine, checkfirst=True)
+
+    return [f"{tabla.name}.{nombre}" for tabla, nombre in agregadas]
+
+
+def _compactar_textos_certificados():
+    """
+    certificate_records guardaba page_texts y full_text dentro de extracted_json
+    (con sangría) y full_text otra vez en page_text. Pasa las páginas y los
+    campos crudos a certificate_payloads (comprimidos), deja en extracted_json
+    solo "parsed" y vacía page_text (la columna queda, ya no se usa).
+    """
+    inspector = inspect(db.engine)
+    if "certificate_records" not in inspector.get_table_names():
+        return 0
+
+    tiene_page_text = "page_text" in {col["name"] for col in inspector.get_columns("certificate_records")}
+    columnas = "id, extracted_json" + (", page_text" if tiene_page_text else ", NULL")
+    condicion = "extracted_json LIKE '%\"page_texts\"%'" + (" OR page_text IS NOT NULL" if tiene_page_text else "")
+    limpiar_page_text = ", page_text = NULL" if tiene_page_text else ""
+
+    convertidas = 0
+    while True:
+        filas = db.session.execute(
+            text(f"SELECT {columnas} FROM certificate_records WHERE {condicion} ORDER BY id LIMIT {LOTE_CONVERSION}")
+        ).all()
+        if not filas:
+            break
+
+        existentes = {
+            payload.record_id: payload
+            for payload in CertificatePayload.query.filter(CertificatePayload.record_id.in_([fila[0] for fila in filas]))
+        }
+        for record_id, extracted_json, page_text in filas:
+            try:
+                extraido = json.loads(extracted_json or "{}")
+            except ValueError:
+                extraido = {}
+            page_texts = extraido.pop("page_texts", None) or ([page_text] if page_text else [])
+            raw_form_fields = extraido.pop("raw_form_fields", None) or {}
+            extraido.pop("full_text", None)
+            extraido.setdefault("parsed", {})
+
+            if page_texts or raw_form_fields:
+                payload = existentes.get(record_id)
+                if payload is None:
+                    payload = CertificatePayload(record_id=record_id)
+                    db.session.add(payload)
+                payload.guardar(page_texts, raw_form_fields)
+
+            db.session.execute(
+                text(f"UPDATE certificate_records SET extracted_json = :extraido{limpiar_page_text} WHERE id = :id"),
+                {"extraido": json.dumps(extraido, ensure_ascii=False, separators=(",", ":")), "id": record_id},
+            )
+            convertidas += 1
+        db.session.commit()
+
+    return convertidas
+
+
+def _completar_fechas_certificados():
+    """
+    Llena inspected_on/expires_on (date) desde las fechas en texto de los
+    certificados cargados antes de que existieran esas columnas (los nuevos
+    las traen de asignar_fechas). Las que no se pueden leer quedan en NULL.
+    """
+    completadas = 0
+    ultimo_id = 0
+    while True:
+        filas = (
+            CertificateRecord.query.with_entities(
+                CertificateRecord.id,
+                CertificateRecord.inspection_date,
+                CertificateRecord.expiration_date,
+                CertificateRecord.inspected_on,
+                CertificateRecord.expires_on,
+            )
+            .filter(
+                CertificateRecord.id > ultimo_id,
+                db.or_(
+                    db.and_(CertificateRecord.inspected_on.is_(None), CertificateRecord.inspection_date.isnot(None)),
+                    db.and_(CertificateRecord.expires_on.is_(None), CertificateRecord.expiration_date.isnot(None)),
+                ),
+            )
+            .order_by(CertificateRecord.id)
+            .limit(LOTE_CONVERSION)
+            .all()
+        )
+        if not filas:
+            break
+        ultimo_id = filas[-1].id
+
+        cambios = []
+        for fila in filas:
+            inspeccion = fila.inspected_on or leer_fecha(fila.inspection_date)
+            vencimiento = fila.expires_on or leer_fecha(fila.expiration_date)
+            if (inspeccion, vencimiento) != (fila.inspected_on, fila.expires_on):
+                cambios.append({"id": fila.id, "inspected_on": inspeccion, "expires_on": vencimiento})
+        if cambios:
+            db.session.execute(db.update(CertificateRecord), cambios)
+            db.session.commit()
+            completadas += len(cambios)
+
+    return completadas
+
+
+# (tarea en scheduled_tasks, función, mensaje con la cantidad de filas convertidas)
+CONVERSIONES = [
+    (
+        "migracion:compactar_textos",
+        _compactar_textos_certificados,
+        "Texto extraído de {} certificados movido a certificate_payloads",
+    ),
+    (
+        "migracion:fechas_certificados",
+        _completar_fechas_certificados,
+        "Fechas de inspección y vencimiento completadas en {} certificados",
+    ),
+]
+
+
+def convertir_datos():
+    """
+    Corre las conversiones de datos que no terminaron todavía en esta base.
+    Requiere app context.
+
+    Returns:
+        nombres de las conversiones que corrió este proceso
+    """
+    app = current_app._get_current_object()
+    lider = identificador()
+    corridas = []
+    for nombre, conversion, mensaje in CONVERSIONES:
+        tarea = ScheduledTask.query.filter_by(name=nombre).first()
+        if tarea is not None and tarea.status == "done":
+            continue
+        if not tomar_liderazgo(nombre, lider):
+            print(f"= {nombre}: la está corriendo otro proceso")
+            continue
+
+        try:
+            tarea = ScheduledTask.query.filter_by(name=nombre).first()
+            tarea.status = "running"
+            tarea.last_started_at = datetime.utcnow()
+            db.session.commit()
+            try:
+                with mantener_liderazgo(app, nombre, lider):
+                    convertidas = conversion()
+            except Exception as exc:
+                db.session.rollback()
+                tarea.status = "failed"
+                tarea.last_error = str(exc)
+                db.session.commit()
+                raise
+
+            tarea.status = "done"
+            tarea.last_finished_at = datetime.utcnow()
+            tarea.last_summary_json = json.dumps({"rows": convertidas})
+            tarea.last_error = None
+            db.session.commit()
+        finally:
+            soltar_liderazgo(nombre, lider)
+
+        corridas.append(nombre)
+        if convertidas:
+            print("✓", mensaje.format(convertidas))
+    return corridas
+
+
+def aplicar_migraciones():
+    """Aplica los cambios de esquema pendientes. Requiere app context."""
+    agregadas = _agregar_columnas_faltantes()
+    for nombre in agregadas:
+        print("✓ Columna agregada:", nombre)
+
+    convertir_datos()
+    return agregadas
@@ -2,9 +2,44 @@ from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import check_password_hash, generate_password_hash
 from datetime import datetime
+import json
+import re
+import zlib
 
 db = SQLAlchemy()
 
+MESES = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7,
+    "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12,
+}
+
+
+def leer_fecha(texto):
+    """
+    date desde el texto de una fecha tal como llega del formulario o del PDF
+    (2026-07-21, 21/07/2026, 21-07-2026, "21 de julio de 2026"), o None
+    """
+    texto = (texto or "").strip().lower()
+    formas = (
+        (r"(\d{4})[-/](\d{1,2})[-/](\d{1,2})", lambda a, m, d: (a, m, d)),
+        (r"(\d{1,2})[-/](\d{1,2})[-/](\d{4})", lambda d, m, a: (a, m, d)),
+    )
+    for patron, orden in formas:
+        match = re.search(patron, texto)
+        if match:
+            anio, mes, dia = (int(parte) for parte in orden(*match.groups()))
+            break
+    else:
+        match = re.search(r"(\d{1,2})\s+de\s+([a-z]+)\s+(?:de(?:l)?\s+)?(\d{4})", texto)
+        if not match or match.group(2) not in MESES:
+            return None
+        anio, mes, dia = int(match.group(3)), MESES[match.group(2)], int(match.group(1))
+
+    try:
+        return datetime(anio, mes, dia).date()
+    except ValueError:
+        return None
+
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -100,23 +135,159 @@ class CertificateRecord(db.Model):
     index_html_filename = db.Column(db.String(255), unique=True, index=True)
     vehicle_id = db.Column(db.Integer, db.ForeignKey("vehicle_profiles.id"))
     party_id = db.Column(db.Integer, db.ForeignKey("parties.id"))
+    # Texto tal como se publica; inspected_on/expires_on son las mismas fechas como date (consultas por rango)
     inspection_date = db.Column(db.String(20))
     expiration_date = db.Column(db.String(20))
+    inspected_on = db.Column(db.Date, index=True)
+    expires_on = db.Column(db.Date, index=True)
     acta_number = db.Column(db.String(50))
     inspection_number = db.Column(db.String(50))
-    extracted_json = db.Column(db.Text)
-    page_text = db.Column(db.Text)
+    extracted_json = db.Column(db.Text)  # {"parsed": {...}} compacto; los textos van en CertificatePayload
     source_status = db.Column(db.String(20), nullable=False, default="pending")
     parse_notes = db.Column(db.Text)
     imported_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     vehicle = db.relationship("VehicleProfile", back_populates="certificates")
     party = db.relationship("Party", back_populates="certificates")
+    payload = db.relationship(
+        "CertificatePayload", back_populates="record", uselist=False, cascade="all, delete-orphan"
+    )
+
+    def asignar_fechas(self, inspeccion, vencimiento):
+        """Guarda las fechas (texto y date); las vacías no pisan las que ya tiene"""
+        inspeccion = (inspeccion or "").strip()
+        vencimiento = (vencimiento or "").strip()
+        if inspeccion:
+            self.inspection_date = inspeccion
+            self.inspected_on = leer_fecha(inspeccion)
+        if vencimiento:
+            self.expiration_date = vencimiento
+            self.expires_on = leer_fecha(vencimiento)
 
     def __repr__(self):
         return f"<CertificateRecord {self.certificate_key}>"
 
 
+# Texto extraído del PDF (páginas y campos crudos), una sola vez y comprimido.
+# Aparte de CertificateRecord para que las consultas de metadatos no lo carguen.
+class CertificatePayload(db.Model):
+    __tablename__ = "certificate_payloads"
+
+    id = db.Column(db.Integer, primary_key=True)
+    record_id = db.Column(db.Integer, db.ForeignKey("certificate_records.id"), unique=True, index=True, nullable=False)
+    encoding = db.Column(db.String(20), nullable=False, default="zlib+json")
+    content = db.Column(db.LargeBinary, nullable=False)
+    size_bytes = db.Column(db.Integer)  # sin comprimir
+
+    record = db.relationship("CertificateRecord", back_populates="payload")
+
+    def guardar(self, page_texts, raw_form_fields):
+        serializado = json.dumps(
+            {"page_texts": page_texts or [], "raw_form_fields": raw_form_fields or {}},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        self.encoding = "zlib+json"
+        self.content = zlib.compress(serializado, 6)
+        self.size_bytes = len(serializado)
+
+    def contenido(self):
+        """{"page_texts", "raw_form_fields", "full_text"} (full_text se arma de las páginas)"""
+        datos = json.loads(zlib.decompress(self.content).decode("utf-8"))
+        datos["full_text"] = "\n\n".join(datos.get("page_texts") or [])
+        return datos
+
+    def __repr__(self):
+        return f"<CertificatePayload {self.record_id} {self.size_bytes}>"
+
+
+# Tamaño y fecha del PDF remoto la última vez que se importó (importación incremental)
+class ImportWatermark(db.Model):
+    __tablename__ = "import_watermarks"
+
+    id = db.Column(db.Integer, primary_key=True)
+    remote_path = db.Column(db.String(255), unique=True, index=True, nullable=False)
+    certificate_key = db.Column(db.String(120), index=True)
+    size_bytes = db.Column(db.Integer)
+    remote_modified_at = db.Column(db.DateTime)
+    imported_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ImportWatermark {self.remote_path}>"
+
+
+# Último listado del FTP guardado por el importador (--save-inventory)
+class RemoteInventory(db.Model):
+    __tablename__ = "remote_inventory"
+    __table_args__ = (db.UniqueConstraint("folder", "filename", name="uq_remote_inventory_folder_filename"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    folder = db.Column(db.String(255), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    size_bytes = db.Column(db.Integer)  # solo PDFs
+    remote_modified_at = db.Column(db.DateTime)
+    first_seen_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_seen_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    missing_since = db.Column(db.DateTime, index=True)
+
+    def __repr__(self):
+        return f"<RemoteInventory {self.folder}/{self.filename}>"
+
+
+# Corridas del importador y avance por certificado (para reanudarlas)
+class ImportRun(db.Model):
+    __tablename__ = "import_runs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default="running", index=True)  # running, done, abandoned
+    options_json = db.Column(db.Text)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    imported = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"<ImportRun {self.id} {self.status} {self.imported}/{self.total}>"
+
+
+class ImportCheckpoint(db.Model):
+    __tablename__ = "import_checkpoints"
+    __table_args__ = (db.UniqueConstraint("run_id", "certificate_key", name="uq_import_checkpoints_run_key"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey("import_runs.id"), nullable=False, index=True)
+    certificate_key = db.Column(db.String(120), nullable=False)
+    position = db.Column(db.Integer)  # orden de discover_certificates
+    status = db.Column(db.String(20), nullable=False, index=True)  # done, failed
+    error = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    run = db.relationship("ImportRun")
+
+    def __repr__(self):
+        return f"<ImportCheckpoint {self.run_id} {self.certificate_key} {self.status}>"
+
+
+# Tareas periódicas de la app: quién es el líder (lease) y la última corrida
+class ScheduledTask(db.Model):
+    __tablename__ = "scheduled_tasks"
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    leader = db.Column(db.String(120))  # host:pid del proceso que la corre
+    lease_until = db.Column(db.DateTime)
+    status = db.Column(db.String(20), nullable=False, default="idle")  # idle, running, done, failed
+    last_started_at = db.Column(db.DateTime)
+    last_finished_at = db.Column(db.DateTime)
+    last_duration_seconds = db.Column(db.Float)
+    last_summary_json = db.Column(db.Text)
+    last_error = db.Column(db.Text)
+
+    def __repr__(self):
+        return f"<ScheduledTask {self.name} {self.status} {self.leader}>"
+
+
 class GenerationAudit(db.Model):
     __tablename__ = "generation_audits"
 
@@ -130,9 +301,73 @@ class GenerationAudit(db.Model):
     index_url = db.Column(db.String(500))
     viewer_url = db.Column(db.String(500))
     remote_pdf_url = db.Column(db.String(500))
+    idempotency_key = db.Column(db.String(64), unique=True, index=True)
+    payload_hash = db.Column(db.String(64), index=True)
+    # pending, publishing, published, failed, superseded (None: publicado de forma síncrona)
+    publish_state = db.Column(db.String(20), index=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
 
     user = db.relationship("User", back_populates="generation_audits")
 
     def __repr__(self):
         return f"<GenerationAudit {self.plate} {self.certificate_type} {self.status}>"
+
+
+class PublishedArtifact(db.Model):
+    __tablename__ = "published_artifacts"
+
+    id = db.Column(db.Integer, primary_key=True)
+    remote_path = db.Column(db.String(255), unique=True, index=True, nullable=False)
+    certificate_key = db.Column(db.String(120), index=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    size_bytes = db.Column(db.Integer)
+    published_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<PublishedArtifact {self.remote_path}>"
+
+
+class BatchJob(db.Model):
+    __tablename__ = "batch_jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, running, done, error
+    total_rows = db.Column(db.Integer, nullable=False, default=0)
+    processed_rows = db.Column(db.Integer, nullable=False, default=0)
+    ok_rows = db.Column(db.Integer, nullable=False, default=0)
+    error_rows = db.Column(db.Integer, nullable=False, default=0)
+    report_json = db.Column(db.Text)
+    message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    heartbeat_at = db.Column(db.DateTime)  # último avance guardado (ver lotes.marcar_lotes_interrumpidos)
+    finished_at = db.Column(db.DateTime)
+
+    user = db.relationship("User")
+
+    def __repr__(self):
+        return f"<BatchJob {self.id} {self.status} {self.processed_rows}/{self.total_rows}>"
+
+
+class PublishOutbox(db.Model):
+    __tablename__ = "publish_outbox"
+
+    id = db.Column(db.Integer, primary_key=True)
+    audit_id = db.Column(db.Integer, db.ForeignKey("generation_audits.id"), index=True)
+    certificate_key = db.Column(db.String(120), index=True)
+    payload_json = db.Column(db.Text, nullable=False)
+    pdf_path = db.Column(db.String(255), nullable=False)
+    sequence = db.Column(db.BigInteger)  # orden de la petición (time_ns), ver bloqueos.py
+    status = db.Column(db.String(20), nullable=False, default="pending", index=True)  # pending, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    locked_at = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(120))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    audit = db.relationship("GenerationAudit")
+
+    def __repr__(self):
+        return f"<PublishOutbox {self.certificate_key} {self.status} ({self.attempts})>"
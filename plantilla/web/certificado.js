@@ -0,0 +1,59 @@
+// Scripts compartidos de las páginas index<placa>.html de los certificados.
+// Se publica una sola vez (con la huella en el nombre) y cada página solo
+// indica en <body data-visor="..."> cuál es su visor.
+
+// FUNCION DE INICIALIZACION DE VALORES
+function init() {
+    // Posiciono el cursor en el primer campo
+    formulario.verificacion.focus();
+
+    // Verifico navegador
+    if (navigator.appName.indexOf("Microsoft") != -1) {
+        formulario.target = "_blank";
+    }
+}
+
+// FUNCION DE VALIDACION DEL FORMULARIO
+function validacion(form) {
+    // Mensaje de error
+    var mensaje = "";
+
+    // Verifico campos generales
+    if (
+        (form.tipoVerificacion[0].checked ||
+            form.tipoVerificacion[1].checked) &&
+        form.verificacion.value != ""
+    ) {
+        return true;
+    } else {
+        if (form.verificacion.value == "") {
+            mensaje +=
+                "- Debe digitar código de verificación, identificación o placa\n";
+        } else {
+            mensaje += "- Debe escoger un tipo de búsqueda\n";
+        }
+
+        // Muestro mensaje de error
+        alert(mensaje);
+        return false;
+    }
+}
+
+// FUNCION MANEJADORA DE EVENTOS DE BOTONES
+function botones(form, boton) {
+    switch (boton.name) {
+        case "buscar":
+            // Valido formulario
+            if (validacion(form)) {
+                // Envío formulario
+                form.submit();
+            } else {
+                form.verificacion.select();
+            }
+            break;
+        default:
+            archivo = window.open(document.body.getAttribute("data-visor"));
+            archivo.focus();
+            break;
+    }
+}
@@ -0,0 +1,241 @@
+"""Reconciliación entre la base de datos y el archivo publicado.
+
+Toma un solo listado de FTP_BASE y FTP_VISOR y lo compara en una pasada con
+lo que la base dice que está publicado:
+
+    faltantes   index, visor o PDF de un CertificateRecord o de una generación
+                exitosa que no están en el servidor
+    huérfanos   páginas o PDFs de certificados en el servidor que la base no
+                conoce
+
+Con --republicar, los certificados con faltantes se encolan en la cola de
+publicación (se necesita su CertificateRecord para armar las páginas y el PDF
+en generados/ o todavía en el servidor).
+
+Uso:
+    python reconciliar.py
+    python reconciliar.py --republicar --reporte reconciliacion.json
+"""
+
+import argparse
+import json
+import os
+import posixpath
+from urllib.parse import unquote, urlparse
+
+from almacenamiento import abrir_almacenamiento
+from app import app
+from bloqueos import bloqueo_certificado, nueva_secuencia
+from certificado_pdf import ruta_pdf_generado
+from cola_publicacion import encolar_publicacion, publicacion_en_cola
+from ftp_config import FTP_BASE, FTP_VISOR
+from models import CertificateRecord, GenerationAudit, PublishedArtifact, db
+from regenerar_sitio import datos_de_registro
+
+CARPETAS = {"base": FTP_BASE, "visor": FTP_VISOR}
+
+
+def ruta_remota(carpeta, nombre):
+    """Ruta tal como la usa la publicación (y PublishedArtifact)"""
+    return f"{CARPETAS[carpeta]}/{nombre}"
+
+
+def tomar_inventario(almacen):
+    """Un listado por carpeta: {"base": {nombres}, "visor": {nombres}}"""
+    return {carpeta: set(almacen.listar(ruta)) for carpeta, ruta in CARPETAS.items()}
+
+
+def _nombre_desde_url(url):
+    return unquote(posixpath.basename(urlparse(url).path)) if url else ""
+
+
+def artefactos_esperados():
+    """
+    Lo que la base espera encontrar publicado.
+
+    Returns:
+        dict certificate_key -> {"archivos": {(carpeta, nombre)}, "origen": "registro"|"generacion"}
+    """
+    esperados = {}
+
+    for record in CertificateRecord.query.with_entities(
+        CertificateRecord.certificate_key,
+        CertificateRecord.index_html_filename,
+        CertificateRecord.viewer_html_filename,
+        CertificateRecord.pdf_filename,
+    ):
+        key, index_file, viewer_file, pdf_file = record
+        esperados[key] = {
+            "archivos": {
+                ("base", index_file or f"index{key}.html"),
+                ("visor", viewer_file or f"{key}.html"),
+                ("visor", pdf_file or f"{key}.pdf"),
+            },
+            "origen": "registro",
+        }
+
+    # Generaciones exitosas ya publicadas (las que están en cola todavía no cuentan)
+    generaciones = GenerationAudit.query.with_entities(
+        GenerationAudit.index_url, GenerationAudit.viewer_url, GenerationAudit.remote_pdf_url
+    ).filter(
+        GenerationAudit.status == "success",
+        db.or_(GenerationAudit.publish_state.is_(None), GenerationAudit.publish_state.in_(["published", "failed"])),
+    )
+    for index_url, viewer_url, pdf_url in generaciones:
+        index_file = _nombre_desde_url(index_url)
+        if not (index_file.startswith("index") and index_file.endswith(".html")):
+            continue
+        key = index_file[len("index"):-len(".html")]
+        entrada = esperados.setdefault(key, {"archivos": set(), "origen": "generacion"})
+        entrada["archivos"].add(("base", index_file))
+        for nombre in (_nombre_desde_url(viewer_url), _nombre_desde_url(pdf_url)):
+            if nombre:
+                entrada["archivos"].add(("visor", nombre))
+
+    return esperados
+
+
+def _parece_certificado(carpeta, nombre):
+    if carpeta == "base":
+        return nombre.startswith("index") and nombre.endswith(".html") and nombre != "index.html"
+    return nombre.lower().endswith((".pdf", ".html"))
+
+
+def reconciliar(inventario, esperados):
+    """
+    Compara el inventario con la base en una sola pasada.
+
+    Returns:
+        (faltantes, huerfanos): faltantes es {certificate_key: [(carpeta, nombre), ...]}
+        y huerfanos una lista de (carpeta, nombre)
+    """
+    faltantes = {}
+    conocidos = set()
+    for key, entrada in esperados.items():
+        conocidos |= entrada["archivos"]
+        ausentes = sorted(
+            (carpeta, nombre) for carpeta, nombre in entrada["archivos"] if nombre not in inventario[carpeta]
+        )
+        if ausentes:
+            faltantes[key] = ausentes
+
+    huerfanos = sorted(
+        (carpeta, nombre)
+        for carpeta, nombres in inventario.items()
+        for nombre in nombres
+        if _parece_certificado(carpeta, nombre) and (carpeta, nombre) not in conocidos
+    )
+    return faltantes, huerfanos
+
+
+def _pdf_local(almacen, inventario, record, datos, bloqueo, secuencia):
+    """
+    Ruta local del PDF para volver a publicarlo (o None si no hay de dónde
+    sacarlo). Es la misma de generar_certificado, así que requiere el bloqueo
+    de la clave para escribirla.
+    """
+    ruta = ruta_pdf_generado(datos)
+    if os.path.exists(ruta):
+        return ruta
+    pdf_file = record.pdf_filename or f"{record.certificate_key}.pdf"
+    if pdf_file in inventario["visor"]:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, "wb") as handle:
+            handle.write(almacen.leer(ruta_remota("visor", pdf_file)))
+        bloqueo.guardar(generado=secuencia)
+        return ruta
+    return None
+
+
+def encolar_faltantes(almacen, inventario, faltantes):
+    """
+    Encola la re-publicación de los certificados con faltantes.
+
+    Borra la huella guardada de los archivos ausentes para que la publicación
+    no los omita por "sin cambios".
+
+    Returns:
+        (encolados, no_encolados) donde no_encolados es {certificate_key: motivo}
+    """
+    encolados = []
+    no_encolados = {}
+    registros = {
+        record.certificate_key: record
+        for record in CertificateRecord.query.filter(CertificateRecord.certificate_key.in_(list(faltantes)))
+    }
+
+    for key, ausentes in faltantes.items():
+        record = registros.get(key)
+        if record is None:
+            no_encolados[key] = "sin CertificateRecord para armar las páginas"
+            continue
+        if publicacion_en_cola(key):
+            no_encolados[key] = "ya está en la cola de publicación"
+            continue
+
+        datos = datos_de_registro(record)
+        secuencia = nueva_secuencia()
+        with bloqueo_certificado(key) as bloqueo:
+            if not bloqueo.vigente(secuencia, "generado", "publicado"):
+                # Se generó mientras esperábamos el bloqueo: esa publica lo suyo
+                no_encolados[key] = "se generó una versión más reciente"
+                continue
+            ruta_pdf = _pdf_local(almacen, inventario, record, datos, bloqueo, secuencia)
+            if ruta_pdf is None:
+                no_encolados[key] = "el PDF no está en generados/ ni en el servidor"
+                continue
+
+            PublishedArtifact.query.filter(
+                PublishedArtifact.remote_path.in_([ruta_remota(carpeta, nombre) for carpeta, nombre in ausentes])
+            ).delete(synchronize_session=False)
+            encolar_publicacion(None, datos, ruta_pdf, key, secuencia)
+        encolados.append(key)
+
+    db.session.commit()
+    return encolados, no_encolados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara la base de datos con los archivos publicados.")
+    parser.add_argument("--republicar", action="store_true", help="Encolar la re-publicación de los faltantes")
+    parser.add_argument("--reporte", default=None, help="Guardar el resultado en este JSON")
+    args = parser.parse_args()
+
+    with app.app_context(), abrir_almacenamiento() as almacen:
+        inventario = tomar_inventario(almacen)
+        esperados = artefactos_esperados()
+        faltantes, huerfanos = reconciliar(inventario, esperados)
+
+        print(
+            f"{sum(len(n) for n in inventario.values())} archivos en el servidor, "
+            f"{len(esperados)} certificados en la base"
+        )
+        print(f"\nFaltantes ({len(faltantes)} certificados):")
+        for key, ausentes in sorted(faltantes.items()):
+            print(f"  ✗ {key}: {', '.join(nombre for _, nombre in ausentes)}")
+        print(f"\nHuérfanos ({len(huerfanos)} archivos):")
+        for carpeta, nombre in huerfanos:
+            print(f"  ? {ruta_remota(carpeta, nombre)}")
+
+        resultado = {
+            "faltantes": {key: [ruta_remota(c, n) for c, n in ausentes] for key, ausentes in faltantes.items()},
+            "huerfanos": [ruta_remota(c, n) for c, n in huerfanos],
+        }
+
+        if args.republicar and faltantes:
+            encolados, no_encolados = encolar_faltantes(almacen, inventario, faltantes)
+            print(f"\n{len(encolados)} certificados encolados para re-publicar")
+            for key, motivo in sorted(no_encolados.items()):
+                print(f"  - {key}: {motivo}")
+            if encolados:
+                print("La app los publica en segundo plano (o drene la cola con: python cola_publicacion.py)")
+            resultado.update(encolados=encolados, no_encolados=no_encolados)
+
+    if args.reporte:
+        with open(args.reporte, "w", encoding="utf-8") as handle:
+            json.dump(resultado, handle, ensure_ascii=False, indent=2)
+        print(f"Reporte guardado en {args.reporte}")
+
+
+if __name__ == "__main__":
+    main()
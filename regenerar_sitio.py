@@ -0,0 +1,220 @@
+"""Regeneración masiva de las páginas publicadas (index<clave>.html y <clave>.html).
+
+Cuando cambia index_certificado.html o visor_pdf.html hay que volver a
+renderizar las páginas de todos los certificados. Este comando las arma desde
+CertificateRecord/VehicleProfile en un pool de procesos, compara cada archivo
+con la huella guardada en PublishedArtifact y sube solo los que cambiaron,
+repartidos en varias conexiones. Los PDF no se tocan.
+
+Uso:
+    python regenerar_sitio.py --procesos 4 --conexiones 4
+    python regenerar_sitio.py --dry-run      # solo informa qué cambiaría
+"""
+
+import argparse
+import json
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from sqlalchemy.orm import joinedload
+
+from almacenamiento import abrir_almacenamiento
+from app import (
+    app,
+    huella_contenido,
+    nombre_archivo_certificado,
+    recursos_web,
+    registrar_artefacto,
+    renderizar_paginas,
+)
+from bloqueos import bloqueo_certificado, nueva_secuencia
+from ftp_config import FTP_BASE, FTP_VISOR
+from models import CertificateRecord, PublishedArtifact, db
+
+PROCESOS_REGENERACION = int(os.environ.get("REGENERACION_PROCESOS", os.cpu_count() or 2))
+CONEXIONES_REGENERACION = int(os.environ.get("REGENERACION_CONEXIONES", "4"))
+
+
+def datos_de_registro(record):
+    """Arma los `datos` de publicación de un certificado importado o generado"""
+    datos = {}
+    if record.extracted_json:
+        try:
+            datos.update(json.loads(record.extracted_json).get("parsed") or {})
+        except ValueError:
+            pass
+
+    vehiculo = record.vehicle
+    datos.update(
+        placa=record.plate,
+        tipo_certificado=record.certificate_type or "nuevo",
+        tipo_transporte=datos.get("tipo_transporte") or (vehiculo.tipo_transporte if vehiculo else "") or "",
+        fecha_inspeccion=record.inspection_date or datos.get("fecha_inspeccion") or "",
+        fecha_vencimiento=record.expiration_date or datos.get("fecha_vencimiento") or "",
+    )
+    return {clave: ("" if valor is None else valor) for clave, valor in datos.items()}
+
+
+def _renderizar(trabajo):
+    """Corre en el pool de procesos: devuelve [(ruta_remota, contenido, huella), ...]"""
+    certificate_key, datos = trabajo
+    html_index, html_visor = renderizar_paginas(datos)
+    paginas = [
+        (f"{FTP_BASE}/index{certificate_key}.html", html_index.encode("utf-8")),
+        (f"{FTP_VISOR}/{certificate_key}.html", html_visor.encode("utf-8")),
+    ]
+    return certificate_key, [(ruta, contenido, huella_contenido(contenido)) for ruta, contenido in paginas]
+
+
+# Resultado de cada archivo: subido, o no subido porque el certificado se
+# publicó (con datos más nuevos) mientras corría la regeneración
+SUBIDO = "subido"
+REEMPLAZADO = "reemplazado"
+
+
+def _subir_y_registrar(almacen, ruta, contenido, huella, certificate_key):
+    """Sube un archivo y confirma su huella; el registro se relee recién acá"""
+    info = almacen.escribir(ruta, contenido)
+    registro = PublishedArtifact.query.filter_by(remote_path=ruta).first()
+    registrar_artefacto(registro, ruta, certificate_key, huella, len(contenido), info)
+    db.session.commit()
+    return SUBIDO
+
+
+def _subir_cola(cola, resultados, secuencia):
+    """
+    Un hilo por conexión: sube archivos de la cola hasta vaciarla. Cada hilo
+    tiene su app context (y su sesión); la huella de un certificado se guarda
+    sin soltar su bloqueo, así una publicación posterior no queda pisada.
+    """
+    with app.app_context(), abrir_almacenamiento() as almacen:
+        while True:
+            try:
+                ruta, contenido, huella, certificate_key = cola.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if certificate_key is None:
+                    resultados[ruta] = _subir_y_registrar(almacen, ruta, contenido, huella, None)
+                    continue
+                with bloqueo_certificado(certificate_key) as bloqueo:
+                    if bloqueo.vigente(secuencia, "publicado"):
+                        resultados[ruta] = _subir_y_registrar(almacen, ruta, contenido, huella, certificate_key)
+                    else:
+                        resultados[ruta] = REEMPLAZADO
+            except Exception as exc:
+                db.session.rollback()
+                resultados[ruta] = exc
+
+
+def regenerar_sitio(procesos=None, conexiones=None, dry_run=False, limite=None):
+    """
+    Re-renderiza y sube las páginas que cambiaron.
+
+    Returns:
+        dict con el resumen (revisados, cambiados, subidos, errores, segundos)
+    """
+    procesos = procesos or PROCESOS_REGENERACION
+    conexiones = conexiones or CONEXIONES_REGENERACION
+    inicio = time.perf_counter()
+    secuencia = nueva_secuencia()
+    resumen = {
+        "certificados": 0,
+        "revisados": 0,
+        "cambiados": 0,
+        "subidos": 0,
+        "reemplazados": 0,
+        "errores": [],
+    }
+
+    with app.app_context():
+        consulta = CertificateRecord.query.options(joinedload(CertificateRecord.vehicle)).order_by(
+            CertificateRecord.certificate_key
+        )
+        if limite:
+            consulta = consulta.limit(limite)
+
+        trabajos = []
+        for record in consulta:
+            datos = datos_de_registro(record)
+            if nombre_archivo_certificado(datos) != record.certificate_key:
+                resumen["errores"].append(f"{record.certificate_key}: la placa y el tipo no coinciden con la clave")
+                continue
+            trabajos.append((record.certificate_key, datos))
+        resumen["certificados"] = len(trabajos)
+
+        publicados = {registro.remote_path: registro for registro in PublishedArtifact.query}
+
+        # (ruta, contenido, huella, certificate_key) de lo que cambió
+        cambiados = []
+        for remoto, contenido in recursos_web().values():
+            ruta = f"{FTP_VISOR}/{remoto}"
+            huella = huella_contenido(contenido)
+            resumen["revisados"] += 1
+            if ruta not in publicados or publicados[ruta].content_hash != huella:
+                cambiados.append((ruta, contenido, huella, None))
+
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            for certificate_key, paginas in pool.map(_renderizar, trabajos, chunksize=32):
+                for ruta, contenido, huella in paginas:
+                    resumen["revisados"] += 1
+                    registro = publicados.get(ruta)
+                    if registro is None or registro.content_hash != huella:
+                        cambiados.append((ruta, contenido, huella, certificate_key))
+        resumen["cambiados"] = len(cambiados)
+
+        print(f"{resumen['revisados']} archivos revisados, {len(cambiados)} con cambios")
+        if dry_run or not cambiados:
+            for ruta, *_ in cambiados:
+                print("  ~", ruta)
+            resumen["segundos"] = round(time.perf_counter() - inicio, 2)
+            return resumen
+
+        cola = queue.Queue()
+        for cambiado in cambiados:
+            cola.put(cambiado)
+        resultados = {}
+        with ThreadPoolExecutor(max_workers=conexiones) as hilos:
+            for _ in range(min(conexiones, len(cambiados))):
+                hilos.submit(_subir_cola, cola, resultados, secuencia)
+
+        for ruta, *_ in cambiados:
+            resultado = resultados.get(ruta)
+            if resultado == SUBIDO:
+                resumen["subidos"] += 1
+            elif resultado == REEMPLAZADO:
+                resumen["reemplazados"] += 1
+            else:
+                resumen["errores"].append(f"{ruta}: {resultado}")
+                print(f"  ✗ {ruta}: {resultado}")
+
+    resumen["segundos"] = round(time.perf_counter() - inicio, 2)
+    return resumen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-renderiza las páginas publicadas y sube solo las que cambiaron.")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos para renderizar")
+    parser.add_argument("--conexiones", type=int, default=None, help="Conexiones simultáneas de subida")
+    parser.add_argument("--limit", type=int, default=None, help="Solo los primeros N certificados")
+    parser.add_argument("--dry-run", action="store_true", help="Informar los cambios sin subir nada")
+    args = parser.parse_args()
+
+    resumen = regenerar_sitio(
+        procesos=args.procesos, conexiones=args.conexiones, dry_run=args.dry_run, limite=args.limit
+    )
+
+    print(
+        f"\n{resumen['certificados']} certificados, {resumen['revisados']} archivos revisados, "
+        f"{resumen['cambiados']} con cambios, {resumen['subidos']} subidos, "
+        f"{resumen['reemplazados']} publicados mientras tanto, "
+        f"{len(resumen['errores'])} errores ({resumen['segundos']} s)"
+    )
+    for error in resumen["errores"]:
+        print("  ✗", error)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""Borradores de renovación pre-generados.
+
+Las renovaciones (remo … remo5) son la mayor parte del trabajo diario y cada
+una empezaba con el autocompletado por FTP (bajar y parsear el PDF anterior)
+y una generación completa. Este módulo busca los certificados que vencen en
+los próximos días y deja listo en instance/borradores/ el borrador de la
+siguiente renovación de cada placa (el sufijo que sigue en CERTIFICATE_SUFFIXES):
+
+    <PLACA>.json   datos del formulario, huella, números calculados y origen
+    <PLACA>.pdf    el PDF ya llenado y post-procesado, sin publicar
+
+El autocompletado devuelve el borrador sin tocar el FTP. Si el operador
+confirma sin cambiar nada (misma huella de datos), generar_certificado solo
+mueve el PDF a generados/ y publica; si cambió algo se genera como siempre.
+
+La fecha de inspección del borrador es la del día en que se arma, así que
+vale solo ese día (la preparación siguiente descarta los viejos). Los campos
+de opciones (refrigeración, clase de vehículo) se llevan a los valores del
+formulario antes de calcular la huella. Se preparan con un cron diario en el mismo servidor:
+
+    python renovaciones.py --dias 15
+
+o dentro de la app con CERT_BORRADORES_INTERVALO_HORAS (hilo de fondo).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin exclusión entre procesos
+    fcntl = None
+
+from models import CertificateRecord, leer_fecha
+
+CARPETA_BORRADORES = os.path.join("instance", "borradores")
+PLANTILLA_PDF = os.path.join("plantilla", "pny_prueba.pdf")
+# Vencimientos dentro de esta cantidad de días tienen borrador
+DIAS_RENOVACION = int(os.environ.get("CERT_DIAS_RENOVACION", "15"))
+# También los ya vencidos hace hasta esta cantidad de días
+DIAS_VENCIDOS = 30
+# Vigencia cuando el certificado anterior no permite calcularla
+VIGENCIA_POR_DEFECTO = timedelta(days=365)
+# 0 = sin hilo de fondo (solo el comando)
+INTERVALO_HORAS = float(os.environ.get("CERT_BORRADORES_INTERVALO_HORAS", "0"))
+
+_huella_plantilla = None
+_iniciado = False
+_iniciado_lock = threading.Lock()
+
+
+def huella_plantilla():
+    """Un cambio de plantilla invalida los borradores armados con la anterior"""
+    global _huella_plantilla
+    if _huella_plantilla is None:
+        with open(PLANTILLA_PDF, "rb") as handle:
+            _huella_plantilla = hashlib.sha256(handle.read()).hexdigest()
+    return _huella_plantilla
+
+
+def orden_tipos():
+    """["nuevo", "remo", "remo2", ... "remo5"]: el orden en que se renueva"""
+    from app import CERTIFICATE_SUFFIXES
+
+    return [sufijo or "nuevo" for sufijo in reversed(CERTIFICATE_SUFFIXES)]
+
+
+def siguiente_tipo(tipo_certificado):
+    """Tipo de la próxima renovación, o None si ya es el último sufijo"""
+    orden = orden_tipos()
+    try:
+        posicion = orden.index(tipo_certificado or "nuevo")
+    except ValueError:
+        return None
+    return orden[posicion + 1] if posicion + 1 < len(orden) else None
+
+
+def _rutas(placa):
+    return (
+        os.path.join(CARPETA_BORRADORES, f"{placa}.json"),
+        os.path.join(CARPETA_BORRADORES, f"{placa}.pdf"),
+    )
+
+
+def _escribir_atomico(ruta, contenido):
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), prefix=".borrador_")
+    with os.fdopen(descriptor, "wb") as handle:
+        handle.write(contenido)
+    os.replace(temporal, ruta)
+
+
+def _borrar(placa):
+    for ruta in _rutas(placa):
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+
+def leer_borrador(placa):
+    """El JSON del borrador de la placa tal como está en disco, o None"""
+    ruta_json, _ = _rutas(placa)
+    try:
+        with open(ruta_json, encoding="utf-8") as handle:
+            return json.load(handle)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _vigente(borrador, hoy):
+    _, ruta_pdf = _rutas(borrador["placa"])
+    return (
+        borrador.get("fecha") == hoy.isoformat()
+        and borrador.get("plantilla") == huella_plantilla()
+        and os.path.exists(ruta_pdf)
+    )
+
+
+def buscar_borrador(placa, hoy=None):
+    """El borrador de hoy para la placa (dict con datos, tipo_certificado, ...), o None"""
+    if not placa:
+        return None
+    borrador = leer_borrador(placa)
+    if borrador is None or not _vigente(borrador, hoy or date.today()):
+        return None
+    return borrador
+
+
+def tomar_borrador(placa, huella, destino):
+    """
+    Usa el borrador de la placa si se armó con exactamente los mismos datos.
+
+    Mueve su PDF a `destino` y lo descarta. Requiere el bloqueo de la clave
+    del certificado (lo toma generar_certificado).
+
+    Returns:
+        dict con numero_acta y numero_inspeccion del PDF, o None si no aplica
+    """
+    borrador = buscar_borrador(placa)
+    if borrador is None or borrador.get("huella") != huella:
+        return None
+
+    _, ruta_pdf = _rutas(placa)
+    try:
+        os.replace(ruta_pdf, destino)
+    except FileNotFoundError:
+        return None  # otro proceso lo tomó primero
+    _borrar(placa)
+    return borrador.get("detalles") or {}
+
+
+def candidatos(dias, hoy):
+    """
+    Último certificado de cada placa cuyo vencimiento cae entre
+    hoy - DIAS_VENCIDOS y hoy + `dias`, y que todavía tiene renovación.
+
+    Returns:
+        dict placa -> id del CertificateRecord
+    """
+    posicion = {tipo: numero for numero, tipo in enumerate(orden_tipos())}
+    desde, hasta = hoy - timedelta(days=DIAS_VENCIDOS), hoy + timedelta(days=dias)
+
+    # Solo las placas con algún vencimiento en la ventana (índice de expires_on)
+    placas = {
+        plate
+        for (plate,) in CertificateRecord.query.with_entities(CertificateRecord.plate)
+        .filter(CertificateRecord.expires_on.between(desde, hasta))
+        .distinct()
+    }
+    if not placas:
+        return {}
+
+    ultimos = {}
+    for record_id, plate, tipo, vencimiento in CertificateRecord.query.with_entities(
+        CertificateRecord.id,
+        CertificateRecord.plate,
+        CertificateRecord.certificate_type,
+        CertificateRecord.expires_on,
+    ).filter(CertificateRecord.plate.in_(placas)):
+        rango = posicion.get(tipo or "nuevo", -1)
+        if plate not in ultimos or rango > ultimos[plate][0]:
+            ultimos[plate] = (rango, record_id, tipo, vencimiento)
+
+    elegidos = {}
+    for plate, (_, record_id, tipo, vencimiento) in ultimos.items():
+        if vencimiento is not None and desde <= vencimiento <= hasta and siguiente_tipo(tipo):
+            elegidos[plate] = record_id
+    return elegidos
+
+
+def datos_borrador(record, hoy):
+    """`datos` de la renovación: los del certificado anterior con el tipo y las fechas nuevas"""
+    from app import campos_como_formulario, datos_desde_formulario, urls_publicacion
+    from regenerar_sitio import datos_de_registro
+
+    anterior = datos_de_registro(record)
+    inspeccion = record.inspected_on or leer_fecha(record.inspection_date)
+    vencimiento = record.expires_on or leer_fecha(record.expiration_date)
+    vigencia = VIGENCIA_POR_DEFECTO
+    if inspeccion and vencimiento and vencimiento > inspeccion:
+        vigencia = vencimiento - inspeccion
+
+    # Como llegan del formulario (todo texto, radios en sus opciones) para que
+    # la huella coincida al confirmar
+    campos = {clave: valor if isinstance(valor, str) else str(valor) for clave, valor in anterior.items()}
+    campos.update(
+        placa=record.plate,
+        tipo_certificado=siguiente_tipo(record.certificate_type),
+        fecha_inspeccion=hoy.isoformat(),
+        fecha_vencimiento=(hoy + vigencia).isoformat(),
+        fecha_ultima_inspeccion=inspeccion.isoformat() if inspeccion else anterior.get("fecha_inspeccion", ""),
+    )
+    return datos_desde_formulario(campos_como_formulario(campos)), urls_publicacion(anterior)
+
+
+def preparar_borradores(dias=None, hoy=None, limite=None):
+    """
+    Arma los borradores que falten y borra los que ya no corresponden.
+
+    Solo una preparación a la vez (flock sobre instance/borradores/.preparando);
+    si hay otra en curso, devuelve {"ocupado": True}. Requiere app context.
+
+    Returns:
+        dict con el resumen (candidatos, creados, vigentes, eliminados, errores, segundos)
+    """
+    from certificado_pdf import generar_borrador, huella_datos, nombre_archivo_certificado
+
+    dias = DIAS_RENOVACION if dias is None else dias
+    hoy = hoy or date.today()
+    inicio = time.perf_counter()
+    os.makedirs(CARPETA_BORRADORES, exist_ok=True)
+
+    with open(os.path.join(CARPETA_BORRADORES, ".preparando"), "a") as cerrojo:
+        if fcntl is not None:
+            try:
+                fcntl.flock(cerrojo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return {"ocupado": True}
+
+        elegidos = candidatos(dias, hoy)
+        resumen = {"candidatos": len(elegidos), "creados": 0, "vigentes": 0, "eliminados": 0, "errores": []}
+
+        # Los que ya no corresponden y los de días anteriores (su fecha de
+        # inspección quedó vieja); los elegidos se vuelven a armar abajo
+        for nombre in os.listdir(CARPETA_BORRADORES):
+            placa, extension = os.path.splitext(nombre)
+            if extension != ".json":
+                continue
+            existente = leer_borrador(placa)
+            if placa not in elegidos or existente is None or existente.get("fecha") != hoy.isoformat():
+                _borrar(placa)
+                resumen["eliminados"] += 1
+
+        placas = sorted(elegidos)
+        if limite:
+            placas = placas[:limite]
+
+        for placa in placas:
+            record = CertificateRecord.query.get(elegidos[placa])
+            existente = leer_borrador(placa)
+            if existente and existente.get("origen") == record.certificate_key and _vigente(existente, hoy):
+                resumen["vigentes"] += 1
+                continue
+
+            try:
+                datos, anterior = datos_borrador(record, hoy)
+                detalles = {}
+                ruta, error, _ = generar_borrador(datos, CARPETA_BORRADORES, detalles)
+                if error:
+                    raise RuntimeError(error)
+
+                ruta_json, ruta_pdf = _rutas(placa)
+                os.replace(ruta, ruta_pdf)
+                borrador = {
+                    "placa": placa,
+                    "certificate_key": nombre_archivo_certificado(datos),
+                    "tipo_certificado": datos["tipo_certificado"],
+                    "origen": record.certificate_key,
+                    "fecha": hoy.isoformat(),
+                    "huella": huella_datos(datos),
+                    "plantilla": huella_plantilla(),
+                    "datos": datos,
+                    "detalles": detalles,
+                    "anterior": anterior,
+                    "creado": datetime.utcnow().isoformat(),
+                }
+                _escribir_atomico(ruta_json, json.dumps(borrador, ensure_ascii=False, indent=2).encode("utf-8"))
+                resumen["creados"] += 1
+                print(f"  ✓ {placa}: borrador {datos['tipo_certificado']} (vence {record.expiration_date})")
+            except Exception as exc:
+                _borrar(placa)
+                resumen["errores"].append(f"{placa}: {exc}")
+                print(f"  ✗ {placa}: {exc}")
+
+    resumen["segundos"] = round(time.perf_counter() - inicio, 2)
+    return resumen
+
+
+def _bucle_preparacion(app, intervalo):
+    while True:
+        try:
+            with app.app_context():
+                preparar_borradores()
+        except Exception as exc:
+            print("WARN: error preparando borradores de renovación:", exc)
+        time.sleep(intervalo)
+
+
+def iniciar_preparacion_borradores(app, intervalo_horas=None):
+    """Arranca (una vez por proceso) el hilo que prepara borradores, si está configurado"""
+    global _iniciado
+
+    intervalo_horas = INTERVALO_HORAS if intervalo_horas is None else intervalo_horas
+    if intervalo_horas <= 0:
+        return
+
+    with _iniciado_lock:
+        if _iniciado:
+            return
+        _iniciado = True
+
+    hilo = threading.Thread(
+        target=_bucle_preparacion,
+        args=(app, intervalo_horas * 3600),
+        name="borradores-renovacion",
+        daemon=True,
+    )
+    hilo.start()
+
+
+def main():
+    from app import app
+
+    parser = argparse.ArgumentParser(description="Prepara los borradores de las renovaciones próximas a vencer.")
+    parser.add_argument("--dias", type=int, default=None, help=f"Vencimientos dentro de N días (por defecto {DIAS_RENOVACION})")
+    parser.add_argument("--limit", type=int, default=None, help="Solo las primeras N placas")
+    args = parser.parse_args()
+
+    with app.app_context():
+        resumen = preparar_borradores(dias=args.dias, limite=args.limit)
+
+    if resumen.get("ocupado"):
+        print("Otra preparación de borradores está en curso.")
+        return
+
+    print(
+        f"\n{resumen['candidatos']} placas por renovar: {resumen['creados']} borradores nuevos, "
+        f"{resumen['vigentes']} ya vigentes, {resumen['eliminados']} descartados, "
+        f"{len(resumen['errores'])} errores ({resumen['segundos']} s)"
+    )
+    for error in resumen["errores"]:
+        print("  ✗", error)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Post-procesado del PDF final del certificado.
+
+pypdf rellena la plantilla pero no sabe optimizar ni linealizar ("fast web
+view"); para eso se usa pikepdf (qpdf), que se importa solo cuando hace falta.
+"""
+
+import hashlib
+import os
+from io import StringIO
+
+# Diccionarios que la plantilla repite entre páginas y se pueden compartir.
+TIPOS_DEDUPLICABLES = {"/Font", "/FontDescriptor", "/ExtGState"}
+
+
+def _pikepdf():
+    try:
+        import pikepdf
+    except ImportError as exc:
+        raise RuntimeError(
+            "pikepdf no está instalado; es necesario para post-procesar el PDF"
+        ) from exc
+    return pikepdf
+
+
+def _serializar(pikepdf, valor):
+    # pikepdf entrega enteros y booleanos como tipos nativos de Python.
+    if isinstance(valor, pikepdf.Object):
+        return valor.unparse()
+    return repr(valor).encode()
+
+
+def _firma_objeto(pikepdf, obj):
+    """Firma estable de un objeto indirecto, o None si no se debe deduplicar."""
+    if isinstance(obj, pikepdf.Stream):
+        claves = sorted(k for k in obj.keys() if k != "/Length")
+        cabecera = b"".join(
+            k.encode() + _serializar(pikepdf, obj.get(k)) for k in claves
+        )
+        return b"S" + hashlib.sha256(cabecera + b"\0" + obj.read_raw_bytes()).digest()
+
+    if isinstance(obj, pikepdf.Dictionary) and obj.get("/Type") in TIPOS_DEDUPLICABLES:
+        # resolved=True: de un objeto indirecto, unparse() daría solo "n 0 R"
+        return b"D" + hashlib.sha256(obj.unparse(resolved=True)).digest()
+
+    return None
+
+
+def _redirigir_referencias(pikepdf, obj, reemplazos):
+    """Cambia en `obj` (y sus hijos directos) las referencias duplicadas por la canónica."""
+    if isinstance(obj, (pikepdf.Dictionary, pikepdf.Stream)):
+        pares = [(k, obj.get(k)) for k in list(obj.keys())]
+    elif isinstance(obj, pikepdf.Array):
+        pares = list(enumerate(obj))
+    else:
+        return
+
+    for clave, valor in pares:
+        if not isinstance(valor, pikepdf.Object):
+            continue
+        if valor.is_indirect:
+            canonico = reemplazos.get(valor.objgen)
+            if canonico is not None:
+                obj[clave] = canonico
+        else:
+            _redirigir_referencias(pikepdf, valor, reemplazos)
+
+
+def deduplicar_objetos(pdf):
+    """
+    Unifica streams idénticos y fuentes repetidas de la plantilla.
+
+    Se repite hasta que no haya cambios: al unificar los FontFile, los
+    FontDescriptor y Font que los usan pasan a ser idénticos también.
+
+    Returns:
+        Número de objetos que quedaron sin referencias
+    """
+    pikepdf = _pikepdf()
+    descartados = set()
+
+    while True:
+        canonicos = {}
+        reemplazos = {}
+        for obj in pdf.objects:
+            if obj.objgen in descartados:
+                continue
+            firma = _firma_objeto(pikepdf, obj)
+            if firma is None:
+                continue
+            if firma in canonicos:
+                reemplazos[obj.objgen] = canonicos[firma]
+            else:
+                canonicos[firma] = obj
+
+        if not reemplazos:
+            return len(descartados)
+
+        for obj in pdf.objects:
+            _redirigir_referencias(pikepdf, obj, reemplazos)
+        _redirigir_referencias(pikepdf, pdf.trailer, reemplazos)
+        descartados.update(reemplazos)
+
+
+def verificar_linealizado(ruta_pdf):
+    """
+    Confirma que el PDF está linealizado y que sus hint tables son válidas.
+
+    Returns:
+        (ok, detalle) donde detalle es el reporte de qpdf si algo falla
+    """
+    pikepdf = _pikepdf()
+    reporte = StringIO()
+
+    with pikepdf.open(ruta_pdf) as pdf:
+        if not pdf.is_linearized:
+            return False, "el PDF no está linealizado"
+        ok = pdf.check_linearization(stream=reporte)
+
+    return ok, reporte.getvalue().strip()
+
+
+def postprocesar_pdf(ruta_pdf, optimizar=True, linealizar=False, determinista=False):
+    """
+    Reescribe el PDF (en el mismo archivo) optimizado y/o linealizado.
+
+    Optimizar comprime los streams que la plantilla trae sin comprimir, unifica
+    objetos y fuentes duplicados y descarta los que quedan sin uso (qpdf solo
+    escribe lo alcanzable desde el trailer). Linealizar deja la página 1 al
+    inicio del archivo para que el visor la muestre con peticiones por rangos.
+    Con determinista, el /ID del trailer se calcula a partir del contenido en
+    lugar de la hora, así los mismos datos producen los mismos bytes; por eso
+    el archivo se reescribe aunque no se pida optimizar ni linealizar.
+
+    Returns:
+        dict con tamano_antes, tamano_despues y objetos_unificados
+    """
+    tamano_antes = os.path.getsize(ruta_pdf)
+    resultado = {
+        "tamano_antes": tamano_antes,
+        "tamano_despues": tamano_antes,
+        "objetos_unificados": 0,
+    }
+    if not optimizar and not linealizar and not determinista:
+        return resultado
+
+    pikepdf = _pikepdf()
+    ruta_tmp = f"{ruta_pdf}.tmp"
+
+    try:
+        with pikepdf.open(ruta_pdf) as pdf:
+            opciones = {"linearize": linealizar, "deterministic_id": determinista}
+            if determinista and "/ID" in pdf.trailer:
+                # qpdf conserva la primera mitad del /ID de entrada; sin ella
+                # calcula las dos a partir del contenido
+                del pdf.trailer["/ID"]
+            if optimizar:
+                resultado["objetos_unificados"] = deduplicar_objetos(pdf)
+                pdf.remove_unreferenced_resources()
+                opciones.update(
+                    compress_streams=True,
+                    object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                )
+            pdf.save(ruta_tmp, **opciones)
+
+        if linealizar:
+            ok, detalle = verificar_linealizado(ruta_tmp)
+            if not ok:
+                raise ValueError(f"El PDF linealizado no es válido: {detalle}")
+
+        os.replace(ruta_tmp, ruta_pdf)
+    finally:
+        if os.path.exists(ruta_tmp):
+            os.remove(ruta_tmp)
+
+    resultado["tamano_despues"] = os.path.getsize(ruta_pdf)
+    return resultado
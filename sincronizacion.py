@@ -0,0 +1,277 @@
+"""Sincronización periódica con el FTP dentro de la app.
+
+Con CERT_SINCRONIZACION_MINUTOS > 0 cada proceso de gunicorn arranca un hilo
+que cada tanto intenta ser el programador (lease de la tarea
+"importacion:programador" en scheduled_tasks). El lease se toma con un UPDATE
+condicionado a que esté vencido o ya sea propio, igual que la cola de
+publicación reclama sus filas, así vale entre procesos y entre servidores que
+compartan la base; si el proceso muere, otro lo toma cuando vence.
+
+Solo el programador revisa si pasó el intervalo desde la última importación
+y, si toca, corre la incremental (run_import con incremental=True) con el
+lease de la tarea "importacion", que se suelta al terminar. Ese es el lease
+que toma también `python importar_certificados_ftp.py`: entre corridas queda
+libre. Mientras se importa, un hilo aparte lo renueva; si la renovación falla
+(otro lo tomó o la base no responde a tiempo) la importación se corta antes
+del próximo lote, así nunca importan dos a la vez. El resultado (hora,
+duración y conteos) queda en la fila de la tarea y lo muestra
+GET /api/sincronizacion en cualquier proceso.
+
+Uso (una corrida desde consola, si no hay otra importación en curso):
+    python sincronizacion.py
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from models import ScheduledTask, db
+
+TAREA_IMPORTACION = "importacion"
+TAREA_PROGRAMADOR = "importacion:programador"
+# 0 = sin sincronización automática
+INTERVALO_MINUTOS = float(os.environ.get("CERT_SINCRONIZACION_MINUTOS", "0"))
+PROCESOS_IMPORTACION = int(os.environ.get("CERT_SINCRONIZACION_JOBS", "1"))
+DURACION_LEASE_SEGUNDOS = 2 * 60
+INTERVALO_SONDEO_SEGUNDOS = 30
+
+_iniciado = False
+_iniciado_lock = threading.Lock()
+
+
+def identificador():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _tarea(nombre):
+    """Fila de la tarea, creándola si no existe (otro proceso puede ganarle)"""
+    tarea = ScheduledTask.query.filter_by(name=nombre).first()
+    if tarea is not None:
+        return tarea
+    db.session.add(ScheduledTask(name=nombre))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+    return ScheduledTask.query.filter_by(name=nombre).first()
+
+
+def tomar_liderazgo(nombre, lider):
+    """True si `lider` quedó con el lease de la tarea (nuevo o renovado)"""
+    _tarea(nombre)
+    ahora = datetime.utcnow()
+    tomadas = ScheduledTask.query.filter(
+        ScheduledTask.name == nombre,
+        db.or_(
+            ScheduledTask.leader == lider,
+            ScheduledTask.leader.is_(None),
+            ScheduledTask.lease_until.is_(None),
+            ScheduledTask.lease_until < ahora,
+        ),
+    ).update(
+        {"leader": lider, "lease_until": ahora + timedelta(seconds=DURACION_LEASE_SEGUNDOS)},
+        synchronize_session=False,
+    )
+    db.session.commit()
+    return bool(tomadas)
+
+
+def soltar_liderazgo(nombre, lider):
+    """Libera el lease si lo tiene `lider` (para que otro lo tome sin esperar)"""
+    ScheduledTask.query.filter_by(name=nombre, leader=lider).update(
+        {"leader": None, "lease_until": None}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def _renovar_lease(app, nombre, lider, terminado, perdido):
+    """
+    Hilo que mantiene el lease mientras el líder trabaja. Marca `perdido` si
+    otro lo tomó o si no se pudo renovar y queda menos de un tercio de lease.
+    """
+    ultima_renovacion = time.monotonic()
+    while not terminado.wait(DURACION_LEASE_SEGUNDOS / 3):
+        try:
+            with app.app_context():
+                renovado = tomar_liderazgo(nombre, lider)
+        except Exception as exc:
+            print("WARN: no se pudo renovar el lease de la sincronización:", exc)
+            if time.monotonic() - ultima_renovacion < DURACION_LEASE_SEGUNDOS * 2 / 3:
+                continue
+            renovado = False
+        if not renovado:
+            print(f"WARN: {lider} perdió el liderazgo de {nombre}; se detiene la corrida")
+            perdido.set()
+            return
+        ultima_renovacion = time.monotonic()
+
+
+@contextmanager
+def mantener_liderazgo(app, nombre, lider):
+    """
+    Renueva en segundo plano el lease (ya tomado) mientras dura el bloque.
+    Entrega un Event que se marca si el lease se pierde: quien trabaja debe
+    revisarlo y detenerse.
+    """
+    terminado = threading.Event()
+    perdido = threading.Event()
+    renovacion = threading.Thread(
+        target=_renovar_lease,
+        args=(app, nombre, lider, terminado, perdido),
+        name="sincronizacion-lease",
+        daemon=True,
+    )
+    renovacion.start()
+    try:
+        yield perdido
+    finally:
+        terminado.set()
+        renovacion.join()
+
+
+def toca_correr(tarea, intervalo_minutos, ahora=None):
+    """True si pasó el intervalo desde la última corrida (o nunca corrió)"""
+    ahora = ahora or datetime.utcnow()
+    if tarea.last_started_at is None:
+        return True
+    return ahora - tarea.last_started_at >= timedelta(minutes=intervalo_minutos)
+
+
+def sincronizar(app, lider=None, forzar=False, intervalo_minutos=None):
+    """
+    Corre la importación incremental si toca (o si `forzar`). El lease de la
+    importación se toma solo para la corrida y se suelta al terminar.
+
+    Returns:
+        dict de resumen de run_import, o None si no tocaba o había otra
+        importación en curso
+    """
+    from importar_certificados_ftp import run_import
+
+    lider = lider or identificador()
+    intervalo_minutos = INTERVALO_MINUTOS if intervalo_minutos is None else intervalo_minutos
+
+    with app.app_context():
+        if not forzar and not toca_correr(_tarea(TAREA_IMPORTACION), intervalo_minutos):
+            return None
+        if not tomar_liderazgo(TAREA_IMPORTACION, lider):
+            return None
+        # El commit de tomar_liderazgo expiró la fila: esto relee la última corrida
+        tarea = _tarea(TAREA_IMPORTACION)
+        if not forzar and not toca_correr(tarea, intervalo_minutos):
+            soltar_liderazgo(TAREA_IMPORTACION, lider)
+            return None
+        tarea.status = "running"
+        tarea.last_started_at = datetime.utcnow()
+        tarea.last_error = None
+        db.session.commit()
+
+    inicio = time.perf_counter()
+    resumen = None
+    error = None
+    try:
+        with mantener_liderazgo(app, TAREA_IMPORTACION, lider) as perdido:
+            resumen = run_import(
+                incremental=True, jobs=PROCESOS_IMPORTACION, app=app, cancel=perdido, start_method="spawn"
+            )
+    except Exception as exc:
+        error = exc
+
+    with app.app_context():
+        tarea = _tarea(TAREA_IMPORTACION)
+        tarea.status = "failed" if error is not None else "done"
+        tarea.last_finished_at = datetime.utcnow()
+        tarea.last_duration_seconds = round(time.perf_counter() - inicio, 2)
+        tarea.last_summary_json = json.dumps(resumen) if resumen is not None else None
+        tarea.last_error = str(error) if error is not None else None
+        db.session.commit()
+        soltar_liderazgo(TAREA_IMPORTACION, lider)
+
+    if error is not None:
+        raise error
+    return resumen
+
+
+def estado_sincronizacion():
+    """Estado de la tarea para la API. Requiere app context."""
+    tarea = ScheduledTask.query.filter_by(name=TAREA_IMPORTACION).first()
+    estado = {
+        "enabled": INTERVALO_MINUTOS > 0,
+        "interval_minutes": INTERVALO_MINUTOS,
+        "status": "idle",
+        "leader": None,
+        "lease_until": None,
+        "last_started_at": None,
+        "last_finished_at": None,
+        "last_duration_seconds": None,
+        "next_run_at": None,
+        "counts": None,
+        "last_error": None,
+    }
+    if tarea is None:
+        return estado
+
+    lease_vigente = tarea.lease_until is not None and tarea.lease_until >= datetime.utcnow()
+    estado.update(
+        status=tarea.status,
+        leader=tarea.leader if lease_vigente else None,
+        lease_until=tarea.lease_until.isoformat() if lease_vigente else None,
+        last_started_at=tarea.last_started_at.isoformat() if tarea.last_started_at else None,
+        last_finished_at=tarea.last_finished_at.isoformat() if tarea.last_finished_at else None,
+        last_duration_seconds=tarea.last_duration_seconds,
+        counts=json.loads(tarea.last_summary_json) if tarea.last_summary_json else None,
+        last_error=tarea.last_error,
+    )
+    if INTERVALO_MINUTOS > 0 and tarea.last_started_at is not None:
+        estado["next_run_at"] = (tarea.last_started_at + timedelta(minutes=INTERVALO_MINUTOS)).isoformat()
+    return estado
+
+
+def _bucle_sincronizacion(app):
+    lider = identificador()
+    while True:
+        try:
+            # Un solo programador; los demás procesos solo renuevan el intento
+            with app.app_context():
+                programador = tomar_liderazgo(TAREA_PROGRAMADOR, lider)
+            if programador:
+                sincronizar(app, lider)
+        except Exception as exc:
+            print("WARN: error en la sincronización con el FTP:", exc)
+        time.sleep(min(INTERVALO_SONDEO_SEGUNDOS, INTERVALO_MINUTOS * 60))
+
+
+def iniciar_sincronizacion(app):
+    """Arranca (una vez por proceso) el hilo de sincronización, si está configurado"""
+    global _iniciado
+
+    if INTERVALO_MINUTOS <= 0:
+        return
+
+    with _iniciado_lock:
+        if _iniciado:
+            return
+        _iniciado = True
+
+    hilo = threading.Thread(target=_bucle_sincronizacion, args=(app,), name="sincronizacion-ftp", daemon=True)
+    hilo.start()
+
+
+def main():
+    from app import app
+
+    resumen = sincronizar(app, lider=f"{identificador()}:cli", forzar=True)
+    if resumen is None:
+        print("Hay otra importación en curso (ver GET /api/sincronizacion); no se corrió.")
+        return
+    print(f"\nSincronización: {resumen['selected']} certificados procesados, {resumen['failed']} con error.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import importlib
+from pathlib import Path
+
+import pytest
+from flask import Flask
+
+from models import db
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App mínima con una base SQLite vacía, dentro de su app context"""
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'test.db'}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def aplicacion(tmp_path, monkeypatch):
+    """La app real sobre una base SQLite vacía, con las carpetas relativas en tmp_path"""
+    for carpeta in ("plantilla", "templates"):
+        (tmp_path / carpeta).symlink_to(RAIZ / carpeta)
+    (tmp_path / "generados").mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'app.db'}")
+    monkeypatch.setenv("CERT_OPTIMIZAR_PDF", "0")
+    # La base queda la del primer import (el módulo se importa una vez); se vacía en cada prueba
+    modulo = importlib.import_module("app")
+    with modulo.app.app_context():
+        modulo.db.drop_all()
+        modulo.db.create_all()
+        yield modulo
+        modulo.db.session.remove()
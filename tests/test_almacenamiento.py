@@ -0,0 +1,28 @@
+import pytest
+
+from almacenamiento import Almacenamiento, AlmacenamientoLocal
+
+
+def test_local_escribe_lee_e_informa(tmp_path):
+    almacen = AlmacenamientoLocal(tmp_path)
+
+    info = almacen.escribir("/carpeta/AAA111.pdf", b"%PDF-1.4")
+
+    assert info.tamano == 8
+    assert almacen.leer("/carpeta/AAA111.pdf") == b"%PDF-1.4"
+    assert almacen.info("/carpeta/BBB222.pdf") is None
+    almacen.escribir("/carpeta/AAA111.html", b"<html>")
+    assert sorted(almacen.listar("/carpeta")) == ["AAA111.html", "AAA111.pdf"]
+    assert list(almacen.listar_info("/carpeta", ".PDF")) == ["AAA111.pdf"]
+
+
+def test_local_no_sale_de_la_raiz(tmp_path):
+    almacen = AlmacenamientoLocal(tmp_path / "raiz")
+
+    with pytest.raises(ValueError):
+        almacen.escribir("/../fuera.txt", b"x")
+
+
+def test_interfaz_abstracta():
+    with pytest.raises(TypeError):
+        Almacenamiento()
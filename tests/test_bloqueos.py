@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+import bloqueos
+from bloqueos import bloqueo_certificado
+from certificado_pdf import llenar_certificado
+
+
+@pytest.fixture(autouse=True)
+def carpeta_bloqueos(tmp_path, monkeypatch):
+    monkeypatch.setattr(bloqueos, "CARPETA_BLOQUEOS", str(tmp_path / "bloqueos"))
+
+
+def test_el_estado_se_guarda_entre_bloqueos():
+    with bloqueo_certificado("ABC123") as bloqueo:
+        bloqueo.guardar(generado=200)
+
+    with bloqueo_certificado("ABC123") as bloqueo:
+        assert bloqueo.estado == {"generado": 200}
+        assert bloqueo.vigente(300, "generado", "publicado")
+        assert not bloqueo.vigente(100, "generado", "publicado")
+
+
+def test_reentrante_en_el_mismo_hilo():
+    with bloqueo_certificado("ABC123") as externo:
+        with bloqueo_certificado("ABC123", espera_maxima=0) as interno:
+            interno.guardar(publicado=5)
+        assert externo.estado == {"publicado": 5}
+
+
+def test_otro_hilo_espera_el_bloqueo():
+    errores = []
+
+    def intentar():
+        try:
+            with bloqueo_certificado("ABC123", espera_maxima=0.1):
+                pass
+        except TimeoutError as exc:
+            errores.append(exc)
+
+    with bloqueo_certificado("ABC123"):
+        hilo = threading.Thread(target=intentar)
+        hilo.start()
+        hilo.join()
+        # Otra clave no se bloquea
+        with bloqueo_certificado("XYZ987", espera_maxima=0):
+            pass
+
+    assert len(errores) == 1
+
+
+def test_una_peticion_vieja_no_pisa_a_la_nueva():
+    with bloqueo_certificado("ABC123") as bloqueo:
+        bloqueo.guardar(generado=200)
+
+    ruta, error, _ = llenar_certificado({"placa": "ABC123", "tipo_certificado": "nuevo"}, secuencia=100)
+
+    assert ruta is None and "más reciente" in error
+    with bloqueo_certificado("ABC123") as bloqueo:
+        assert bloqueo.estado == {"generado": 200}
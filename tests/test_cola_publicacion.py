@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import cola_publicacion
+from cola_publicacion import _reclamar_siguiente, encolar_publicacion, procesar_fila
+from models import PublishOutbox
+
+
+def encolar(modulo, clave, listo_en=0):
+    fila = encolar_publicacion(None, {"placa": clave}, f"generados/{clave}.pdf", clave)
+    fila.next_attempt_at = datetime.utcnow() + timedelta(seconds=listo_en)
+    modulo.db.session.commit()
+    return fila
+
+
+def test_reclamar_toma_cada_fila_una_vez(aplicacion):
+    lista = encolar(aplicacion, "AAA111")
+    encolar(aplicacion, "BBB222", listo_en=600)
+
+    fila = _reclamar_siguiente("t1")
+
+    assert (fila.id, fila.status, fila.locked_by, fila.attempts) == (lista.id, "running", "t1", 1)
+    # La otra todavía no está lista y la tomada no se vuelve a dar
+    assert _reclamar_siguiente("t2") is None
+
+
+def test_reclamar_retoma_una_fila_abandonada(aplicacion):
+    fila = encolar(aplicacion, "AAA111")
+    _reclamar_siguiente("caido")
+    fila.locked_at = datetime.utcnow() - timedelta(seconds=cola_publicacion.BLOQUEO_VENCIDO_SEGUNDOS + 1)
+    aplicacion.db.session.commit()
+
+    retomada = _reclamar_siguiente("t2")
+
+    assert (retomada.id, retomada.locked_by, retomada.attempts) == (fila.id, "t2", 2)
+
+
+@pytest.fixture
+def ftp_caido(aplicacion, monkeypatch):
+    monkeypatch.setattr(aplicacion, "publicar_certificado_web", lambda datos, pdf, secuencia=None: (False, "sin conexión"))
+
+
+def test_error_reintenta_con_backoff_y_despues_falla(aplicacion, ftp_caido, monkeypatch):
+    monkeypatch.setattr(cola_publicacion, "MAX_INTENTOS", 3)
+    encolar(aplicacion, "AAA111")
+
+    esperas = []
+    for _ in range(2):
+        fila = _reclamar_siguiente("t1")
+        antes = datetime.utcnow()
+        assert procesar_fila(fila) is False
+        assert (fila.status, fila.last_error, fila.locked_by) == ("pending", "sin conexión", None)
+        esperas.append(round((fila.next_attempt_at - antes).total_seconds()))
+        fila.next_attempt_at = antes  # adelantar el reloj
+        aplicacion.db.session.commit()
+
+    assert esperas == [cola_publicacion.BACKOFF_BASE_SEGUNDOS, cola_publicacion.BACKOFF_BASE_SEGUNDOS * 2]
+
+    procesar_fila(_reclamar_siguiente("t1"))
+    assert PublishOutbox.query.one().status == "failed"
@@ -0,0 +1,45 @@
+import hashlib
+import os
+from datetime import datetime
+
+import pytest
+
+import espejo_pdf
+from almacenamiento import InfoArchivo
+
+
+@pytest.fixture
+def espejo(tmp_path, monkeypatch):
+    monkeypatch.setattr(espejo_pdf, "CARPETA_ESPEJO", str(tmp_path / "espejo"))
+    monkeypatch.setattr(espejo_pdf, "TOPE_BYTES", 1_000_000)
+    return tmp_path / "espejo"
+
+
+def info(contenido, dia=1):
+    return InfoArchivo(len(contenido), datetime(2026, 1, dia))
+
+
+def test_guardar_y_buscar(espejo):
+    contenido = b"a" * 100
+    espejo_pdf.guardar("/v/AAA111.pdf", info(contenido), contenido)
+
+    assert espejo_pdf.buscar("/v/AAA111.pdf", info(contenido)) == contenido
+    # Otra fecha en el servidor es otra versión
+    assert espejo_pdf.buscar("/v/AAA111.pdf", info(contenido, dia=2)) is None
+    # Sin tamaño o fecha no hay clave confiable
+    assert espejo_pdf.buscar("/v/AAA111.pdf", InfoArchivo(100, None)) is None
+
+
+def test_podar_borra_los_menos_usados(espejo):
+    rutas = {}
+    for numero in range(4):
+        contenido = bytes([numero]) * 3_000
+        espejo_pdf.guardar(f"/v/P{numero}.pdf", info(contenido), contenido)
+        rutas[numero] = espejo_pdf._ruta_blob(hashlib.sha256(contenido).hexdigest())
+        os.utime(rutas[numero], (1_000 + numero, 1_000 + numero))
+
+    borrados, liberados = espejo_pdf.podar(tope=10_000)
+
+    # 12 000 bytes con tope 10 000: se baja al 90 % (9 000) borrando el más viejo
+    assert (borrados, liberados) == (1, 3_000)
+    assert [os.path.exists(rutas[numero]) for numero in range(4)] == [False, True, True, True]
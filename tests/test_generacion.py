@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+from models import GenerationAudit, User
+
+
+def usuario(modulo, nombre="op"):
+    user = User(username=nombre)
+    user.set_password("x")
+    modulo.db.session.add(user)
+    modulo.db.session.commit()
+    return user
+
+
+def generacion(modulo, usuario, status="success", segundos=0, **campos):
+    audit = GenerationAudit(
+        user_id=usuario.id,
+        plate="ABC123",
+        status=status,
+        created_at=datetime.utcnow() - timedelta(seconds=segundos),
+        **campos,
+    )
+    modulo.db.session.add(audit)
+    modulo.db.session.commit()
+    return audit
+
+
+def test_misma_llave_devuelve_la_generacion_anterior(aplicacion):
+    op = usuario(aplicacion)
+    previa = generacion(aplicacion, op, idempotency_key="k1", payload_hash="h1", segundos=3600)
+
+    # La llave vale sin importar la antigüedad ni los datos
+    assert aplicacion.buscar_generacion_previa(op.id, "k1", "otro") == previa
+    assert aplicacion.buscar_generacion_previa(usuario(aplicacion, "otro").id, "k1", "otro") is None
+
+
+def test_llave_con_error_no_bloquea_el_reintento(aplicacion):
+    op = usuario(aplicacion)
+    generacion(aplicacion, op, status="error", idempotency_key="k1", payload_hash="h1")
+
+    assert aplicacion.buscar_generacion_previa(op.id, "k1", "h1") is None
+
+
+def test_mismos_datos_dentro_de_la_ventana(aplicacion):
+    op = usuario(aplicacion)
+    ventana = aplicacion.VENTANA_DUPLICADOS_SEGUNDOS
+    reciente = generacion(aplicacion, op, payload_hash="h1", segundos=ventana // 2)
+    generacion(aplicacion, op, payload_hash="h2", segundos=ventana * 2)
+    en_curso = generacion(aplicacion, op, status="processing", payload_hash="h3")
+    generacion(aplicacion, op, status="processing", payload_hash="h4", segundos=aplicacion.VIGENCIA_EN_CURSO_SEGUNDOS * 2)
+
+    assert aplicacion.buscar_generacion_previa(op.id, None, "h1") == reciente
+    assert aplicacion.buscar_generacion_previa(op.id, None, "h2") is None
+    assert aplicacion.buscar_generacion_previa(op.id, None, "h3") == en_curso
+    # Una generación "processing" abandonada no bloquea el reenvío
+    assert aplicacion.buscar_generacion_previa(op.id, None, "h4") is None
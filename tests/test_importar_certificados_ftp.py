@@ -0,0 +1,192 @@
+from datetime import datetime
+
+from almacenamiento import AlmacenamientoLocal
+from ftp_config import FTP_BASE, FTP_VISOR
+from importar_certificados_ftp import (
+    ListingSnapshot,
+    RemoteCertificate,
+    discover_certificates,
+    is_unchanged,
+    open_run,
+    record_checkpoints,
+    take_listing_snapshot,
+    write_chunk,
+)
+from models import CertificateRecord, ImportCheckpoint, ImportRun, ImportWatermark, Party, VehicleProfile, db
+
+
+def remoto(clave, size=None, modified=None):
+    return RemoteCertificate(
+        certificate_key=clave,
+        plate=clave,
+        certificate_type="nuevo",
+        pdf_filename=f"{clave}.pdf",
+        viewer_html_filename=f"{clave}.html",
+        index_html_filename=f"index{clave}.html",
+        pdf_size=size,
+        pdf_modified=modified,
+    )
+
+
+def test_corrida_cortada_se_retoma_sin_lo_hecho(app):
+    run, keys = open_run({"limit": None})
+    assert keys == set()
+    positions = {"AAA111": 0, "BBB222": 1, "CCC333": 2}
+    record_checkpoints(run, [(remoto("AAA111"), None), (remoto("BBB222"), ValueError("PDF roto"))], positions)
+
+    retomada, hechas = open_run({"limit": None})
+
+    assert retomada.id == run.id
+    assert hechas == {"AAA111"}
+
+
+def test_checkpoint_se_actualiza(app):
+    run, _ = open_run({})
+    record_checkpoints(run, [(remoto("AAA111"), ValueError("PDF roto"))], {"AAA111": 4})
+    record_checkpoints(run, [(remoto("AAA111"), None)], {"AAA111": 4})
+
+    checkpoint = ImportCheckpoint.query.filter_by(run_id=run.id).one()
+    assert (checkpoint.status, checkpoint.error, checkpoint.position) == ("done", None, 4)
+
+
+def test_fresh_abandona_la_corrida_pendiente(app):
+    run, _ = open_run({})
+    record_checkpoints(run, [(remoto("AAA111"), None)], {})
+
+    nueva, hechas = open_run({}, fresh=True)
+
+    assert nueva.id != run.id
+    assert hechas == set()
+    assert db.session.get(ImportRun, run.id).status == "abandoned"
+
+
+def test_retry_failed_reabre_la_ultima_con_sus_fallidas(app):
+    assert open_run({}, retry_failed=True) == (None, set())
+
+    run, _ = open_run({})
+    record_checkpoints(run, [(remoto("AAA111"), None), (remoto("BBB222"), ValueError("PDF roto"))], {})
+    run.status = "done"
+
+    reabierta, fallidas = open_run({}, retry_failed=True)
+
+    assert reabierta.id == run.id
+    assert reabierta.status == "running"
+    assert fallidas == {"BBB222"}
+
+
+def test_is_unchanged():
+    fecha = datetime(2026, 1, 2, 3, 4, 5)
+    marca = ImportWatermark(remote_path="/x/AAA111.pdf", size_bytes=100, remote_modified_at=fecha)
+
+    assert is_unchanged(remoto("AAA111", 100, fecha), marca)
+    assert not is_unchanged(remoto("AAA111", 101, fecha), marca)
+    assert not is_unchanged(remoto("AAA111", 100, datetime(2026, 1, 3)), marca)
+    # Sin fecha del servidor alcanza el tamaño; sin tamaño no hay cómo saberlo
+    assert is_unchanged(remoto("AAA111", 100), marca)
+    assert not is_unchanged(remoto("AAA111"), marca)
+    assert not is_unchanged(remoto("AAA111", 100, fecha), None)
+
+
+def test_pipeline_detenido_no_deja_hilos_colgados(tmp_path, monkeypatch):
+    import threading
+    import time
+
+    import importar_certificados_ftp
+
+    class AlmacenLento:
+        def cerrar(self):
+            pass
+
+    def descarga_lenta(storage, remote_path, destination, info=None):
+        time.sleep(0.2)
+        destination.write_bytes(b"%PDF")
+
+    monkeypatch.setattr(importar_certificados_ftp, "abrir_almacenamiento", AlmacenLento)
+    monkeypatch.setattr(importar_certificados_ftp, "download_remote_file", descarga_lenta)
+
+    pipeline = importar_certificados_ftp.parse_in_pipeline([remoto(f"P{numero}") for numero in range(8)], tmp_path, 2)
+    next(pipeline)  # el primero llega (con error de parseo o no) y se corta
+    pipeline.close()
+
+    limite = time.monotonic() + 5
+    while time.monotonic() < limite and any(hilo.name.startswith("import-") for hilo in threading.enumerate()):
+        time.sleep(0.1)
+    assert not [hilo.name for hilo in threading.enumerate() if hilo.name.startswith("import-")]
+
+
+class AlmacenContado(AlmacenamientoLocal):
+    def __init__(self, raiz):
+        super().__init__(raiz)
+        self.listados = []
+
+    def listar(self, carpeta):
+        self.listados.append(("listar", carpeta))
+        return super().listar(carpeta)
+
+    def listar_info(self, carpeta, extension=""):
+        self.listados.append(("listar_info", carpeta))
+        return super().listar_info(carpeta, extension)
+
+
+def almacen_con_certificado(tmp_path):
+    almacen = AlmacenContado(str(tmp_path))
+    almacen.escribir(f"{FTP_BASE}/indexAAA111.html", b"<html>")
+    almacen.escribir(f"{FTP_VISOR}/AAA111.html", b"<html>")
+    almacen.escribir(f"{FTP_VISOR}/AAA111.pdf", b"%PDF")
+    almacen.listados.clear()
+    return almacen
+
+
+def test_listado_completo_no_pide_tamanos(tmp_path):
+    almacen = almacen_con_certificado(tmp_path)
+
+    snapshot = take_listing_snapshot(almacen)
+
+    assert ("listar_info", FTP_VISOR) not in almacen.listados
+    assert almacen.listados.count(("listar", FTP_VISOR)) == 1
+    [remote] = discover_certificates(snapshot)
+    assert (remote.certificate_key, remote.pdf_size) == ("AAA111", None)
+
+
+def test_listado_incremental_lista_el_visor_una_vez(tmp_path):
+    almacen = almacen_con_certificado(tmp_path)
+
+    snapshot = take_listing_snapshot(almacen, with_info=True)
+
+    assert [llamada for llamada in almacen.listados if llamada[1] == FTP_VISOR] == [("listar_info", FTP_VISOR)]
+    assert snapshot.visor_files == {"AAA111.html", "AAA111.pdf"}
+    [remote] = discover_certificates(snapshot)
+    assert remote.pdf_size == 4
+
+
+def certificado(placa, persona, nit="", color="BLANCO"):
+    return remoto(placa), {"placa": placa, "persona": persona, "nit": nit, "color": color, "page_texts": []}
+
+
+def snapshot_de(*claves):
+    return ListingSnapshot(
+        taken_at=datetime(2026, 1, 1),
+        root_files=frozenset(f"index{clave}.html" for clave in claves),
+        visor_files=frozenset(f"{clave}.html" for clave in claves),
+        pdf_info={},
+    )
+
+
+def test_write_chunk_actualiza_en_lugar_de_duplicar(app):
+    snapshot = snapshot_de("AAA111", "BBB222", "CCC333")
+    lote = [
+        certificado("AAA111", "ACME SAS", nit="900123"),
+        certificado("BBB222", "Juan Pérez"),
+        certificado("CCC333", "Juan Pérez"),
+    ]
+    write_chunk(snapshot, lote)
+    write_chunk(snapshot, [certificado("AAA111", "ACME S.A.S.", nit="900123", color="ROJO"), *lote[1:]])
+
+    assert CertificateRecord.query.count() == 3
+    assert VehicleProfile.query.filter_by(plate="AAA111").one().color == "ROJO"
+    assert Party.query.filter_by(document_number="900123").one().name == "ACME S.A.S."
+    # Sin documento se reconoce por el nombre: ni dentro del lote ni entre lotes se duplica
+    [juan] = Party.query.filter_by(document_number=None).all()
+    assert {record.party_id for record in CertificateRecord.query.filter(CertificateRecord.plate != "AAA111")} == {
+        juan.id
+    }
@@ -0,0 +1,54 @@
+import json
+
+from sqlalchemy import text
+
+from migraciones import _compactar_textos_certificados
+from models import CertificatePayload, CertificateRecord, db
+
+
+def registro_viejo(clave, con_page_text=True):
+    """Fila como las guardaba el importador antes de certificate_payloads"""
+    extraido = {
+        "parsed": {"placa": clave},
+        "page_texts": ["Página 1", "Página 2"],
+        "raw_form_fields": {"placa": clave},
+        "full_text": "Página 1\nPágina 2",
+    }
+    db.session.execute(
+        text(
+            "INSERT INTO certificate_records (certificate_key, plate, certificate_type, extracted_json, "
+            "source_status, imported_at) VALUES (:clave, :clave, 'nuevo', :extraido, 'imported', CURRENT_TIMESTAMP)"
+        ),
+        {"clave": clave, "extraido": json.dumps(extraido, indent=2)},
+    )
+    if con_page_text:
+        db.session.execute(
+            text("UPDATE certificate_records SET page_text = 'Página 1\nPágina 2' WHERE certificate_key = :clave"),
+            {"clave": clave},
+        )
+    db.session.commit()
+
+
+def test_compactar_mueve_los_textos_a_payloads(app):
+    db.session.execute(text("ALTER TABLE certificate_records ADD COLUMN page_text TEXT"))
+    registro_viejo("AAA111")
+    registro_viejo("BBB222")
+
+    assert _compactar_textos_certificados() == 2
+
+    record = CertificateRecord.query.filter_by(certificate_key="AAA111").one()
+    assert json.loads(record.extracted_json) == {"parsed": {"placa": "AAA111"}}
+    assert db.session.execute(text("SELECT COUNT(*) FROM certificate_records WHERE page_text IS NOT NULL")).scalar() == 0
+    payload = CertificatePayload.query.filter_by(record_id=record.id).one()
+    contenido = payload.contenido()
+    assert contenido["page_texts"] == ["Página 1", "Página 2"]
+    assert contenido["raw_form_fields"] == {"placa": "AAA111"}
+    # Ya convertidas: una segunda pasada no encuentra nada
+    assert _compactar_textos_certificados() == 0
+
+
+def test_compactar_sin_columna_page_text(app):
+    registro_viejo("AAA111", con_page_text=False)
+
+    assert _compactar_textos_certificados() == 1
+    assert CertificatePayload.query.count() == 1
@@ -0,0 +1,34 @@
+from datetime import date
+
+import pytest
+
+from models import CertificateRecord, leer_fecha
+
+
+@pytest.mark.parametrize(
+    "texto, esperada",
+    [
+        ("2026-07-21", date(2026, 7, 21)),
+        ("2026/7/1", date(2026, 7, 1)),
+        ("21/07/2026", date(2026, 7, 21)),
+        ("1-7-2026", date(2026, 7, 1)),
+        ("Itagüí, 21 de julio de 2026", date(2026, 7, 21)),
+        ("3 de Setiembre del 2025", date(2025, 9, 3)),
+    ],
+)
+def test_leer_fecha_formatos(texto, esperada):
+    assert leer_fecha(texto) == esperada
+
+
+@pytest.mark.parametrize("texto", ["", None, "sin fecha", "31/02/2026", "21 de brumario de 2026"])
+def test_leer_fecha_invalida(texto):
+    assert leer_fecha(texto) is None
+
+
+def test_asignar_fechas_no_pisa_con_vacias():
+    record = CertificateRecord(certificate_key="ABC123", plate="ABC123")
+    record.asignar_fechas("2026-01-20", "20/01/2027")
+    record.asignar_fechas("", None)
+
+    assert (record.inspection_date, record.inspected_on) == ("2026-01-20", date(2026, 1, 20))
+    assert (record.expiration_date, record.expires_on) == ("20/01/2027", date(2027, 1, 20))
@@ -0,0 +1,71 @@
+import json
+import os
+from datetime import date, timedelta
+
+
+def registro_importado(modulo, hoy):
+    from models import CertificateRecord, VehicleProfile
+
+    parsed = {
+        "placa": "ABC123",
+        "marca": "CHEVROLET",
+        "persona": "ACME SAS",
+        "nit": "900123",
+        "capacidad": "7,0   TONELADAS",
+        "tipo_transporte": "CARNICOS",
+        # Texto del PDF importado, no las opciones del formulario
+        "sistema_refrigeracion": "Sí",
+        "clase_vehiculo": "Camión",
+    }
+    vehiculo = VehicleProfile(plate="ABC123")
+    record = CertificateRecord(
+        certificate_key="ABC123",
+        plate="ABC123",
+        certificate_type="nuevo",
+        vehicle=vehiculo,
+        inspection_date=(hoy - timedelta(days=360)).isoformat(),
+        expiration_date=(hoy + timedelta(days=5)).isoformat(),
+        inspected_on=hoy - timedelta(days=360),
+        expires_on=hoy + timedelta(days=5),
+        extracted_json=json.dumps({"parsed": parsed}),
+    )
+    modulo.db.session.add_all([vehiculo, record])
+    modulo.db.session.commit()
+
+
+def formulario_desde(datos):
+    """Lo que envía el navegador después de cargar los datos del borrador"""
+    return {clave: ("true" if valor else "false") if isinstance(valor, bool) else valor for clave, valor in datos.items()}
+
+
+def test_generar_con_borrador_sin_cambios_lo_consume(aplicacion):
+    from renovaciones import buscar_borrador, preparar_borradores
+
+    hoy = date.today()
+    registro_importado(aplicacion, hoy)
+    resumen = preparar_borradores(hoy=hoy)
+    assert resumen["creados"] == 1, resumen
+
+    borrador = buscar_borrador("ABC123")
+    assert (borrador["datos"]["sistema_refrigeracion"], borrador["datos"]["clase_vehiculo"]) == ("SI", "CAMION")
+    assert borrador["datos"]["capacidad"] == "7.0 TONELADAS"
+
+    datos = aplicacion.datos_desde_formulario(formulario_desde(borrador["datos"]))
+    ruta, error, _ = aplicacion.generar_certificado(datos, publicar=False)
+
+    assert error is None
+    assert ruta == os.path.join("generados", "ABC123remo.pdf") and os.path.exists(ruta)
+    assert buscar_borrador("ABC123") is None
+
+
+def test_borradores_de_dias_anteriores_se_descartan(aplicacion):
+    from renovaciones import leer_borrador, preparar_borradores
+
+    ayer = date.today() - timedelta(days=1)
+    registro_importado(aplicacion, ayer)
+    assert preparar_borradores(hoy=ayer)["creados"] == 1
+
+    resumen = preparar_borradores(hoy=date.today())
+
+    assert (resumen["eliminados"], resumen["creados"]) == (1, 1)
+    assert leer_borrador("ABC123")["fecha"] == date.today().isoformat()
@@ -0,0 +1,54 @@
+import pikepdf
+
+from salida_pdf import postprocesar_pdf, verificar_linealizado
+
+
+def pdf_de_prueba(ruta, paginas=3, identificador=b"0" * 16):
+    """PDF sin comprimir con la misma fuente repetida en cada página, como la plantilla"""
+    pdf = pikepdf.new()
+    for numero in range(paginas):
+        fuente = pdf.make_indirect(
+            pikepdf.Dictionary(Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1, BaseFont=pikepdf.Name.Helvetica)
+        )
+        contenido = pikepdf.Stream(pdf, b"BT /F1 12 Tf 72 720 Td (Certificado) Tj ET\n" * 50)
+        pdf.add_blank_page(page_size=(612, 792))
+        pagina = pdf.pages[numero]
+        pagina.Resources = pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=fuente))
+        pagina.Contents = pdf.make_indirect(contenido)
+    pdf.trailer.ID = pikepdf.Array([pikepdf.String(identificador)] * 2)
+    pdf.save(ruta, compress_streams=False, static_id=True)
+    return ruta
+
+
+def test_linealizar(tmp_path):
+    ruta = str(pdf_de_prueba(tmp_path / "cert.pdf"))
+
+    postprocesar_pdf(ruta, optimizar=False, linealizar=True)
+
+    assert verificar_linealizado(ruta) == (True, "")
+
+
+def test_optimizar_unifica_fuentes_y_achica(tmp_path):
+    ruta = str(pdf_de_prueba(tmp_path / "cert.pdf"))
+
+    salida = postprocesar_pdf(ruta, optimizar=True)
+
+    assert salida["objetos_unificados"] == 4  # 2 fuentes y 2 streams de contenido repetidos
+    assert salida["tamano_despues"] < salida["tamano_antes"]
+    with pikepdf.open(ruta) as pdf:
+        fuentes = {pagina.Resources.Font.F1.objgen for pagina in pdf.pages}
+    assert len(fuentes) == 1
+
+
+def test_determinista_sin_optimizar_ni_linealizar(tmp_path):
+    # Mismo contenido con distinto /ID, como dos salidas de pypdf en distinto momento
+    primero = str(pdf_de_prueba(tmp_path / "primero.pdf", identificador=b"1" * 16))
+    segundo = str(pdf_de_prueba(tmp_path / "segundo.pdf", identificador=b"2" * 16))
+    with open(primero, "rb") as a, open(segundo, "rb") as b:
+        assert a.read() != b.read()
+
+    for ruta in (primero, segundo):
+        postprocesar_pdf(ruta, optimizar=False, linealizar=False, determinista=True)
+
+    with open(primero, "rb") as a, open(segundo, "rb") as b:
+        assert a.read() == b.read()
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import ScheduledTask, db
+from sincronizacion import TAREA_IMPORTACION, sincronizar, soltar_liderazgo, tomar_liderazgo, toca_correr
+
+TAREA = "prueba"
+
+
+def vencer_lease():
+    ScheduledTask.query.filter_by(name=TAREA).update({"lease_until": datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+
+def test_un_solo_lider_mientras_el_lease_esta_vigente(app):
+    assert tomar_liderazgo(TAREA, "host:1")
+    assert not tomar_liderazgo(TAREA, "host:2")
+    # El líder renueva su propio lease
+    assert tomar_liderazgo(TAREA, "host:1")
+    assert ScheduledTask.query.filter_by(name=TAREA).one().leader == "host:1"
+
+
+def test_otro_toma_el_lease_vencido(app):
+    assert tomar_liderazgo(TAREA, "host:1")
+    vencer_lease()
+
+    assert tomar_liderazgo(TAREA, "host:2")
+    assert not tomar_liderazgo(TAREA, "host:1")
+
+
+def test_soltar_liderazgo(app):
+    assert tomar_liderazgo(TAREA, "host:1")
+    # Solo lo suelta quien lo tiene
+    soltar_liderazgo(TAREA, "host:2")
+    assert not tomar_liderazgo(TAREA, "host:2")
+
+    soltar_liderazgo(TAREA, "host:1")
+    assert tomar_liderazgo(TAREA, "host:2")
+
+
+def test_toca_correr():
+    ahora = datetime(2026, 1, 1, 12, 0)
+    assert toca_correr(ScheduledTask(name=TAREA), 60, ahora)
+    assert not toca_correr(ScheduledTask(name=TAREA, last_started_at=ahora - timedelta(minutes=30)), 60, ahora)
+    assert toca_correr(ScheduledTask(name=TAREA, last_started_at=ahora - timedelta(minutes=60)), 60, ahora)
+
+
+def test_sincronizar_sin_corrida_pendiente_no_toma_el_lease(app, monkeypatch):
+    import importar_certificados_ftp
+
+    monkeypatch.setattr(importar_certificados_ftp, "run_import", lambda **opciones: pytest.fail("no tocaba"))
+    db.session.add(ScheduledTask(name=TAREA_IMPORTACION, last_started_at=datetime.utcnow()))
+    db.session.commit()
+
+    assert sincronizar(app, "host:1", intervalo_minutos=60) is None
+    assert tomar_liderazgo(TAREA_IMPORTACION, "host:2:cli")
+
+
+def test_sincronizar_suelta_el_lease_al_terminar(app, monkeypatch):
+    import importar_certificados_ftp
+
+    corridas = []
+
+    def run_import(**opciones):
+        corridas.append(ScheduledTask.query.filter_by(name=TAREA_IMPORTACION).one().leader)
+        return {"selected": 0, "failed": 0}
+
+    monkeypatch.setattr(importar_certificados_ftp, "run_import", run_import)
+
+    assert sincronizar(app, "host:1", intervalo_minutos=60) == {"selected": 0, "failed": 0}
+    assert corridas == ["host:1"]
+    tarea = ScheduledTask.query.filter_by(name=TAREA_IMPORTACION).one()
+    assert (tarea.status, tarea.leader) == ("done", None)
+    # Otra importación (la de consola) ya puede correr
+    assert tomar_liderazgo(TAREA_IMPORTACION, "host:2:cli")
+    # ... y mientras tanto el programador no la pisa
+    assert sincronizar(app, "host:1", forzar=True) is None